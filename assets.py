@@ -0,0 +1,147 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from flask import Request, Response, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/xml", "image/svg+xml",
+                      "image/x-icon", "image/vnd.microsoft.icon")
+MAX_IN_MEMORY_BYTES = 1024 * 1024  # larger files are indexed but their bodies stay on disk
+MIN_COMPRESS_BYTES = 1024
+
+
+@dataclass
+class Asset:
+    path: str
+    mimetype: str
+    etag: str
+    mtime: float
+    modified: datetime  # mtime at HTTP date precision
+    fingerprinted: bool
+    body: bytes | None
+    # Content-Encoding -> precompressed body
+    encodings: dict[str, bytes] = field(default_factory=dict)
+
+
+class AssetIndex:
+    """In-memory index of the static tree built once at startup: content hashes for ETags, modification
+    times, and bodies precompressed with brotli (when installed) and gzip. Requests are answered from memory,
+    including conditional ones, without a filesystem call. Files named in the Vite manifest are fingerprinted
+    and get immutable caching"""
+
+    def __init__(self, root: str, exclude: tuple[str, ...] = (), manifests: tuple[str, ...] = ()):
+        self.root = root
+        self.exclude = tuple(os.path.normpath(path) for path in exclude)
+        self.manifests = manifests
+        # Checks files for changes on every lookup, for development
+        self.watch = False
+        self.assets: dict[str, Asset] = {}
+        self.reload()
+
+    def reload(self):
+        fingerprinted = self._fingerprinted_files()
+        assets = {}
+        for folder, dirs, files in os.walk(self.root):
+            relative_folder = os.path.relpath(folder, self.root)
+            dirs[:] = [name for name in dirs if not name.startswith(".")
+                       and os.path.normpath(os.path.join(relative_folder, name)) not in self.exclude]
+            for name in files:
+                if name.startswith(".") or name.endswith((".gz", ".br")):
+                    continue
+                relative_path = os.path.normpath(os.path.join(relative_folder, name)).replace(os.sep, "/")
+                assets[relative_path] = self._load(relative_path, relative_path in fingerprinted)
+        self.assets = assets
+
+    def get(self, relative_path: str) -> Asset | None:
+        asset = self.assets.get(relative_path)
+        if asset and self.watch:
+            try:
+                changed = os.path.getmtime(asset.path) != asset.mtime
+            except OSError:
+                self.assets.pop(relative_path, None)
+                return None
+            if changed:
+                asset = self.assets[relative_path] = self._load(relative_path, asset.fingerprinted)
+        return asset
+
+    def respond(self, asset: Asset, request: Request, immutable: bool = False) -> Response:
+        """Serves the asset in the best encoding the client accepts, or a 304 if its copy is current"""
+
+        encoding = next((name for name in asset.encodings if request.accept_encodings[name]), None)
+        # Each encoding is a different representation, so it needs its own ETag
+        etag = f"{asset.etag}-{encoding}" if encoding else asset.etag
+        headers = {
+            "Cache-Control": IMMUTABLE if asset.fingerprinted or immutable else "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            not_modified = request.if_modified_since is not None and request.if_modified_since >= asset.modified
+        if asset.body is None:
+            response = send_file(asset.path, mimetype=asset.mimetype, etag=etag, last_modified=asset.modified,
+                                 conditional=True)
+        elif not_modified:
+            response = Response(status=304)
+        else:
+            response = Response(asset.encodings[encoding] if encoding else asset.body, mimetype=asset.mimetype)
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+        response.last_modified = asset.modified
+        response.headers.update(headers)
+        return response
+
+    def _load(self, relative_path: str, fingerprinted: bool) -> Asset:
+        path = os.path.join(self.root, relative_path)
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        mtime = os.path.getmtime(path)
+        modified = datetime.fromtimestamp(int(mtime), timezone.utc)
+        size = os.path.getsize(path)
+        if size > MAX_IN_MEMORY_BYTES:
+            with open(path, "rb") as file:
+                digest = hashlib.file_digest(file, "sha256").hexdigest()
+            return Asset(path, mimetype, digest[:16], mtime, modified, fingerprinted, None)
+
+        with open(path, "rb") as file:
+            body = file.read()
+        asset = Asset(path, mimetype, hashlib.sha256(body).hexdigest()[:16], mtime, modified, fingerprinted, body)
+        if size >= MIN_COMPRESS_BYTES and mimetype.startswith(COMPRESSIBLE_TYPES):
+            # Prefer variants written by the build, otherwise compress now, once
+            for encoding, extension, compress in (("br", ".br", brotli.compress if brotli else None),
+                                                  ("gzip", ".gz", lambda data: gzip.compress(data, 9, mtime=0))):
+                if os.path.exists(path + extension):
+                    with open(path + extension, "rb") as file:
+                        asset.encodings[encoding] = file.read()
+                elif compress:
+                    compressed = compress(body)
+                    if len(compressed) < size:
+                        asset.encodings[encoding] = compressed
+        return asset
+
+    def _fingerprinted_files(self) -> set[str]:
+        """Files listed in Vite manifests, which carry a content hash in their names"""
+
+        files = set()
+        for manifest_path in self.manifests:
+            base = os.path.relpath(os.path.dirname(os.path.dirname(manifest_path)), self.root).replace(os.sep, "/")
+            try:
+                with open(manifest_path) as file:
+                    manifest = json.load(file)
+            except FileNotFoundError:
+                continue
+            for chunk in manifest.values():
+                for name in [chunk.get("file"), *chunk.get("css", []), *chunk.get("assets", [])]:
+                    if name:
+                        files.add(f"{base}/{name}")
+        return files
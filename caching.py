@@ -0,0 +1,184 @@
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import closing
+from threading import Lock
+from typing import Callable, Protocol
+
+
+class LRUCache:
+    """Thread-safe in-process cache that evicts the least recently used entry past max_entries,
+    and treats entries older than ttl seconds (if given) as missing. Keeps hit/miss counters"""
+
+    def __init__(self, max_entries: int, ttl: float | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and (self.ttl is None or time.monotonic() - entry[1] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+    def delete_prefix(self, prefix: str) -> int:
+        """Deletes every entry whose key is a string starting with prefix, returns how many"""
+
+        with self._lock:
+            keys = [key for key in self._entries if isinstance(key, str) and key.startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+
+class SQLiteCache:
+    """String cache in an SQLite file, shared by every worker process on the host. Entries older than ttl
+    seconds (if given) count as missing, and the oldest written are dropped past max_entries. Hit/miss
+    counters are per process"""
+
+    def __init__(self, path: str, max_entries: int, ttl: float | None = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_stored_at ON entries (stored_at)")
+
+    def get(self, key: str) -> str | None:
+        with closing(self._connect()) as conn:
+            entry = conn.execute("SELECT value, stored_at FROM entries WHERE key = ?", (key,)).fetchone()
+        hit = entry is not None and (self.ttl is None or time.time() - entry[1] < self.ttl)
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry[0] if hit else None
+
+    def set(self, key: str, value: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO entries (key, value, stored_at) VALUES (?, ?, ?)",
+                         (key, value, time.time()))
+            conn.execute("DELETE FROM entries WHERE key IN "
+                         "(SELECT key FROM entries ORDER BY stored_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def delete(self, key: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix: str) -> int:
+        with closing(self._connect()) as conn, conn:
+            # A range instead of LIKE, which would treat _ and % in the prefix as wildcards
+            return conn.execute("DELETE FROM entries WHERE key >= ? AND key < ?",
+                                (prefix, prefix + "\U0010ffff")).rowcount
+
+    def clear(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM entries")
+
+    def stats(self) -> dict:
+        with closing(self._connect()) as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+
+class CacheBackend(Protocol):
+    def get(self, key: str) -> str | None: ...
+    def set(self, key: str, value: str): ...
+    def delete_prefix(self, prefix: str) -> int: ...
+    def stats(self) -> dict: ...
+
+
+class FragmentCache:
+    """Rendered HTML fragments of one object (e.g. a recipe card), keyed by the object's id and version. A change
+    bumps the version, so every worker stops looking up the old fragments and the backend ages them out.
+    invalidate() drops all of an object's fragments right away, for deletes. Bump namespace when a fragment's
+    template changes"""
+
+    def __init__(self, backend: CacheBackend, namespace: str):
+        self.backend = backend
+        self.namespace = namespace
+        self.stats_by_fragment: dict[str, dict[str, int]] = {}
+        self.invalidated = 0
+        self._stats_lock = Lock()
+
+    def render(self, name: str, object_id: int, version: int, render: Callable[[], str], variant: str = "") -> str:
+        """Returns the cached fragment, or calls render() and caches what it returns. variant tells apart
+        renderings of the same object version, and must be all that render() depends on besides the object"""
+
+        key = f"{self.namespace}:{object_id}:{version}:{name}:{variant}"
+        fragment = self.backend.get(key)
+        self._count(name, "hits" if fragment is not None else "misses")
+        if fragment is None:
+            fragment = render()
+            self.backend.set(key, fragment)
+        return fragment
+
+    def invalidate(self, object_id: int):
+        removed = self.backend.delete_prefix(f"{self.namespace}:{object_id}:")
+        with self._stats_lock:
+            self.invalidated += removed
+
+    def stats(self) -> dict:
+        backend_stats = self.backend.stats()
+        with self._stats_lock:
+            return {
+                **backend_stats,
+                "invalidated": self.invalidated,
+                "fragments": {name: dict(counts) for name, counts in self.stats_by_fragment.items()},
+            }
+
+    def _count(self, name: str, stat: str):
+        with self._stats_lock:
+            counts = self.stats_by_fragment.setdefault(name, {"hits": 0, "misses": 0})
+            counts[stat] += 1
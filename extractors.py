@@ -0,0 +1,268 @@
+import html
+import json
+import re
+from typing import Callable
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+
+class ExtractionError(Exception):
+    """Raised when no recipe could be extracted from a page"""
+
+
+# Site (as split from the URL, i.e. "allrecipes") -> fallback extractor used when the page's JSON-LD is missing
+# or incomplete. Sites registered with None rely on JSON-LD alone
+SITE_EXTRACTORS: dict[str, Callable[[str], dict] | None] = {
+    "simplyrecipes": None,
+    "seriouseats": None,
+    "foodnetwork": None,
+    "bonappetit": None,
+    "epicurious": None,
+}
+
+# Recipe columns a scraped recipe can't be saved without
+REQUIRED_FIELDS = ("title", "ingredients", "instructions", "default_servings")
+
+JSON_LD_PATTERN = re.compile(
+    r"<script[^>]*type=[\"']application/ld\+json[\"'][^>]*>(.*?)</script>", re.IGNORECASE | re.DOTALL
+)
+ISO_DURATION_PATTERN = re.compile(r"P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?")
+QUANTITY_PATTERN = re.compile(r"^((?:\d+(?:[.,/]\d+)?|[¼½¾⅓⅔⅛⅜⅝⅞])(?:\s*(?:-|to\b)\s*)?(?:\s*(?:\d+(?:[./]\d+)?|[¼½¾⅓⅔⅛⅜⅝⅞]))*)\s*")
+UNITS = {
+    "cup", "cups", "c", "tablespoon", "tablespoons", "tbsp", "tbs", "teaspoon", "teaspoons", "tsp",
+    "pound", "pounds", "lb", "lbs", "ounce", "ounces", "oz", "fluid ounce", "fluid ounces", "fl oz",
+    "gram", "grams", "g", "kilogram", "kilograms", "kg", "milliliter", "milliliters", "ml", "liter", "liters", "l",
+    "quart", "quarts", "qt", "pint", "pints", "pt", "gallon", "gallons", "clove", "cloves", "pinch", "pinches",
+    "dash", "dashes", "can", "cans", "package", "packages", "stick", "sticks", "slice", "slices", "sprig", "sprigs",
+    "bunch", "bunches", "head", "heads", "large", "medium", "small",
+}
+
+
+def register_extractor(site: str):
+    """Registers a function as the fallback extractor for a site, for pages without usable JSON-LD"""
+
+    def decorator(extractor: Callable[[str], dict]):
+        SITE_EXTRACTORS[site] = extractor
+        return extractor
+    return decorator
+
+
+def extract_recipe(site: str, page_html: str) -> dict:
+    """Extracts Recipe column values from a page. Tries the schema.org Recipe JSON-LD first, which only needs
+    a regex over the page instead of a full DOM, then falls back to the site's own extractor"""
+
+    if site not in SITE_EXTRACTORS:
+        raise ExtractionError(f"Functionality for {site} has not been integrated yet")
+
+    recipe = recipe_from_json_ld(page_html)
+    if recipe and all(recipe.get(field) for field in REQUIRED_FIELDS):
+        return recipe
+
+    fallback = SITE_EXTRACTORS[site]
+    if not fallback:
+        raise ExtractionError(f"Couldn't find a recipe on that {site} page")
+    try:
+        recipe = fallback(page_html)
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        raise ExtractionError(f"Couldn't find a recipe on that {site} page") from e
+    missing = [field for field in REQUIRED_FIELDS if not recipe.get(field)]
+    if missing:
+        raise ExtractionError(f"Couldn't find the {', '.join(missing)} on that {site} page")
+    return recipe
+
+
+def recipe_from_json_ld(page_html: str) -> dict | None:
+    """Finds the schema.org Recipe object in a page's JSON-LD blocks and maps it to Recipe column values"""
+
+    for block in JSON_LD_PATTERN.findall(page_html):
+        try:
+            data = json.loads(block, strict=False)
+        except json.JSONDecodeError:
+            continue
+        recipe = find_recipe_node(data)
+        if recipe:
+            return {
+                "title": clean_text(recipe.get("name")),
+                "description": clean_text(recipe.get("description")),
+                "ingredients": [split_ingredient_line(line)
+                                for line in map(clean_text, text_list(recipe.get("recipeIngredient"))) if line],
+                "instructions": instructions_markup(recipe.get("recipeInstructions")),
+                "default_servings": servings_from_yield(recipe.get("recipeYield")),
+                "time_to_cook": duration_to_text(recipe.get("totalTime")),
+                "image_url": first_image_url(recipe.get("image")),
+            }
+    return None
+
+
+def find_recipe_node(data) -> dict | None:
+    """Walks JSON-LD (single objects, lists and @graph containers) for the first node typed Recipe"""
+
+    if isinstance(data, list):
+        for item in data:
+            recipe = find_recipe_node(item)
+            if recipe:
+                return recipe
+    elif isinstance(data, dict):
+        node_type = data.get("@type")
+        if node_type == "Recipe" or (isinstance(node_type, list) and "Recipe" in node_type):
+            return data
+        if "@graph" in data:
+            return find_recipe_node(data["@graph"])
+    return None
+
+
+def clean_text(value) -> str:
+    """Strips the markup from a JSON-LD text value. Anything but a string (a list of names, an object where
+    text was expected) counts as missing, since there's no telling which part of it is the text"""
+
+    if not isinstance(value, str):
+        return ""
+    return html.unescape(re.sub(r"<[^>]+>", "", value)).strip()
+
+
+def text_list(value) -> list[str]:
+    """A JSON-LD value that should be a list of strings, as one, dropping anything else"""
+
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list):
+        return []
+    return [item for item in value if isinstance(item, str)]
+
+
+def split_ingredient_line(line: str) -> dict:
+    """Splits "2 cups all-purpose flour" into the amount/unit/ingredient dict that scraped recipes are saved as"""
+
+    amount = unit = ""
+    quantity = QUANTITY_PATTERN.match(line)
+    if quantity:
+        amount = quantity.group(1).strip()
+        line = line[quantity.end():]
+    words = line.split(" ", 2)
+    for size in (2, 1):
+        candidate = " ".join(words[:size]).lower().rstrip(".")
+        if len(words) > size and candidate in UNITS:
+            unit = " ".join(words[:size])
+            line = " ".join(words[size:])
+            break
+    return {"amount": amount, "unit": unit, "ingredient": line.strip()}
+
+
+def instructions_markup(instructions) -> str:
+    """Flattens recipeInstructions (a string, HowToSteps, or HowToSections of steps) to an ordered list"""
+
+    steps = []
+
+    def collect(node):
+        if isinstance(node, str):
+            steps.extend(step for step in (clean_text(part) for part in node.split("\n")) if step)
+        elif isinstance(node, list):
+            for item in node:
+                collect(item)
+        elif isinstance(node, dict):
+            if "itemListElement" in node:
+                collect(node["itemListElement"])
+            else:
+                collect(node.get("text") or node.get("name"))
+
+    collect(instructions)
+    if not steps:
+        return ""
+    return "<ol> " + "".join(f"<li>{html.escape(step)}</li> " for step in steps) + "</ol>"
+
+
+def servings_from_yield(recipe_yield) -> int | None:
+    if isinstance(recipe_yield, list):
+        recipe_yield = " ".join(str(value) for value in recipe_yield)
+    servings = re.search(r"\d+", str(recipe_yield or ""))
+    return int(servings.group()) if servings else None
+
+
+def duration_to_text(duration) -> str | None:
+    """Formats an ISO 8601 duration ("PT1H15M") the way add_recipe saves times ("1 hr 15 mins")"""
+
+    if not isinstance(duration, str):
+        return None
+    match = ISO_DURATION_PATTERN.fullmatch(duration)
+    if not match or not any(match.groups()):
+        return None
+    days, hours, minutes = (int(value or 0) for value in match.groups())
+    hours += days * 24
+    total_time = ""
+    if hours:
+        total_time += f"{hours} hr "
+    if minutes:
+        total_time += f"{minutes} mins"
+    return total_time.strip()
+
+
+def first_image_url(image) -> str | None:
+    if isinstance(image, list):
+        image = image[0] if image else None
+    if isinstance(image, dict):
+        image = image.get("url")
+    return image if isinstance(image, str) else None
+
+
+@register_extractor("allrecipes")
+def parse_allrecipes(page_html: str) -> dict:
+    """Scrapes an allrecipes recipe page into Recipe column values"""
+
+    soup = BeautifulSoup(page_html, HTML_PARSER)
+
+    title = soup.find("h1", {"class": "article-heading"}).text
+    description = soup.find("p", {"class": "article-subheading"}).text
+
+    ingredients = []
+    ing_list = soup.find_all('li', {'class': 'mm-recipes-structured-ingredients__list-item'})
+    for ing in ing_list:
+        ing_components = {"amount": ing.find("span", {"data-ingredient-quantity": "true"}).text,
+                          "unit": ing.find("span", {"data-ingredient-unit": "true"}).text,
+                          "ingredient": ing.find("span", {"data-ingredient-name": "true"}).text}
+        ingredients.append(ing_components)
+
+    instructions = "<ol> "
+    instructions_soup = soup.find_all("li", {
+        "class": "comp mntl-sc-block mntl-sc-block-startgroup mntl-sc-block-group--LI"})
+    for step in instructions_soup:
+        step_text = step.find("p").text
+        instructions += f"<li>{step_text}</li> "
+    instructions += f"</ol>"
+
+    recipe_details = soup.find_all(class_="mm-recipes-details__item")
+    total_time = None
+    num_servings = None
+    for detail in recipe_details:
+        label = detail.find(class_='mm-recipes-details__label')
+        value = detail.find(class_='mm-recipes-details__value')
+        if label and "Total Time:" in label.text:
+            total_time = value.text.strip()
+            continue
+        if label and "Servings" in label.text:
+            num_servings = value.text.strip()  # Get the text and strip any extra whitespace
+            continue
+
+    image = soup.find("img", {"class": "primary-image__image"})
+    if image:
+        image_url = image["src"]
+    # What about 'class': 'universal-image__image'? Reason I didn't use as secondary option?
+    else:
+        image = soup.find("img", {"id": "mntl-sc-block-image_1-0"})
+        image_url = image["data-hi-res-src"]
+
+    return {
+        "title": title,
+        "description": description,
+        "ingredients": ingredients,
+        "instructions": instructions,
+        # "4 servings" or "4 to 6"
+        "default_servings": servings_from_yield(num_servings),
+        "time_to_cook": total_time,
+        "image_url": image_url,
+    }
@@ -1,6 +1,7 @@
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField, FileAllowed
-from wtforms import StringField, SubmitField, PasswordField, TextAreaField, SelectMultipleField, widgets, IntegerField
+from flask_wtf.file import FileField, FileAllowed, FileRequired
+from wtforms import StringField, SubmitField, PasswordField, TextAreaField, SelectMultipleField, widgets, IntegerField, \
+    BooleanField, SelectField
 from wtforms.validators import DataRequired, EqualTo, Length, Email, Optional, URL, NumberRange
 import email_validator
 
@@ -69,7 +70,12 @@ class CommentForm(FlaskForm):
 
 
 class AIQueryForm(FlaskForm):
-    query = StringField("ex. \"Korean recipe with garlic, onions, rice, and gochujang\"", [DataRequired()])
+    query = StringField("ex. \"Korean recipe with garlic, onions, rice, and gochujang\"",
+                        [DataRequired(), Length(max=500)])
+    variations = SelectField("How many recipes?", choices=[(1, "One recipe"), (2, "2 variations to compare"),
+                                                            (3, "3 variations to compare"), (4, "4 variations to compare")],
+                             coerce=int, default=1)
+    regenerate = BooleanField("Generate a brand new recipe (skip previously generated answers)")
     submit = SubmitField("Submit")
 
 
@@ -79,3 +85,9 @@ class GetRecipeForm(FlaskForm):
                              # render_kw={"placeholder": "Recipe URL"}
                              )
     submit = SubmitField("Submit")
+
+
+class BulkImportForm(FlaskForm):
+    urls_file = FileField("Recipe URLs (.txt, one per line) or a sitemap (.xml)",
+                          [FileRequired(), FileAllowed(["txt", "xml"], "Text files or sitemaps only")])
+    submit = SubmitField("Import Recipes")
@@ -0,0 +1,159 @@
+import random
+import time
+from dataclasses import dataclass, field
+from threading import Lock
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised without touching the network while a host's circuit breaker is open"""
+
+
+@dataclass
+class HostPolicy:
+    """Timeouts, retry and circuit breaker settings for requests to one host"""
+    connect_timeout: float = 3.05
+    read_timeout: float = 10
+    retries: int = 2
+    backoff: float = 0.5  # seconds, doubled per retry with full jitter
+    retry_methods: frozenset = frozenset({"GET", "HEAD"})
+    retry_statuses: frozenset = frozenset({429, 500, 502, 503, 504})
+    failure_threshold: int = 5  # consecutive failures that open the circuit
+    reset_timeout: float = 30  # seconds the circuit stays open before a trial request is let through
+
+
+@dataclass
+class HostStats:
+    """Counters for one host, plus its circuit breaker state"""
+    requests: int = 0
+    errors: int = 0
+    retries: int = 0
+    rejected: int = 0
+    total_latency: float = 0
+    max_latency: float = 0
+    consecutive_failures: int = 0
+    opened_at: float | None = None
+    lock: Lock = field(default_factory=Lock, repr=False)
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "avg_latency_ms": round(1000 * self.total_latency / self.requests, 1) if self.requests else None,
+            "max_latency_ms": round(1000 * self.max_latency, 1),
+            "circuit": "open" if self.opened_at else "closed",
+        }
+
+
+class HostHeaderAdapter(HTTPAdapter):
+    """Checks TLS against the Host header when it names another host than the URL, so a request can be sent to
+    an address resolved beforehand (https://93.184.216.34/ with Host: example.com) and still verify example.com"""
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        host = request.headers.get("Host")
+        if host and host_params["scheme"] == "https":
+            hostname = urlsplit(f"//{host}").hostname
+            if hostname != host_params["host"]:
+                pool_kwargs["server_hostname"] = pool_kwargs["assert_hostname"] = hostname
+        return host_params, pool_kwargs
+
+
+class HttpClient:
+    """Shared client for every outbound call. One keep-alive connection pool per host,
+    per-host timeouts, bounded retries with jittered exponential backoff and a circuit breaker
+    that fails fast while a host keeps erroring"""
+
+    def __init__(self, policies: dict[str, HostPolicy] | None = None, default_policy: HostPolicy | None = None,
+                 pool_maxsize: int = 10, user_agent: str = "YesChef/1.0"):
+        self.policies = policies or {}
+        self.default_policy = default_policy or HostPolicy()
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = user_agent
+        # Retries are handled here so they can be counted and fed to the circuit breaker
+        adapter = HostHeaderAdapter(pool_connections=20, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._stats: dict[str, HostStats] = {}
+        self._stats_lock = Lock()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Sends a request under the host's policy. Returns the last response, even an error status,
+        and raises the last exception if every attempt failed to get one"""
+
+        # A Host header names the site when the URL is an address it was resolved to
+        host = (kwargs.get("headers") or {}).get("Host") or urlsplit(url).netloc
+        policy = self.policies.get(host, self.default_policy)
+        stats = self._host_stats(host)
+        kwargs.setdefault("timeout", (policy.connect_timeout, policy.read_timeout))
+        retries = policy.retries if method.upper() in policy.retry_methods else 0
+
+        for attempt in range(retries + 1):
+            self._check_circuit(host, policy, stats)
+            if attempt:
+                with stats.lock:
+                    stats.retries += 1
+                time.sleep(random.uniform(0, policy.backoff * 2 ** (attempt - 1)))
+
+            started = time.monotonic()
+            error = response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                error = e
+            failed = error is not None or response.status_code in policy.retry_statuses
+            self._record(stats, policy, time.monotonic() - started, failed)
+
+            if not failed:
+                return response
+        if error is not None:
+            raise error
+        return response
+
+    def stats(self) -> dict[str, dict]:
+        """Per-host request, error, retry and latency counters"""
+
+        with self._stats_lock:
+            return {host: stats.as_dict() for host, stats in self._stats.items()}
+
+    def _host_stats(self, host: str) -> HostStats:
+        with self._stats_lock:
+            return self._stats.setdefault(host, HostStats())
+
+    @staticmethod
+    def _check_circuit(host: str, policy: HostPolicy, stats: HostStats):
+        with stats.lock:
+            if stats.opened_at is None:
+                return
+            if time.monotonic() - stats.opened_at >= policy.reset_timeout:
+                # Half-open: let this request through as a trial, re-arm the timer for everyone else
+                stats.opened_at = time.monotonic()
+                return
+            stats.rejected += 1
+        raise CircuitOpenError(f"Circuit open for {host}, not sending request")
+
+    @staticmethod
+    def _record(stats: HostStats, policy: HostPolicy, latency: float, failed: bool):
+        with stats.lock:
+            stats.requests += 1
+            stats.total_latency += latency
+            stats.max_latency = max(stats.max_latency, latency)
+            if failed:
+                stats.errors += 1
+                stats.consecutive_failures += 1
+                if stats.consecutive_failures >= policy.failure_threshold:
+                    stats.opened_at = time.monotonic()
+            else:
+                stats.consecutive_failures = 0
+                stats.opened_at = None
@@ -0,0 +1,236 @@
+import glob
+import hashlib
+import ipaddress
+import os
+import socket
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from threading import Lock, Semaphore
+from urllib.parse import urljoin, urlsplit
+
+import requests
+
+from caching import LRUCache
+from http_client import HttpClient
+from images import DERIVATIVE_FORMATS, Image, ImageOps, flatten, resize_to_width
+
+
+class ImageProxyError(Exception):
+    """Raised when a remote image can't be fetched or decoded"""
+
+
+class ImageProxyBusy(Exception):
+    """Raised when every upstream fetch slot stayed taken for the whole wait"""
+
+
+class ImageProxy:
+    """Local cache of remote recipe images (image_url). Each image is downloaded once, up to max_source_bytes,
+    and resized variants are written next to it on demand. At most max_fetches downloads run at a time, and
+    the least recently used images are evicted once their files exceed max_bytes. Redirects are followed by hand,
+    at most max_redirects of them, so every hop goes through the same host check as the image URL"""
+
+    def __init__(self, http_client: HttpClient, folder: str, max_bytes: int, max_source_bytes: int = 10 * 1024 * 1024,
+                 max_fetches: int = 4, fetch_wait: float = 5, allow_private_hosts: bool = False,
+                 max_redirects: int = 5):
+        self.http_client = http_client
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_source_bytes = max_source_bytes
+        self.fetch_wait = fetch_wait
+        # Image URLs are user provided, so by default don't let them reach the server's own network
+        self.allow_private_hosts = allow_private_hosts
+        self.max_redirects = max_redirects
+        self.stats = {"hits": 0, "misses": 0, "downloads": 0, "errors": 0, "busy": 0, "evictions": 0}
+        self._stats_lock = Lock()
+        self._fetches = Semaphore(max_fetches)
+        # Image key -> [lock, number of requests holding or waiting for it], dropped once that's back to 0
+        self._url_locks: dict[str, list] = {}
+        self._url_locks_lock = Lock()
+        # Broken or oversized images aren't retried on every page view
+        self._failures = LRUCache(1000, ttl=300)
+        os.makedirs(folder, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                "key TEXT PRIMARY KEY, url TEXT NOT NULL, size INTEGER NOT NULL, last_used_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS images_last_used_at ON images (last_used_at)")
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    @staticmethod
+    def version(url: str) -> str:
+        """Short hash of an image URL, for cache busting links when a recipe's image_url changes"""
+
+        return hashlib.sha256(url.encode()).hexdigest()[:12]
+
+    def variant(self, url: str, width: int, extension: str) -> str:
+        """Returns the path of url's image resized to width (never upscaled) as a DERIVATIVE_FORMATS extension,
+        downloading and resizing it first if needed. Concurrent requests for the same image share one download"""
+
+        key = hashlib.sha256(url.encode()).hexdigest()
+        path = os.path.join(self.folder, f"{key}-{width}.{extension}")
+        if os.path.exists(path):
+            self._count("hits")
+            self._touch(key)
+            return path
+
+        with self._url_lock(key):
+            if not os.path.exists(path):
+                source = os.path.join(self.folder, f"{key}.source")
+                added = 0
+                if not os.path.exists(source):
+                    self._download(url, source)
+                    added += os.path.getsize(source)
+                self._resize(source, path, width, extension)
+                added += os.path.getsize(path)
+                self._add(key, url, added)
+        self._count("misses")
+        self.evict()
+        return path
+
+    def evict(self):
+        """Deletes least recently used images, with all their variants, until the cache is back under max_bytes"""
+
+        with closing(self._connect()) as conn, conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evicted = 0
+            for key, size in conn.execute("SELECT key, size FROM images ORDER BY last_used_at").fetchall():
+                if total <= self.max_bytes:
+                    break
+                for leftover in glob.glob(os.path.join(self.folder, f"{key}[.-]*")):
+                    os.remove(leftover)
+                conn.execute("DELETE FROM images WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        self._count("evictions", evicted)
+
+    def info(self) -> dict:
+        with closing(self._connect()) as conn:
+            images, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images").fetchone()
+        with self._stats_lock:
+            return {"images": images, "bytes": size, **self.stats}
+
+    def _download(self, url: str, source: str):
+        if self._failures.get(url):
+            raise ImageProxyError(f"{url} failed recently")
+        if not self._fetches.acquire(timeout=self.fetch_wait):
+            self._count("busy")
+            raise ImageProxyBusy(f"No free slot to fetch {url}")
+
+        partial = f"{source}.{os.getpid()}.part"
+        try:
+            with closing(self._get(url)) as response:
+                response.raise_for_status()
+                if not response.headers.get("Content-Type", "").startswith("image/"):
+                    raise ImageProxyError(f"{url} isn't an image")
+                size = 0
+                with open(partial, "wb") as file:
+                    for chunk in response.iter_content(64 * 1024):
+                        size += len(chunk)
+                        if size > self.max_source_bytes:
+                            raise ImageProxyError(f"{url} is larger than {self.max_source_bytes} bytes")
+                        file.write(chunk)
+            os.replace(partial, source)
+            self._count("downloads")
+        except (requests.RequestException, ImageProxyError) as e:
+            if os.path.exists(partial):
+                os.remove(partial)
+            self._failures.set(url, True)
+            self._count("errors")
+            raise ImageProxyError(f"Couldn't fetch {url}: {e}") from e
+        finally:
+            self._fetches.release()
+
+    def _get(self, url: str) -> requests.Response:
+        """Streams url, checking the host of it and of every redirect before connecting. The connection goes to
+        the address that was checked, so the host can't resolve somewhere else in between (DNS rebinding)"""
+
+        for _ in range(self.max_redirects + 1):
+            address = self._check_host(url)
+            if address is None:
+                response = self.http_client.get(url, stream=True, allow_redirects=False)
+            else:
+                parts = urlsplit(url)
+                host = f"[{parts.hostname}]" if ":" in parts.hostname else parts.hostname
+                pinned = f"[{address}]" if ":" in address else address
+                if parts.port:
+                    host, pinned = f"{host}:{parts.port}", f"{pinned}:{parts.port}"
+                response = self.http_client.get(parts._replace(netloc=pinned).geturl(), headers={"Host": host},
+                                                stream=True, allow_redirects=False)
+            if not response.is_redirect:
+                return response
+            response.close()
+            url = urljoin(url, response.headers["Location"])
+        raise ImageProxyError(f"More than {self.max_redirects} redirects")
+
+    def _resize(self, source: str, path: str, width: int, extension: str):
+        derivative_format, options = DERIVATIVE_FORMATS[extension]
+        partial = f"{path}.{os.getpid()}.part"
+        try:
+            with Image.open(source) as original:
+                image = flatten(ImageOps.exif_transpose(original))
+            if image.width > width:
+                image = resize_to_width(image, width)
+            image.save(partial, format=derivative_format, **options)
+            os.replace(partial, path)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            if os.path.exists(partial):
+                os.remove(partial)
+            self._count("errors")
+            raise ImageProxyError(f"Couldn't resize {source}: {e}") from e
+
+    def _check_host(self, url: str) -> str | None:
+        """Returns the public address to connect to for url, or None when private hosts are allowed"""
+
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ImageProxyError(f"{url} isn't an http(s) URL")
+        if self.allow_private_hosts:
+            return None
+        try:
+            addresses = [info[4][0] for info in socket.getaddrinfo(parts.hostname, parts.port or 443,
+                                                                   type=socket.SOCK_STREAM)]
+        except socket.gaierror as e:
+            raise ImageProxyError(f"Couldn't resolve {parts.hostname}") from e
+        if not addresses or any(not ipaddress.ip_address(address.split("%")[0]).is_global for address in addresses):
+            raise ImageProxyError(f"{parts.hostname} isn't a public host")
+        return addresses[0]
+
+    @contextmanager
+    def _url_lock(self, key: str):
+        with self._url_locks_lock:
+            entry = self._url_locks.setdefault(key, [Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._url_locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._url_locks[key]
+
+    def _add(self, key: str, url: str, size: int):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO images (key, url, size, last_used_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET size = size + excluded.size, last_used_at = excluded.last_used_at",
+                (key, url, size, time.time())
+            )
+
+    def _touch(self, key: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE images SET last_used_at = ? WHERE key = ?", (time.time(), key))
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(os.path.join(self.folder, "index.db"), timeout=30)
+
+    def _count(self, stat: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[stat] += amount
@@ -0,0 +1,154 @@
+import glob
+import hashlib
+import os
+import re
+from contextlib import contextmanager
+from threading import Lock
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Widths generated for every uploaded photo, never upscaled past the original
+IMAGE_WIDTHS = (320, 640, 960, 1280)
+ORIENTATION_TAG = 0x0112
+# Derivative extension -> Pillow format and save options, modern format first
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 6}),
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+def derivative_path(filepath: str, width: int, extension: str) -> str:
+    """Path of one derivative, e.g. images/recipes/<uuid>-640.webp for images/recipes/<uuid>.png"""
+
+    return f"{os.path.splitext(filepath)[0]}-{width}.{extension}"
+
+
+def srcset(filepath: str, widths: list[int], extension: str, static_url) -> str:
+    return ", ".join(f"{static_url(derivative_path(filepath, width, extension))} {width}w" for width in widths)
+
+
+def process_image(static_folder: str, filepath: str) -> dict | None:
+    """Rewrites an uploaded photo upright and without its metadata (EXIF, GPS, camera details), then saves
+    every width in IMAGE_WIDTHS as WebP and JPEG next to it. Returns the original's dimensions and the
+    derivative widths, or None when Pillow isn't installed"""
+
+    if Image is None:
+        return None
+
+    path = os.path.join(static_folder, filepath)
+    with Image.open(path) as original:
+        original.load()
+        icc_profile = original.info.get("icc_profile")
+        save_options = {"icc_profile": icc_profile} if icc_profile else {}
+        if original.format == "JPEG" and original.getexif().get(ORIENTATION_TAG, 1) == 1:
+            # Already upright, so reuse its quantization tables instead of compressing it a second time
+            save_atomically(original, path, format="JPEG", quality="keep", **save_options)
+            image = original.copy()
+        else:
+            image = ImageOps.exif_transpose(original)
+            image.info = {}
+            save_atomically(image, path, format=original.format, quality=90, optimize=True, **save_options)
+
+    width, height = image.size
+    image = flatten(image)
+    largest = min(width, IMAGE_WIDTHS[-1])
+    widths = [target for target in IMAGE_WIDTHS if target < largest] + [largest]
+    for target in widths:
+        resized = resize_to_width(image, target)
+        for extension, (derivative_format, options) in DERIVATIVE_FORMATS.items():
+            save_atomically(resized, os.path.join(static_folder, derivative_path(filepath, target, extension)),
+                            format=derivative_format, **save_options, **options)
+    return {"image_width": width, "image_height": height, "image_widths": widths}
+
+
+def save_atomically(image: "Image.Image", path: str, **options):
+    """Writes to a temporary file first, since identical uploads share files that may be served or
+    processed by another thread at the same time"""
+
+    partial = f"{path}.{os.getpid()}.part"
+    image.save(partial, **options)
+    os.replace(partial, path)
+
+
+def flatten(image: "Image.Image") -> "Image.Image":
+    """Converts to RGB, since JPEG has no transparency, flattening transparent images onto white"""
+
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        flattened = Image.new("RGB", image.size, "white")
+        flattened.paste(image, mask=image.getchannel("A"))
+        return flattened
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+def resize_to_width(image: "Image.Image", width: int) -> "Image.Image":
+    return image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+
+
+def store_image(uploaded_file, folder: str) -> str:
+    """Saves an upload named by the SHA-256 of its bytes and returns the file name. Identical uploads
+    share one file, which is deleted once no recipe or user references it"""
+
+    data = uploaded_file.read()
+    extension = os.path.splitext(uploaded_file.filename)[1].lower().lstrip(".")
+    name = f"{hashlib.sha256(data).hexdigest()}.{'jpg' if extension == 'jpeg' else extension}"
+    path = os.path.join(folder, name)
+    with folder_lock(folder):
+        if os.path.exists(path):
+            # Not rewritten, it may already be processed (upright and without metadata). Touched instead, so a
+            # release of the same photo racing this upload sees it as new and leaves it alone
+            os.utime(path)
+        else:
+            partial = f"{path}.{os.getpid()}.part"
+            with open(partial, "wb") as file:
+                file.write(data)
+            os.replace(partial, path)
+    return name
+
+
+_folder_lock = Lock()
+
+
+@contextmanager
+def folder_lock(folder: str):
+    """Serializes storing and deleting photos in a folder, across processes too where fcntl is available"""
+
+    if fcntl is None:
+        with _folder_lock:
+            yield
+        return
+    with open(os.path.join(folder, ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def image_owner(path: str) -> str:
+    """The photo a file belongs to, without extension: itself for an original, the original for a derivative"""
+
+    base = os.path.splitext(path)[0]
+    derivative = re.fullmatch(r"(.+)-\d+", base)
+    return derivative.group(1) if derivative else base
+
+
+def remove_image(static_folder: str, filepath: str):
+    """Deletes an uploaded photo along with its derivatives"""
+
+    path = os.path.join(static_folder, filepath)
+    stem = os.path.splitext(path)[0]
+    derivatives = [match for match in glob.glob(glob.escape(stem) + "-*") if image_owner(match) == stem]
+    for leftover in [path, *derivatives]:
+        if os.path.exists(leftover):
+            os.remove(leftover)
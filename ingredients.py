@@ -0,0 +1,100 @@
+import re
+
+from extractors import QUANTITY_PATTERN, split_ingredient_line
+
+UNICODE_FRACTIONS = {"¼": 1 / 4, "½": 1 / 2, "¾": 3 / 4, "⅓": 1 / 3, "⅔": 2 / 3, "⅛": 1 / 8, "⅜": 3 / 8, "⅝": 5 / 8,
+                     "⅞": 7 / 8}
+# Unit as written (see extractors.UNITS) -> canonical unit. Sizes like "large" aren't units, so they map to None
+CANONICAL_UNITS = {
+    "cup": "cup", "cups": "cup", "c": "cup",
+    "tablespoon": "tbsp", "tablespoons": "tbsp", "tbsp": "tbsp", "tbs": "tbsp",
+    "teaspoon": "tsp", "teaspoons": "tsp", "tsp": "tsp",
+    "pound": "lb", "pounds": "lb", "lb": "lb", "lbs": "lb",
+    "ounce": "oz", "ounces": "oz", "oz": "oz",
+    "fluid ounce": "fl oz", "fluid ounces": "fl oz", "fl oz": "fl oz",
+    "gram": "g", "grams": "g", "g": "g",
+    "kilogram": "kg", "kilograms": "kg", "kg": "kg",
+    "milliliter": "ml", "milliliters": "ml", "ml": "ml",
+    "liter": "l", "liters": "l", "l": "l",
+    "quart": "qt", "quarts": "qt", "qt": "qt",
+    "pint": "pt", "pints": "pt", "pt": "pt",
+    "gallon": "gal", "gallons": "gal",
+    "clove": "clove", "cloves": "clove",
+    "pinch": "pinch", "pinches": "pinch",
+    "dash": "dash", "dashes": "dash",
+    "can": "can", "cans": "can",
+    "package": "package", "packages": "package",
+    "stick": "stick", "sticks": "stick",
+    "slice": "slice", "slices": "slice",
+    "sprig": "sprig", "sprigs": "sprig",
+    "bunch": "bunch", "bunches": "bunch",
+    "head": "head", "heads": "head",
+    "large": None, "medium": None, "small": None,
+}
+# Preparation and descriptor words that don't change which ingredient it is
+DESCRIPTORS = {
+    "fresh", "freshly", "chopped", "minced", "diced", "sliced", "grated", "shredded", "crushed", "peeled", "seeded",
+    "finely", "roughly", "coarsely", "thinly", "large", "medium", "small", "extra", "packed", "softened", "melted",
+    "cold", "warm", "hot", "room", "temperature", "boneless", "skinless", "optional", "to", "taste", "divided",
+    "about", "whole", "of",
+}
+PARENTHETICAL_PATTERN = re.compile(r"\([^)]*\)")
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)?(?:/\d+)?|[¼½¾⅓⅔⅛⅜⅝⅞]")
+RANGE_PATTERN = re.compile(r"\s*(?:-|–|to)\s*")
+
+
+def parse_quantity(amount: str) -> float | None:
+    """Reads "1 1/2", "1½", "0.5" or "1,5" as a number. Ranges ("2-3", "2 to 3") give their lower end"""
+
+    total = 0.0
+    for part in NUMBER_PATTERN.findall(RANGE_PATTERN.split(amount.strip())[0]):
+        if part in UNICODE_FRACTIONS:
+            total += UNICODE_FRACTIONS[part]
+        elif "/" in part:
+            numerator, denominator = part.split("/")
+            if int(denominator) == 0:
+                return None
+            total += int(numerator) / int(denominator)
+        else:
+            total += float(part.replace(",", "."))
+    return round(total, 4) or None
+
+
+def singular(word: str) -> str:
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "sses", "xes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")) and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def canonical_name(text: str) -> str:
+    """The ingredient itself, e.g. "black bean" for "black beans, drained and rinsed" or "garlic" for
+    "fresh garlic (minced)": lowercase and singular, without notes, alternatives and preparation words"""
+
+    text = PARENTHETICAL_PATTERN.sub(" ", text.lower())
+    text = re.split(r",|;| or |\bfor\b", text)[0]
+    words = [word for word in re.sub(r"[^a-z\- ]", " ", text).split() if word not in DESCRIPTORS]
+    if words:
+        words[-1] = singular(words[-1])
+    return " ".join(words)[:100]
+
+
+def parse_ingredient(line: str) -> dict:
+    """Splits an ingredient line into the amount as written and the rest of the line, for display, plus the
+    numeric quantity, canonical unit and canonical ingredient name"""
+
+    quantity_match = QUANTITY_PATTERN.match(line)
+    amount = quantity_match.group(1).strip() if quantity_match else ""
+    # Parentheticals like "1 (15 ounce) can beans" would hide the unit
+    parsed = split_ingredient_line(re.sub(r"\s+", " ", PARENTHETICAL_PATTERN.sub(" ", line)).strip())
+    unit = parsed["unit"].lower().rstrip(".")
+    return {
+        "amount": amount,
+        "description": line[quantity_match.end():].strip() if quantity_match else line.strip(),
+        "quantity": parse_quantity(amount) if amount else None,
+        "unit": CANONICAL_UNITS.get(unit),
+        "name": canonical_name(parsed["ingredient"]),
+    }
@@ -0,0 +1,186 @@
+import math
+import sqlite3
+import time
+from contextlib import closing
+from threading import Condition, Lock
+
+
+class SchedulerBusy(Exception):
+    """Raised instead of starting a completion when the queue is full, the wait ran out or a token budget is spent"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Ticket:
+    """An admitted completion. Holds a concurrency slot and a token reservation until released,
+    at which point the reservation is replaced by the tokens actually used"""
+
+    def __init__(self, scheduler: "CompletionScheduler", usage_id: int, slot_id: int):
+        self._scheduler = scheduler
+        self._usage_id = usage_id
+        self._slot_id = slot_id
+        self._released = False
+
+    def release(self, tokens_used: int | None = None):
+        self._scheduler._release(self, tokens_used)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class CompletionScheduler:
+    """Bounds in-flight LLM completions. Callers past max_in_flight wait in a queue of at most max_queue
+    for up to max_wait seconds. Tokens are charged against a global and a per-user budget over a sliding
+    window, so a spike gets fast rejections instead of tying up every web worker on upstream rate limits.
+
+    The slots and token usage live in an SQLite file, so every worker process on the host shares the same
+    limits. A slot held longer than slot_lease seconds (its process died mid-completion) is given back.
+    The queue and the stats are per process"""
+
+    # Seconds between checks for a slot freed by another process
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, path: str, max_in_flight: int, max_queue: int, max_wait: float,
+                 global_token_budget: int, user_token_budget: int, window: float = 60, slot_lease: float = 300):
+        self.path = path
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.global_token_budget = global_token_budget
+        self.user_token_budget = user_token_budget
+        self.window = window
+        self.slot_lease = slot_lease
+        # Wakes this process's waiters as soon as one of its own completions finishes
+        self._slot_freed = Condition(Lock())
+        self._lock = Lock()
+        self._queued = 0
+        self.stats = {"admitted": 0, "rejected_queue_full": 0, "rejected_timeout": 0, "rejected_budget": 0,
+                      "max_queue_depth": 0, "total_wait": 0.0, "max_wait": 0.0, "tokens_used": 0}
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            # One row per admitted completion inside the window
+            conn.execute("CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY, started_at REAL NOT NULL, "
+                         "user_key TEXT NOT NULL, tokens INTEGER NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS usage_started_at ON usage (started_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS usage_user_key ON usage (user_key, started_at)")
+            # One row per completion in flight
+            conn.execute("CREATE TABLE IF NOT EXISTS slots (id INTEGER PRIMARY KEY, acquired_at REAL NOT NULL)")
+
+    def acquire(self, user_key: str, estimated_tokens: int) -> Ticket:
+        """Reserves estimated_tokens and waits for a free slot. Raises SchedulerBusy without waiting
+        when the budgets or the queue are full, or after max_wait seconds without a slot"""
+
+        usage_id = self._reserve(user_key, estimated_tokens)
+        started = time.monotonic()
+        slot_id = self._take_slot()
+        if slot_id is None:
+            with self._lock:
+                queue_full = self._queued >= self.max_queue
+                if queue_full:
+                    self.stats["rejected_queue_full"] += 1
+                else:
+                    self._queued += 1
+                    self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self._queued)
+            if queue_full:
+                self._unreserve(usage_id)
+                raise SchedulerBusy("Too many recipes are being written right now", self.max_wait)
+            try:
+                deadline = started + self.max_wait
+                while slot_id is None and (remaining := deadline - time.monotonic()) > 0:
+                    with self._slot_freed:
+                        self._slot_freed.wait(min(remaining, self.POLL_INTERVAL))
+                    slot_id = self._take_slot()
+            finally:
+                with self._lock:
+                    self._queued -= 1
+            if slot_id is None:
+                with self._lock:
+                    self.stats["rejected_timeout"] += 1
+                self._unreserve(usage_id)
+                raise SchedulerBusy("Too many recipes are being written right now", self.max_wait)
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self.stats["admitted"] += 1
+            self.stats["total_wait"] += waited
+            self.stats["max_wait"] = max(self.stats["max_wait"], waited)
+        return Ticket(self, usage_id, slot_id)
+
+    def info(self) -> dict:
+        now = time.time()
+        with closing(self._connect()) as conn:
+            in_flight = conn.execute("SELECT COUNT(*) FROM slots WHERE acquired_at >= ?",
+                                     (now - self.slot_lease,)).fetchone()[0]
+            tokens_in_window = conn.execute("SELECT COALESCE(SUM(tokens), 0) FROM usage WHERE started_at > ?",
+                                            (now - self.window,)).fetchone()[0]
+        with self._lock:
+            stats = dict(self.stats)
+            queued = self._queued
+        total_wait, max_wait = stats.pop("total_wait"), stats.pop("max_wait")
+        return {
+            "in_flight": in_flight,
+            "queued": queued,
+            "tokens_in_window": tokens_in_window,
+            **stats,
+            "avg_wait_ms": round(1000 * total_wait / stats["admitted"], 1) if stats["admitted"] else None,
+            "max_wait_ms": round(1000 * max_wait, 1),
+        }
+
+    def _reserve(self, user_key: str, tokens: int) -> int:
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            # Taken before reading the budgets, so two processes can't both fit in the last of one
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM usage WHERE started_at <= ?", (now - self.window,))
+            for where, params, budget in (("", (), self.global_token_budget),
+                                          ("WHERE user_key = ?", (user_key,), self.user_token_budget)):
+                used, oldest = conn.execute(f"SELECT COALESCE(SUM(tokens), 0), MIN(started_at) FROM usage {where}",
+                                            params).fetchone()
+                if used + tokens > budget:
+                    with self._lock:
+                        self.stats["rejected_budget"] += 1
+                    # Roughly when the oldest reservation in this budget leaves the window
+                    raise SchedulerBusy("The recipe writer is out of ideas for the moment",
+                                        (oldest or now) + self.window - now)
+            return conn.execute("INSERT INTO usage (started_at, user_key, tokens) VALUES (?, ?, ?)",
+                                (now, user_key, tokens)).lastrowid
+
+    def _unreserve(self, usage_id: int):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE usage SET tokens = 0 WHERE id = ?", (usage_id,))
+
+    def _take_slot(self) -> int | None:
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM slots WHERE acquired_at < ?", (now - self.slot_lease,))
+            if conn.execute("SELECT COUNT(*) FROM slots").fetchone()[0] >= self.max_in_flight:
+                return None
+            return conn.execute("INSERT INTO slots (acquired_at) VALUES (?)", (now,)).lastrowid
+
+    def _release(self, ticket: Ticket, tokens_used: int | None):
+        with self._lock:
+            if ticket._released:
+                return
+            ticket._released = True
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM slots WHERE id = ?", (ticket._slot_id,))
+            if tokens_used is not None:
+                conn.execute("UPDATE usage SET tokens = ? WHERE id = ?", (tokens_used, ticket._usage_id))
+            else:
+                tokens_used = conn.execute("SELECT tokens FROM usage WHERE id = ?",
+                                           (ticket._usage_id,)).fetchone()
+                tokens_used = tokens_used[0] if tokens_used else 0
+        with self._lock:
+            self.stats["tokens_used"] += tokens_used
+        with self._slot_freed:
+            self._slot_freed.notify()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit, so BEGIN IMMEDIATE above takes the write lock up front
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
@@ -1,25 +1,56 @@
+import hashlib
+import hmac
+import html
 import json
 import os
+import random
 import re
 import smtplib
+import click
 import requests
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from threading import Event, Lock, Semaphore, Thread
+from typing import Callable
+from xml.etree import ElementTree
 from dotenv import load_dotenv
 from bs4 import BeautifulSoup
-from flask import Flask, render_template, redirect, url_for, flash, request, session, send_from_directory, jsonify
+from flask import Flask, render_template, redirect, url_for, flash, request, session, send_from_directory, jsonify, \
+    Response, stream_with_context, send_file, make_response
 from flask_bootstrap import Bootstrap5
 from flask_login import UserMixin, login_user, LoginManager, current_user, logout_user
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from flask_wtf.csrf import CSRFProtect
-from sqlalchemy.orm import relationship, DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import Integer, String, Text, ForeignKey, Float
+from flask_wtf.csrf import CSRFProtect, generate_csrf
+from markupsafe import Markup
+from sqlalchemy.orm import relationship, DeclarativeBase, Mapped, mapped_column, selectinload
+from sqlalchemy import Integer, String, Text, ForeignKey, Float, Index, func, event, text, inspect, insert, update, \
+    delete, case, and_, or_, table, column
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.types import JSON
 from werkzeug.security import generate_password_hash, check_password_hash
 from titlecase import titlecase
 from groq import Groq
 from markdown import markdown
+from urllib.parse import urlsplit
 from uuid import uuid4
-from forms import RecipeForm, RegisterForm, RegisterCont, LoginForm, AIQueryForm, EditProfileForm, CommentForm, GetRecipeForm
+from http_client import HttpClient, HostPolicy
+from page_cache import PageCache
+from assets import AssetIndex
+from ingredients import canonical_name, parse_ingredient
+from nutrition import ROUNDING_RULES, nutrition_rows, round_amount, round_amounts
+from pantry import PANTRY_STAPLES, PantryIndex
+from images import DERIVATIVE_FORMATS, IMAGE_WIDTHS, derivative_path, folder_lock, image_owner, process_image, remove_image, \
+    srcset, store_image
+from image_proxy import ImageProxy, ImageProxyBusy, ImageProxyError
+from caching import FragmentCache, LRUCache, SQLiteCache
+from llm_scheduler import CompletionScheduler, SchedulerBusy
+from extractors import SITE_EXTRACTORS, HTML_PARSER, ExtractionError, extract_recipe, recipe_from_json_ld
+from forms import RecipeForm, RegisterForm, RegisterCont, LoginForm, AIQueryForm, EditProfileForm, CommentForm, GetRecipeForm, BulkImportForm
 
 load_dotenv()
 GROQ_API_KEY = os.environ["GROQ_API_KEY"]
@@ -27,20 +58,109 @@ SMTP_USER = os.environ["SMTP_USERNAME"]
 SMTP_PASSWORD = os.environ["SMTP_PASSWORD"]
 EDAMAM_API_KEY = os.environ["EDAMAM_API_KEY"]
 EDAMAM_APP_ID = os.environ["EDAMAM_APP_ID"]
-EDAMAM_ENDPOINT = "https://api.edamam.com/api/nutrition-details"
-
-ALLOWED_URLS = ["allrecipes"]
+# Overridable so the nutrition workers can be pointed at a local stand-in for Edamam
+EDAMAM_ENDPOINT = os.environ.get("EDAMAM_ENDPOINT", "https://api.edamam.com/api/nutrition-details")
+# Bearer token /metrics requires, which is disabled while it's unset
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+EDAMAM_CACHE_MAX_ENTRIES = int(os.environ.get("EDAMAM_CACHE_MAX_ENTRIES", 10000))
+EDAMAM_CACHE_MAX_AGE = int(os.environ.get("EDAMAM_CACHE_MAX_AGE", 60 * 60 * 24 * 90))  # seconds
+NUTRITION_WORKERS = int(os.environ.get("NUTRITION_WORKERS", 2))
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 2))
+# Seconds after being stored during which an unused photo isn't deleted, long enough for an upload of the same
+# bytes to commit the row that uses it
+IMAGE_RELEASE_MIN_AGE = 300
+PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", 60 * 60 * 24 * 7))  # seconds
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+IMAGE_PROXY_MAX_BYTES = int(os.environ.get("IMAGE_PROXY_MAX_BYTES", 500 * 1024 * 1024))
+IMAGE_PROXY_FETCHES = int(os.environ.get("IMAGE_PROXY_FETCHES", 4))  # concurrent downloads from image hosts
+# "memory" keeps rendered fragments per worker process, "sqlite" shares them between the workers on a host
+FRAGMENT_CACHE_BACKEND = os.environ.get("FRAGMENT_CACHE_BACKEND", "memory")
+FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get("FRAGMENT_CACHE_MAX_ENTRIES", 5000))
+AI_CACHE_MAX_ENTRIES = int(os.environ.get("AI_CACHE_MAX_ENTRIES", 1000))
+AI_CACHE_TTL = int(os.environ.get("AI_CACHE_TTL", 60 * 60 * 24 * 7))  # seconds
+# Also keep generated recipes in the database, so they survive restarts and are shared between workers
+AI_CACHE_PERSIST = os.environ.get("AI_CACHE_PERSIST", "1") == "1"
+AI_MAX_IN_FLIGHT = int(os.environ.get("AI_MAX_IN_FLIGHT", 4))
+AI_MAX_QUEUE = int(os.environ.get("AI_MAX_QUEUE", 16))
+AI_MAX_WAIT = float(os.environ.get("AI_MAX_WAIT", 10))  # seconds a request waits for a free completion slot
+AI_GLOBAL_TOKENS_PER_MINUTE = int(os.environ.get("AI_GLOBAL_TOKENS_PER_MINUTE", 30000))
+AI_RECIPE_MAX_TOKENS = 1500  # completion cap, also what gets reserved from the token budgets up front
+# Most variations AIQueryForm offers. A user's budget has to fit that many reservations at once (each the prompt,
+# at most ~300 tokens with the longest query, plus AI_RECIPE_MAX_TOKENS), or the largest requests never get in
+AI_MAX_VARIATIONS = 4
+AI_USER_TOKENS_PER_MINUTE = int(os.environ.get("AI_USER_TOKENS_PER_MINUTE",
+                                               AI_MAX_VARIATIONS * (AI_RECIPE_MAX_TOKENS + 500)))
+NUTRITION_JOB_MAX_ATTEMPTS = 5
+NUTRITION_JOB_BACKOFF = 10  # seconds, doubled after every failed attempt
+NUTRITION_JOB_LEASE = 300  # seconds before a job left "running" by a dead worker is picked up again
+# Bump whenever nutrition.ROUNDING_RULES or the oil_converter() heuristic change,
+# so `flask backfill-nutrition` knows which recipes' Nutrition rows are stale
+NUTRITION_RULES_VERSION = 1
+# Bump whenever a fragment template changes, so fragments rendered by the old one are never served
+FRAGMENT_TEMPLATES_VERSION = 2
+
+FEED_PAGE_SIZE = 10
+SEARCH_PAGE_SIZE = 10
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 50
+API_MAX_IDS = 100
+PANTRY_MAX_INGREDIENTS = 100
+# How far back each pantry index sync looks for saves that committed after a later one was already synced
+PANTRY_SYNC_OVERLAP_MS = 10_000
+# Recipe fields the JSON API can return, see recipe_json(). ?fields= takes any of them and the presets below
+API_RECIPE_FIELDS = ("id", "title", "description", "url", "image", "author", "likes", "liked", "kcal", "servings",
+                     "time_to_cook", "type_diet", "ingredients", "instructions", "nutrition", "version")
+API_FIELD_PRESETS = {
+    "card": ("id", "title", "description", "url", "image", "author", "likes", "liked", "kcal"),
+    "full": API_RECIPE_FIELDS,
+}
+NUTRITION_CACHE_SIZE = 2048
+BULK_IMPORT_MAX_URLS = 100
+# How many sitemap indexes deep a bulk import follows before giving up on the sitemap
+SITEMAP_MAX_DEPTH = 2
+IMPORT_JOB_MAX_ATTEMPTS = 3
+IMPORT_JOB_LEASE = 1800  # seconds, an import fetches every page under the per-domain politeness limits
 
 
 client = Groq(
     api_key=GROQ_API_KEY,
+    # Overridable so AI recipe generation can run against a local fake endpoint
+    base_url=os.environ.get("GROQ_BASE_URL"),
+)
+AI_RECIPE_MODEL = "llama3-8b-8192"
+AI_RECIPE_SYSTEM_PROMPT = ("You are a chef with knowledge in every culture and cuisine. Use only "
+                           "user provided and common household ingredients to respond with a recipe "
+                           "with the name of the recipe in bold, separated by '**Description:**', "
+                           "'**Number of Servings:**', '**Ingredients:**', and '**Instructions:**'.")
+# Used by the non-streaming /ai-recipe, whose completions are validated as JSON instead of split out of markdown
+AI_RECIPE_JSON_PROMPT = ("You are a chef with knowledge in every culture and cuisine. Use only "
+                         "user provided and common household ingredients to respond with a recipe as a JSON "
+                         "object with the keys \"title\" (string), \"description\" (string), \"servings\" "
+                         "(integer), \"ingredients\" (list of strings, each with its amount) and "
+                         "\"instructions\" (list of strings, one per step).")
+ai_structured_stats = {"repaired": 0, "failed": 0}
+# Words that don't change which recipe a query asks for, dropped from AI cache keys
+AI_QUERY_STOPWORDS = {"a", "an", "and", "the", "with", "of", "for", "to", "in", "using", "some", "recipe", "recipes",
+                      "please", "me", "make", "give", "i", "want", "something"}
+ai_recipe_cache = LRUCache(AI_CACHE_MAX_ENTRIES, ttl=AI_CACHE_TTL)
+ai_cache_stats = {"database_hits": 0}
+
+# Every outbound call to Edamam and scraped recipe sites goes through this client
+http_client = HttpClient(
+    policies={
+        # Nutrition analysis is idempotent, so POSTs to Edamam can be retried
+        urlsplit(EDAMAM_ENDPOINT).netloc: HostPolicy(read_timeout=20, retry_methods=frozenset({"POST"})),
+        "www.allrecipes.com": HostPolicy(read_timeout=10),
+    },
+    pool_maxsize=NUTRITION_WORKERS + 10,
 )
 
-app = Flask(__name__)
+# Overridable so the tests can run against a throwaway database and caches
+app = Flask(__name__, instance_path=os.environ.get("INSTANCE_PATH"))
 app.config['SECRET_KEY'] = os.environ["APP_SECRET_KEY"]
 app.config['MAX_CONTENT_LENGTH'] = 2556 * 1179
-app.config['RECIPE_PHOTO_FOLDER'] = r'static\images\recipes'
-app.config['PROFILE_PHOTO_FOLDER'] = r'static\images\profiles'
+app.config['RECIPE_PHOTO_FOLDER'] = os.path.join(app.static_folder, "images", "recipes")
+app.config['PROFILE_PHOTO_FOLDER'] = os.path.join(app.static_folder, "images", "profiles")
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg'}
 
 csrf = CSRFProtect(app)
@@ -62,14 +182,71 @@ def titlecase_filter(text):
     return titlecase(text)
 
 
+@app.template_filter('srcset')
+def srcset_filter(filepath, widths, extension):
+    return srcset(filepath, widths, extension, lambda path: url_for('static', filename=path))
+
+
+app.add_template_filter(derivative_path, 'derivative')
+
+
+@app.template_global()
+def proxied_image_url(recipe, width: int, extension: str) -> str:
+    return url_for("recipe_image", recipe_id=recipe.id, width=width, extension=extension,
+                   v=ImageProxy.version(recipe.image_url))
+
+
+@app.template_global()
+def proxied_image_srcset(recipe, extension: str) -> str:
+    return ", ".join(f"{proxied_image_url(recipe, width, extension)} {width}w" for width in IMAGE_WIDTHS)
+
+
+@app.template_global()
+def recipe_fragment(template_name: str, recipe, variant: str = "", **context) -> Markup:
+    """Renders a fragment template for a recipe through fragment_cache. The template gets recipe, variant and
+    context, and may only depend on the recipe's columns and Nutrition rows (everything that bumps its version)
+    and on variant. context is only used on a miss, to pass things like the recipe's NutritionFacts"""
+
+    return Markup(fragment_cache.render(
+        template_name, recipe.id, recipe.version,
+        lambda: render_template(template_name, recipe=recipe, variant=variant, **context), variant
+    ))
+
+
 class Base(DeclarativeBase):
     pass
 
 
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///recipes.db'
+# Nutrition workers write from background threads, so wait on locks instead of failing right away
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {"connect_args": {"timeout": 30}}
 db = SQLAlchemy(model_class=Base)
 db.init_app(app)
 
+# Scraped pages are kept next to the database so failed imports can be retried without downloading again
+os.makedirs(app.instance_path, exist_ok=True)
+page_cache = PageCache(http_client, os.path.join(app.instance_path, "page_cache.db"),
+                       ttl=PAGE_CACHE_TTL, max_bytes=PAGE_CACHE_MAX_BYTES)
+# Completion slots and token budgets are shared by every worker process through this file
+ai_scheduler = CompletionScheduler(os.path.join(app.instance_path, "llm_scheduler.db"), AI_MAX_IN_FLIGHT,
+                                   AI_MAX_QUEUE, AI_MAX_WAIT, AI_GLOBAL_TOKENS_PER_MINUTE, AI_USER_TOKENS_PER_MINUTE)
+# Everything under static/ except uploaded photos, which change at runtime, is served from memory
+asset_index = AssetIndex(
+    app.static_folder,
+    exclude=(os.path.relpath(app.config['RECIPE_PHOTO_FOLDER'], app.static_folder),
+             os.path.relpath(app.config['PROFILE_PHOTO_FOLDER'], app.static_folder)),
+    manifests=(os.path.join(app.static_folder, "react", ".vite", "manifest.json"),),
+)
+# Rendered parts of recipe cards and pages, see recipe_fragment()
+if FRAGMENT_CACHE_BACKEND == "sqlite":
+    fragment_cache_backend = SQLiteCache(os.path.join(app.instance_path, "fragment_cache.db"), FRAGMENT_CACHE_MAX_ENTRIES)
+else:
+    fragment_cache_backend = LRUCache(FRAGMENT_CACHE_MAX_ENTRIES)
+fragment_cache = FragmentCache(fragment_cache_backend, namespace=f"recipe-v{FRAGMENT_TEMPLATES_VERSION}")
+# Remote recipe images (image_url) are served from our own origin, see recipe_image()
+image_proxy = ImageProxy(http_client, os.path.join(app.instance_path, "image_proxy"),
+                         max_bytes=IMAGE_PROXY_MAX_BYTES, max_fetches=IMAGE_PROXY_FETCHES)
+
 
 class User(db.Model, UserMixin):
     __tablename__ = "users"
@@ -78,7 +255,15 @@ class User(db.Model, UserMixin):
     password: Mapped[str] = mapped_column(String(100), nullable=False)
     name: Mapped[str] = mapped_column(String(50), unique=True, nullable=False)
     description: Mapped[str] = mapped_column(String(200), nullable=True)
-    image_filepath: Mapped[str] = mapped_column(String(256), nullable=True)
+    # Content-addressed, so several rows can share a photo, see store_image() and release_image()
+    image_filepath: Mapped[str] = mapped_column(String(256), nullable=True, index=True)
+    # Filled in once the photo's derivatives are generated, see process_image_later()
+    image_width: Mapped[int] = mapped_column(Integer, nullable=True)
+    image_height: Mapped[int] = mapped_column(Integer, nullable=True)
+    image_widths: Mapped[list[int]] = mapped_column(JSON, nullable=True)
+    # Milliseconds since the epoch of the last change to the profile or the user's likes, see bump_versions()
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=lambda: time.time_ns() // 1_000_000,
+                                         server_default="0")
     recipes: Mapped[list["Recipe"]] = relationship(back_populates="author")
     liked_recipes: Mapped[list["Like"]] = relationship(back_populates="user")
     comments: Mapped[list["Comment"]] = relationship(back_populates="comment_author")
@@ -99,12 +284,49 @@ class Recipe(db.Model):
     author: Mapped["User"] = relationship(back_populates="recipes")
     liked_by_users: Mapped[list["Like"]] = relationship(back_populates="recipe", cascade="all, delete-orphan")
     comments: Mapped[list["Comment"]] = relationship(back_populates="recipe", cascade="all, delete-orphan")
-    image_filepath: Mapped[str] = mapped_column(String(256), nullable=True)
+    # Parsed from ingredients whenever they're saved, see store_recipe_ingredients()
+    ingredient_rows: Mapped[list["RecipeIngredient"]] = relationship(order_by="RecipeIngredient.position",
+                                                                      viewonly=True)
+    # Content-addressed, so several rows can share a photo, see store_image() and release_image()
+    image_filepath: Mapped[str] = mapped_column(String(256), nullable=True, index=True)
+    # Filled in once the photo's derivatives are generated, see process_image_later()
+    image_width: Mapped[int] = mapped_column(Integer, nullable=True)
+    image_height: Mapped[int] = mapped_column(Integer, nullable=True)
+    image_widths: Mapped[list[int]] = mapped_column(JSON, nullable=True)
     # Users don't have to upload a photo for now.
     # Make so that won't show up on front page if no photo? (Warn when creating recipe)
     image_url: Mapped[str] = mapped_column(nullable=True)
     recipe_url: Mapped[str] = mapped_column(unique=True, nullable=True)
     recipe_source: Mapped[str] = mapped_column(nullable=True)
+    # NUTRITION_RULES_VERSION the recipe's Nutrition rows were computed with, None if never computed
+    nutrition_version: Mapped[int] = mapped_column(Integer, nullable=True, index=True)
+    # Milliseconds since the epoch of the last change to the recipe, its nutrition, likes or comments, see
+    # bump_versions(). Never repeats, even for a new recipe that reuses a deleted recipe's id
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=lambda: time.time_ns() // 1_000_000,
+                                         server_default="0", index=True)
+    # Same, but only changed with the ingredients (see stamp_ingredients_version()), so sync_pantry_index()
+    # skips recipes that just got a like, comment or nutrition. Indexed for it
+    ingredients_version: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0",
+                                                     index=True)
+
+
+class RecipeIngredient(db.Model):
+    """One ingredient line of a recipe, parsed once when the recipe is saved (see ingredients.parse_ingredient())
+    instead of every time Recipe.ingredients is read, whether that's markup or a list of dicts"""
+    __tablename__ = "recipe_ingredients"
+    # Finds the recipes using an ingredient from the index alone
+    __table_args__ = (Index("ix_recipe_ingredients_name_recipe_id", "name", "recipe_id"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    recipe_id: Mapped[int] = mapped_column(Integer, ForeignKey("recipes.id"), nullable=False, index=True)
+    position: Mapped[int] = mapped_column(Integer, nullable=False)
+    # As written, e.g. "1 1/2" and "cups flour, sifted"
+    amount: Mapped[str] = mapped_column(String(30), nullable=False)
+    description: Mapped[str] = mapped_column(String(300), nullable=False)
+    quantity: Mapped[float] = mapped_column(Float, nullable=True)
+    # Canonical, e.g. "cup" for "cups" or "c"
+    unit: Mapped[str] = mapped_column(String(10), nullable=True)
+    # Canonical ingredient, e.g. "flour"
+    name: Mapped[str] = mapped_column(String(100), nullable=False)
 
 
 class Nutrition(db.Model):
@@ -118,6 +340,28 @@ class Nutrition(db.Model):
     daily_value_percent: Mapped[int] = mapped_column(Integer, nullable=True)
 
 
+class NutritionSummary(db.Model):
+    """A recipe's per-serving Nutrition amounts pivoted into one row, a column per NUTRITION_LABEL label, so the
+    feed and search can filter and sort by them with an index instead of joining Nutrition once per nutrient.
+    Rewritten along with the Nutrition rows by write_nutrition()"""
+    __tablename__ = "nutrition_summaries"
+    recipe_id: Mapped[int] = mapped_column(Integer, ForeignKey("recipes.id"), primary_key=True)
+    kcal: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+    totalfat: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+    satfat: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+    transfat: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+    cholesterol: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+    sodium: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+    totalcarbs: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+    fiber: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+    sugar: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+    protein: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+    vitd: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+    calcium: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+    iron: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+    potassium: Mapped[float] = mapped_column(Float, nullable=True, index=True)
+
+
 class Like(db.Model):
     __tablename__ = "likes"
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), primary_key=True)
@@ -136,22 +380,275 @@ class Comment(db.Model):
     recipe: Mapped["Recipe"] = relationship(back_populates="comments")
 
 
+# Full-text index over recipes, rowid == recipes.id. Kept in sync by the Recipe mapper events below
+RECIPE_FTS_DDL = ("CREATE VIRTUAL TABLE recipes_fts USING fts5("
+                  "title, description, ingredients, instructions, tokenize='porter unicode61 remove_diacritics 2')")
+# bm25() column weights for title, description, ingredients, instructions
+RECIPE_FTS_WEIGHTS = (10.0, 4.0, 3.0, 1.0)
+
+
+def recipe_search_document(recipe: Recipe) -> dict:
+    """Flattens a recipe's searchable fields to plain text for the full-text index"""
+
+    return {
+        "id": recipe.id,
+        "title": recipe.title,
+        "description": recipe.description or "",
+        "ingredients": " ".join(ingredient_lines(recipe.ingredients)),
+        "instructions": strip_markup(recipe.instructions),
+    }
+
+
+RECIPE_SEARCH_FIELDS = ("title", "description", "ingredients", "instructions")
+
+
+@event.listens_for(Recipe, "after_insert")
+@event.listens_for(Recipe, "after_update")
+def index_recipe(mapper, connection, target):
+    state = inspect(target)
+    if state.persistent and not any(state.attrs[field].history.has_changes() for field in RECIPE_SEARCH_FIELDS):
+        return
+    connection.execute(text("DELETE FROM recipes_fts WHERE rowid = :id"), {"id": target.id})
+    connection.execute(
+        text("INSERT INTO recipes_fts (rowid, title, description, ingredients, instructions) "
+             "VALUES (:id, :title, :description, :ingredients, :instructions)"),
+        recipe_search_document(target)
+    )
+
+
+@event.listens_for(Recipe, "after_delete")
+def unindex_recipe(mapper, connection, target):
+    connection.execute(text("DELETE FROM recipes_fts WHERE rowid = :id"), {"id": target.id})
+
+
+@event.listens_for(Recipe, "before_insert")
+@event.listens_for(Recipe, "before_update")
+def stamp_ingredients_version(mapper, connection, target):
+    state = inspect(target)
+    if state.persistent and not state.attrs.ingredients.history.has_changes():
+        return
+    target.ingredients_version = max(time.time_ns() // 1_000_000, (target.ingredients_version or 0) + 1)
+
+
+@event.listens_for(Recipe, "after_insert")
+@event.listens_for(Recipe, "after_update")
+def store_recipe_ingredients(mapper, connection, target):
+    state = inspect(target)
+    if state.persistent and not state.attrs.ingredients.history.has_changes():
+        return
+    connection.execute(delete(RecipeIngredient).where(RecipeIngredient.recipe_id == target.id))
+    rows = recipe_ingredient_rows(target.id, target.ingredients)
+    if rows:
+        connection.execute(insert(RecipeIngredient), rows)
+
+
+@event.listens_for(Recipe, "after_delete")
+def delete_recipe_ingredients(mapper, connection, target):
+    connection.execute(delete(RecipeIngredient).where(RecipeIngredient.recipe_id == target.id))
+
+
+@event.listens_for(Recipe, "after_delete")
+def delete_nutrition_summary(mapper, connection, target):
+    connection.execute(delete(NutritionSummary).where(NutritionSummary.recipe_id == target.id))
+
+
+def recipe_ingredient_rows(recipe_id: int, ingredients: str | list[dict]) -> list[dict]:
+    return [{"recipe_id": recipe_id, "position": position, **parse_ingredient(line)}
+            for position, line in enumerate(ingredient_lines(ingredients))]
+
+
+def rebuild_recipe_ingredients(batch_size: int = 500):
+    """(Re)parses the ingredients of every recipe into RecipeIngredient rows"""
+
+    db.session.execute(delete(RecipeIngredient))
+    last_id = 0
+    while True:
+        batch = db.session.execute(
+            db.select(Recipe.id, Recipe.ingredients).where(Recipe.id > last_id).order_by(Recipe.id).limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        rows = [row for recipe_id, ingredients in batch for row in recipe_ingredient_rows(recipe_id, ingredients)]
+        if rows:
+            db.session.execute(insert(RecipeIngredient), rows)
+        last_id = batch[-1][0]
+    db.session.commit()
+
+
+# Canonical ingredient -> recipes, for /api/pantry. Each worker keeps its own, see sync_pantry_index()
+pantry_index = PantryIndex()
+pantry_sync = {"version": None, "seen": {}}
+pantry_sync_lock = Lock()
+
+
+def sync_pantry_index():
+    """Loads pantry_index on first use, then re-reads only the ingredients of recipes whose ingredients changed
+    since the last sync, found by Recipe.ingredients_version, so saves by other workers and commands show up too.
+    Deleted recipes are removed by delete_recipe() in this worker and when /api/pantry can't find them in the
+    others"""
+
+    with pantry_sync_lock:
+        now = time.time_ns() // 1_000_000
+        if pantry_sync["version"] is None:
+            pantry_index.load(db.session.execute(
+                db.select(RecipeIngredient.recipe_id, RecipeIngredient.name).where(RecipeIngredient.name != "")
+            ))
+            pantry_sync["version"] = now
+            return
+
+        since = pantry_sync["version"] - PANTRY_SYNC_OVERLAP_MS
+        seen = {recipe_id: version for recipe_id, version in pantry_sync["seen"].items() if version > since}
+        changed = {recipe_id: version for recipe_id, version in db.session.execute(
+            db.select(Recipe.id, Recipe.ingredients_version).where(Recipe.ingredients_version > since)
+        ) if seen.get(recipe_id) != version}
+        changed_ids = list(changed)
+        for start in range(0, len(changed_ids), 500):
+            names = {recipe_id: set() for recipe_id in changed_ids[start:start + 500]}
+            for recipe_id, name in db.session.execute(
+                db.select(RecipeIngredient.recipe_id, RecipeIngredient.name)
+                .where(RecipeIngredient.recipe_id.in_(list(names)), RecipeIngredient.name != "")
+            ):
+                names[recipe_id].add(name)
+            for recipe_id, recipe_names in names.items():
+                pantry_index.update(recipe_id, recipe_names)
+        pantry_sync["seen"] = {**seen, **changed}
+        pantry_sync["version"] = max(now, *changed.values()) if changed else now
+
+
+def rebuild_search_index():
+    """(Re)creates the full-text index from every recipe in the database"""
+
+    db.session.execute(text("DROP TABLE IF EXISTS recipes_fts"))
+    db.session.execute(text(RECIPE_FTS_DDL))
+    for recipe in db.session.execute(db.select(Recipe)).scalars():
+        db.session.execute(
+            text("INSERT INTO recipes_fts (rowid, title, description, ingredients, instructions) "
+                 "VALUES (:id, :title, :description, :ingredients, :instructions)"),
+            recipe_search_document(recipe)
+        )
+    db.session.commit()
+
+
+class EdamamCache(db.Model):
+    """Edamam nutrition analyses keyed by a hash of the recipe's canonical ingredient lines"""
+    __tablename__ = "edamam_cache"
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    total_nutrients: Mapped[dict] = mapped_column(JSON, nullable=False)
+    total_daily: Mapped[dict] = mapped_column(JSON, nullable=False)
+    created_at: Mapped[float] = mapped_column(Float, nullable=False)
+    last_used_at: Mapped[float] = mapped_column(Float, nullable=False, index=True)
+    hits: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class NutritionJob(db.Model):
+    """Durable queue of recipes waiting for their nutrition to be analyzed by the nutrition workers"""
+    __tablename__ = "nutrition_jobs"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    recipe_id: Mapped[int] = mapped_column(Integer, ForeignKey("recipes.id"), nullable=False, index=True)
+    # pending -> running -> done, or back to pending with a later run_after until it runs out of attempts (failed)
+    status: Mapped[str] = mapped_column(String(10), nullable=False, default="pending", index=True)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    run_after: Mapped[float] = mapped_column(Float, nullable=False)
+    locked_at: Mapped[float] = mapped_column(Float, nullable=True)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+
+
+class ImportJob(db.Model):
+    """Bulk recipe imports waiting to be run by the background workers, see run_import_job()"""
+    __tablename__ = "import_jobs"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    author_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    author: Mapped["User"] = relationship()
+    # The uploaded list of URLs or sitemap
+    source: Mapped[str] = mapped_column(Text, nullable=False)
+    # pending -> running -> done, or failed when the source can't be read or it runs out of attempts
+    status: Mapped[str] = mapped_column(String(10), nullable=False, default="pending", index=True)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[float] = mapped_column(Float, nullable=False)
+    locked_at: Mapped[float] = mapped_column(Float, nullable=True)
+    # ImportReport fields once done
+    report: Mapped[dict] = mapped_column(JSON, nullable=True)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+
+
+class AICompletionCache(db.Model):
+    """Persistent backend of the AI recipe cache, see cached_ai_recipe_text()"""
+    __tablename__ = "ai_completion_cache"
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    recipe_text: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[float] = mapped_column(Float, nullable=False, index=True)
+
+
+class AIRecipeDraft(db.Model):
+    """AI recipes generated over /ai-recipe/stream or as variations, waiting to be saved by save_ai_recipe()"""
+    __tablename__ = "ai_recipe_drafts"
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    recipe: Mapped[dict] = mapped_column(JSON, nullable=False)
+    created_at: Mapped[float] = mapped_column(Float, nullable=False, index=True)
+
+
+def add_missing_columns():
+    """db.create_all() only creates missing tables, so add any columns (and their indexes)
+    that were added to existing models since the database was created"""
+
+    for model_table in db.metadata.sorted_tables:
+        existing = {row[1] for row in db.session.execute(text(f'PRAGMA table_info("{model_table.name}")'))}
+        for model_column in model_table.columns:
+            if model_column.name not in existing:
+                column_type = model_column.type.compile(db.engine.dialect)
+                definition = f'"{model_column.name}" {column_type}'
+                # SQLite only adds NOT NULL columns that have a default for the existing rows
+                default = model_column.server_default
+                if default is not None:
+                    definition += f"{'' if model_column.nullable else ' NOT NULL'} DEFAULT {default.arg}"
+                db.session.execute(text(f'ALTER TABLE "{model_table.name}" ADD COLUMN {definition}'))
+        db.session.commit()
+        for index in model_table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
 with app.app_context():
     db.create_all()
+    add_missing_columns()
+    # WAL lets page views keep reading while the nutrition workers write
+    db.session.execute(text("PRAGMA journal_mode=WAL"))
+
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Rebuilds the recipe full-text search index."""
+    rebuild_search_index()
+
+
+@app.cli.command("rebuild-ingredients")
+def rebuild_ingredients_command():
+    """Parses every recipe's ingredients into the recipe_ingredients table again, e.g. after changing ingredients.py."""
+    rebuild_recipe_ingredients()
+    click.echo(f"Parsed {db.session.execute(db.select(func.count()).select_from(RecipeIngredient)).scalar()} "
+               f"ingredient lines")
 
 
 @app.route("/")
 def home():
-    result = db.session.execute(db.select(Recipe))
-    recipes = result.scalars().all()[::-1]
-
-    likes = {}
-    if current_user.is_authenticated:
-        for recipe in recipes:
-            # Check if the user has liked this recipe
-            liked = any(like.user_id == current_user.id for like in recipe.liked_by_users)
-            likes[recipe.id] = liked
-    return render_template("index.html", recipes=recipes, likes=likes)
+    cursor = request.args.get("cursor", type=int)
+    nutrition_query = NutritionQuery.from_request()
+    recipes, next_cursor = load_feed_page(cursor, nutrition=nutrition_query)
+    recipe_ids = [recipe.id for recipe in recipes]
+    like_counts = count_likes(recipe_ids)
+    likes = current_user_likes(recipe_ids)
+    nutrition = NutritionFacts.for_recipes(recipes)
+
+    # Infinite scroll requests only need the next batch of cards
+    template = "feed-cards.html" if request.args.get("partial") else "index.html"
+    return render_template(
+        template,
+        recipes=recipes,
+        likes=likes,
+        like_counts=like_counts,
+        nutrition=nutrition,
+        next_cursor=next_cursor,
+        nutrition_args=nutrition_query.args,
+    )
 
 
 # TODO fix ingredients/change form to allow for list[dict]
@@ -201,10 +698,7 @@ def add_recipe():
         filepath = None
         image_url = None
         if form.image_upload.data:
-            uploaded_file = form.image_upload.data
-            image_uuid = uuid_from_filename(uploaded_file.filename)
-            filepath = "images/recipes/" + image_uuid
-            uploaded_file.save(os.path.join(app.config['RECIPE_PHOTO_FOLDER'], image_uuid))
+            filepath = "images/recipes/" + store_image(form.image_upload.data, app.config['RECIPE_PHOTO_FOLDER'])
         elif form.image_url.data:
             image_url = form.image_url.data
 
@@ -232,11 +726,9 @@ def add_recipe():
 
         db.session.add(new_recipe)
         db.session.commit()
-
-        ingredients_list = markup_to_list(form.ingredients.data)
-        edamam_ingredients = oil_converter(form.title.data, ingredients_list)
-        edamam_data = edamam_nutrition_analysis(form.title.data, edamam_ingredients)
-        nutrition_to_db(new_recipe, edamam_data["totalNutrients"], edamam_data["totalDaily"])
+        enqueue_nutrition(new_recipe)
+        if filepath:
+            process_image_later(Recipe, new_recipe.id, filepath)
 
         return redirect(url_for("display_recipe", recipe_title=form.title.data))
 
@@ -247,29 +739,6 @@ def add_recipe():
 @app.route("/recipe/<string:recipe_title>", methods=["GET", "POST"])
 def display_recipe(recipe_title):
     recipe = Recipe.query.filter(Recipe.title == recipe_title).first()
-    likes = Like.query.filter(Like.recipe_id == recipe.id).all()
-    nutrients = NutritionFacts(recipe.id)
-
-    # ingredients = "<ul> "
-    # ing_list = recipe.ingredients
-    # for ing in ing_list:
-    #     ing_full = f"{ing["amount"]} {ing["unit"]} {ing["ingredient"]}"
-    #     ingredients += f"<li>{ing_full}</li> "
-    # ingredients += "</ul>"
-
-    recipe_url = None
-    recipe_source = None
-    if recipe.recipe_url:
-        recipe_url = "https://www." + recipe.recipe_url
-        recipe_domain_name = recipe.recipe_url.split(".com")[0]
-        if recipe_domain_name == "allrecipes":
-            recipe_source = "images/sources/allrecipes.svg"
-
-    current_user_liked = False
-    if current_user.is_authenticated:
-        for like in recipe.liked_by_users:
-            if current_user.id == like.user_id:
-                current_user_liked = True
 
     comment_form = CommentForm()
     if comment_form.validate_on_submit():
@@ -283,34 +752,70 @@ def display_recipe(recipe_title):
             recipe=recipe
         )
         db.session.add(new_comment)
+        bump_versions(Recipe, recipe.id)
         db.session.commit()
         return redirect(url_for("display_recipe", recipe_title=recipe_title))
 
-    return render_template(
-        "recipe.html",
-        recipe=recipe,
-        # ingredients=ingredients,
-        nutrients=nutrients,
-        recipe_source=recipe_source,
-        recipe_url=recipe_url,
-        current_user=current_user,
-        likes=likes,
-        currently_liked=current_user_liked,
-        comment_form=comment_form
-    )
+    # Only runs when the client's copy is out of date, see conditional_page()
+    def render():
+        likes = Like.query.filter(Like.recipe_id == recipe.id).all()
+        nutrients = NutritionFacts.for_recipe(recipe)
+        nutrition_status = nutrition_job_status(recipe.id)
+
+        # ingredients = "<ul> "
+        # ing_list = recipe.ingredients
+        # for ing in ing_list:
+        #     ing_full = f"{ing["amount"]} {ing["unit"]} {ing["ingredient"]}"
+        #     ingredients += f"<li>{ing_full}</li> "
+        # ingredients += "</ul>"
+
+        recipe_url = None
+        recipe_source = None
+        if recipe.recipe_url:
+            recipe_url = "https://www." + recipe.recipe_url
+            recipe_domain_name = recipe.recipe_url.split(".com")[0]
+            if recipe_domain_name == "allrecipes":
+                recipe_source = "images/sources/allrecipes.svg"
+
+        current_user_liked = False
+        if current_user.is_authenticated:
+            for like in recipe.liked_by_users:
+                if current_user.id == like.user_id:
+                    current_user_liked = True
+
+        return render_template(
+            "recipe.html",
+            recipe=recipe,
+            # ingredients=ingredients,
+            nutrients=nutrients,
+            nutrition_status=nutrition_status,
+            recipe_source=recipe_source,
+            recipe_url=recipe_url,
+            current_user=current_user,
+            likes=likes,
+            currently_liked=current_user_liked,
+            comment_form=comment_form
+        )
+
+    return conditional_page(render, recipe_page_versions(recipe))
 
 
 @app.route("/like/<int:recipe_id>", methods=["POST"])
 def like_recipe(recipe_id):
     recipe = Recipe.query.get_or_404(recipe_id)
     like = Like.query.filter_by(user_id=current_user.id, recipe_id=recipe.id).first()
+    # The user's version covers their list of liked recipes
     if like:
         db.session.delete(like)
+        bump_versions(Recipe, recipe.id)
+        bump_versions(User, current_user.id)
         db.session.commit()
         return jsonify({"status": "unliked", "likes_count": len(recipe.liked_by_users)})
     else:
         new_like = Like(user=current_user, recipe=recipe)
         db.session.add(new_like)
+        bump_versions(Recipe, recipe.id)
+        bump_versions(User, current_user.id)
         db.session.commit()
         return jsonify({"status": "liked", "likes_count": len(recipe.liked_by_users)})
 
@@ -339,15 +844,10 @@ def edit_recipe(recipe_title):
 
     if edit_form.validate_on_submit():
 
-        filepath = recipe.image_filepath
+        old_filepath = filepath = recipe.image_filepath
         image_url = recipe.image_url
         if edit_form.image_upload.data:
-            uploaded_file = edit_form.image_upload.data
-            image_uuid = uuid_from_filename(uploaded_file.filename)
-            filepath = "images/recipes/" + image_uuid
-            if recipe.image_filepath:
-                os.remove(f"static/{recipe.image_filepath}")
-            uploaded_file.save(os.path.join(app.config['RECIPE_PHOTO_FOLDER'], image_uuid))
+            filepath = "images/recipes/" + store_image(edit_form.image_upload.data, app.config['RECIPE_PHOTO_FOLDER'])
         elif edit_form.image_url.data:
             image_url = edit_form.image_url.data
 
@@ -358,16 +858,16 @@ def edit_recipe(recipe_title):
         recipe.ingredients = edit_form.ingredients.data
         recipe.instructions = edit_form.instructions.data
         recipe.type_diet = diets_string
+        if filepath != old_filepath:
+            recipe.image_width = recipe.image_height = recipe.image_widths = None
         recipe.image_filepath = filepath
         recipe.image_url = image_url
+        recipe.version = version_bump(Recipe)
         db.session.commit()
-
-        Nutrition.query.filter_by(recipe_id=recipe.id).delete()
-
-        ingredients_list = markup_to_list(edit_form.ingredients.data)
-        edamam_ingredients = oil_converter(edit_form.title.data, ingredients_list)
-        edamam_data = edamam_nutrition_analysis(edit_form.title.data, edamam_ingredients)
-        nutrition_to_db(recipe, edamam_data["totalNutrients"], edamam_data["totalDaily"])
+        enqueue_nutrition(recipe)
+        if filepath != old_filepath:
+            release_image(old_filepath)
+            process_image_later(Recipe, recipe.id, filepath)
 
         return redirect(url_for("display_recipe", recipe_title=recipe.title))
 
@@ -383,81 +883,170 @@ def edit_recipe(recipe_title):
 @app.route("/delete/<int:recipe_id>")
 def delete_recipe(recipe_id):
     recipe_to_delete = db.get_or_404(Recipe, recipe_id)
+    filepath = recipe_to_delete.image_filepath
     db.session.delete(recipe_to_delete)
     db.session.commit()
+    fragment_cache.invalidate(recipe_id)
+    pantry_index.remove(recipe_id)
+    release_image(filepath)
     return redirect(url_for("home"))
 
 
 @app.route("/search")
 def search_recipe():
     search_param = request.args.get('query')
+    page = max(request.args.get("page", 1, type=int), 1)
     recipes = None
+    nutrition = {}
+    has_next = False
+    nutrition_query = NutritionQuery.from_request()
     if search_param:
-        formatted_param = re.sub(r'[^a-zA-Z0-9\- ]', "", search_param)
-        param_list = formatted_param.split()
-        recipe_list = []
-        # TODO ? Add "description" to what is searched?
-        for substring in param_list:
-            title_results = Recipe.query.filter(Recipe.title.like(f'%{substring}%')).all()
-            recipe_list.extend(title_results)
-            ingredients_results = Recipe.query.filter(Recipe.ingredients.like(f'%{substring}%')).all()
-            recipe_list.extend(ingredients_results)
-            instructions_results = Recipe.query.filter(Recipe.instructions.like(f'%{substring}%')).all()
-            recipe_list.extend(instructions_results)
-        recipes = list(dict.fromkeys(recipe_list))[::-1]
+        recipes, has_next = full_text_search(search_param, page, nutrition=nutrition_query)
+        nutrition = NutritionFacts.for_recipes(recipes)
     return render_template("search.html",
                            search_param=search_param,
                            recipes=recipes,
+                           nutrition=nutrition,
+                           page=page,
+                           has_next=has_next,
+                           nutrition_args=nutrition_query.args,
                            )
 
 
 @app.route("/ai-recipe", methods=["GET", "POST"])
 def ai_recipe():
+    """Generates one recipe, or several variations side by side, in JSON mode. Variations are
+    requested concurrently so they take about as long as a single recipe"""
+
     form = AIQueryForm()
     if form.validate_on_submit():
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a chef with knowledge in every culture and cuisine. Use only "
-                               "user provided and common household ingredients to respond with a recipe "
-                               "with the name of the recipe in bold, separated by '**Description:**', "
-                               "'**Number of Servings:**', '**Ingredients:**', and '**Instructions:**'."
-                },
-                {
-                    "role": "user",
-                    "content": form.query.data,
-                }
-            ],
-            model="llama3-8b-8192",
-        )
-        recipe_text = chat_completion.choices[0].message.content
-        # recipe_text is  split and saved to session to be saved in save_ai_recipe()
-        recipe_html = markdown(recipe_text)
-        # recipe_html is displayed directly to the ai-recipe page
-
-        title = recipe_text.split("**")[1]
-        recipe_split1 = recipe_text.split("**Instructions:**")
-        instructions = recipe_split1[1].strip()
-        recipe_split2 = recipe_split1[0].split("**Ingredients:**")
-        ingredients = recipe_split2[1].strip()
-        recipe_split3 = recipe_split2[0].split("**Number of Servings:**")
-        num_servings = recipe_split3[1].strip()[0]
-        recipe_split4 = recipe_split3[0].split("**Description:**")
-        description = recipe_split4[1].strip()
-
-        session['ai_recipe'] = {
-            'title': title,
-            'description': description,
-            'servings': num_servings,
-            'ingredients': ingredients,
-            'instructions': instructions
-        }
+        query, variations = form.query.data, form.variations.data
+        cache_keys = [ai_cache_key(query, AI_RECIPE_JSON_PROMPT, variation) for variation in range(variations)]
+        recipes = [None] * variations
+        if not form.regenerate.data:
+            for variation, cache_key in enumerate(cache_keys):
+                cached_json = cached_ai_recipe_text(cache_key)
+                recipes[variation] = validate_ai_recipe(cached_json) if cached_json else None
+
+        missing = [variation for variation, recipe in enumerate(recipes) if recipe is None]
+        user_key = ai_user_key()
+        with ThreadPoolExecutor(max_workers=max(len(missing), 1)) as executor:
+            futures = {variation: executor.submit(generate_ai_recipe, query, user_key, variation, variations)
+                       for variation in missing}
+        busy = None
+        for variation, future in futures.items():
+            try:
+                recipe_json, recipes[variation] = future.result()
+            except SchedulerBusy as e:
+                busy = e
+                continue
+            except Exception as e:
+                app.logger.warning(f"AI recipe generation failed: {e!r}")
+                continue
+            cache_ai_recipe_text(cache_keys[variation], recipe_json)
+
+        recipes = [recipe for recipe in recipes if recipe]
+        if not recipes:
+            if busy:
+                flash(f"{busy}, please try again in {busy.retry_after} seconds.")
+                return render_template("ai-recipe.html", form=form), 429, {"Retry-After": str(busy.retry_after)}
+            flash("Sorry, something went wrong writing that recipe, please try again!")
+            return render_template("ai-recipe.html", form=form)
+        if len(recipes) < variations:
+            flash(f"Only {len(recipes)} of the {variations} variations could be written, please try again for more.")
+
+        # recipes are saved to session (or as drafts, several don't fit in the cookie) for save_ai_recipe()
+        for key in ('ai_recipe', 'ai_recipe_draft', 'ai_recipe_variants'):
+            session.pop(key, None)
+        if len(recipes) == 1:
+            session['ai_recipe'] = recipes[0]
+        else:
+            session['ai_recipe_variants'] = [str(uuid4()) for _ in recipes]
+            for draft_id, recipe in zip(session['ai_recipe_variants'], recipes):
+                store_ai_recipe_draft(draft_id, recipe)
 
-        return render_template("ai-recipe.html", form=form, recipe=recipe_html, ai_recipe_gen=True)
+        # displayed directly on the ai-recipe page
+        recipes_html = [markdown(ai_recipe_markdown(recipe)) for recipe in recipes]
+        return render_template("ai-recipe.html", form=form, recipes=recipes_html, ai_recipe_gen=True)
     return render_template("ai-recipe.html", form=form)
 
 
+@app.route("/ai-recipe/stream", methods=["POST"])
+def ai_recipe_stream():
+    """Streams the generated recipe to the browser as Server-Sent Events while Groq produces it:
+    "token" events as text arrives, then one "done" event with the rendered recipe (or "error")"""
+
+    form = AIQueryForm()
+    if not form.validate_on_submit():
+        return jsonify({"errors": form.errors}), 400
+
+    # The session cookie goes out with the headers, before the recipe exists, so the finished
+    # recipe is stored server-side under an id that save_ai_recipe() can find
+    draft_id = str(uuid4())
+    session.pop('ai_recipe', None)
+    session.pop('ai_recipe_variants', None)
+    session['ai_recipe_draft'] = draft_id
+    query = form.query.data
+    cache_key = ai_cache_key(query)
+    cached_text = None if form.regenerate.data else cached_ai_recipe_text(cache_key)
+    messages = ai_recipe_messages(query)
+    ticket = None
+    if cached_text is None:
+        # Admitted (or turned away) before the stream starts, so a saturated server answers with a plain 429
+        try:
+            ticket = ai_scheduler.acquire(ai_user_key(), estimate_ai_tokens(messages))
+        except SchedulerBusy as e:
+            return (jsonify({"error": f"{e}, please try again in {e.retry_after} seconds."}), 429,
+                    {"Retry-After": str(e.retry_after)})
+
+    def generate():
+        try:
+            if cached_text is not None:
+                recipe_text = cached_text
+                yield server_sent_event("token", recipe_text)
+                store_ai_recipe_draft(draft_id, parse_ai_recipe(recipe_text))
+            else:
+                chunks = []
+                tokens_used = None
+                try:
+                    # Closed on the way out, so a client that goes away mid-recipe stops the completion too
+                    with client.chat.completions.create(
+                        messages=messages,
+                        model=AI_RECIPE_MODEL,
+                        max_tokens=AI_RECIPE_MAX_TOKENS,
+                        stream=True,
+                    ) as stream:
+                        for chunk in stream:
+                            # Groq reports usage on the last chunk
+                            usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+                            if usage:
+                                tokens_used = usage.total_tokens
+                            token = chunk.choices[0].delta.content if chunk.choices else None
+                            if token:
+                                chunks.append(token)
+                                yield server_sent_event("token", token)
+                finally:
+                    recipe_text = "".join(chunks)
+                    ticket.release(tokens_used or estimate_ai_tokens(messages, recipe_text))
+                store_ai_recipe_draft(draft_id, parse_ai_recipe(recipe_text))
+                cache_ai_recipe_text(cache_key, recipe_text)
+        except Exception as e:
+            app.logger.warning(f"AI recipe stream failed: {e!r}")
+            yield server_sent_event("error", "Sorry, something went wrong writing that recipe, please try again!")
+            return
+        yield server_sent_event("done", markdown(recipe_text))
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    if ticket:
+        # Frees the slot even if the client goes away before the stream starts (release is idempotent)
+        response.call_on_close(ticket.release)
+    return response
+
+
 # TODO fix save_ai_recipe() for ingredients list[dict]
 @app.route("/save-ai-recipe", methods=["POST"])
 def save_ai_recipe():
@@ -465,6 +1054,14 @@ def save_ai_recipe():
         return redirect(url_for("home"))
 
     recipe = session.get('ai_recipe')
+    draft_id = session.get('ai_recipe_draft')
+    variant = request.form.get('variant', type=int)
+    variants = session.get('ai_recipe_variants') or []
+    if variant is not None and 0 <= variant < len(variants):
+        recipe, draft_id = None, variants[variant]
+    if not recipe and draft_id:
+        draft = db.session.get(AIRecipeDraft, draft_id)
+        recipe = draft.recipe if draft else None
     if not recipe:
         flash("No AI-generated recipe to save!")
         return redirect(url_for("ai_recipe"))
@@ -491,11 +1088,7 @@ def save_ai_recipe():
 
     db.session.add(new_recipe)
     db.session.commit()
-
-    ingredients_list = markup_to_list(ingredients)
-    edamam_ingredients = oil_converter(title, ingredients_list)
-    edamam_data = edamam_nutrition_analysis(title, edamam_ingredients)
-    nutrition_to_db(new_recipe, edamam_data["totalNutrients"], edamam_data["totalDaily"])
+    enqueue_nutrition(new_recipe)
 
     return redirect(url_for("display_recipe", recipe_title=title))
 
@@ -510,96 +1103,75 @@ def recipe_saver():
 
     if recipe_url_form.validate_on_submit():
 
-        split_url = None
-        url_www_split = recipe_url_form.recipe_url.data.split("www.")
-        if len(url_www_split) == 1:
-            split_url = url_www_split[0]
-        elif len(url_www_split) == 2:
-            split_url = url_www_split[1]
-
-        url_com_split = split_url.split(".com")
-        if url_com_split[0] not in ALLOWED_URLS:
-            flash(f"Functionality for {url_com_split[0]} has not been integrated yet")
+        split_url, recipe_source = split_recipe_url(recipe_url_form.recipe_url.data)
+        if recipe_source not in SITE_EXTRACTORS:
+            flash(f"Functionality for {recipe_source} has not been integrated yet")
             return redirect(url_for("recipe_saver"))
-        # elif url_com_split[0] == "allrecipes":
-        #     pass
 
         recipe_url_result = Recipe.query.filter(Recipe.recipe_url == split_url).first()
         if recipe_url_result:
             flash(f"Someone has already saved that recipe! Try searching for it instead")
             return redirect(url_for("recipe_saver"))
 
-        response = requests.get(recipe_url_form.recipe_url.data)
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        title = soup.find("h1", {"class": "article-heading"}).text
-        description = soup.find("p", {"class": "article-subheading"}).text
-
-        ingredients = []
-        ing_list = soup.find_all('li', {'class': 'mm-recipes-structured-ingredients__list-item'})
-        for ing in ing_list:
-            ing_components = {"amount": ing.find("span", {"data-ingredient-quantity": "true"}).text,
-                              "unit": ing.find("span", {"data-ingredient-unit": "true"}).text,
-                              "ingredient": ing.find("span", {"data-ingredient-name": "true"}).text}
-            ingredients.append(ing_components)
-
-        instructions = "<ol> "
-        instructions_soup = soup.find_all("li", {
-            "class": "comp mntl-sc-block mntl-sc-block-startgroup mntl-sc-block-group--LI"})
-        for step in instructions_soup:
-            step_text = step.find("p").text
-            instructions += f"<li>{step_text}</li> "
-        instructions += f"</ol>"
-
-        recipe_details = soup.find_all(class_="mm-recipes-details__item")
-        total_time = None
-        num_servings = None
-        for detail in recipe_details:
-            label = detail.find(class_='mm-recipes-details__label')
-            value = detail.find(class_='mm-recipes-details__value')
-            if label and "Total Time:" in label.text:
-                total_time = value.text.strip()
-                continue
-            if label and "Servings" in label.text:
-                num_servings = value.text.strip()  # Get the text and strip any extra whitespace
-                continue
+        try:
+            page_html = page_cache.fetch(recipe_url_form.recipe_url.data)
+        except requests.RequestException:
+            flash(f"Couldn't reach {recipe_source} right now, please try again later")
+            return redirect(url_for("recipe_saver"))
+        try:
+            recipe_details = extract_recipe(recipe_source, page_html)
+        except ExtractionError as e:
+            flash(str(e))
+            return redirect(url_for("recipe_saver"))
+        title = recipe_details["title"]
 
-        image = soup.find("img", {"class": "primary-image__image"})
-        if image:
-            image_url = image["src"]
-        # What about 'class': 'universal-image__image'? Reason I didn't use as secondary option?
-        else:
-            image = soup.find("img", {"id": "mntl-sc-block-image_1-0"})
-            image_url = image["data-hi-res-src"]
+        if Recipe.query.filter(Recipe.title == title).first():
+            flash(f"A recipe called \"{title}\" already exists! Try searching for it instead")
+            return redirect(url_for("recipe_saver"))
 
         new_recipe = Recipe(
-            title=title,
-            description=description,
-            ingredients=ingredients,
-            instructions=instructions,
-            default_servings=num_servings,
-            time_to_cook=total_time,
+            **recipe_details,
             author=current_user,
-            image_url=image_url,
             recipe_url=split_url,
-            recipe_source=url_com_split[0]
+            recipe_source=recipe_source
         )
         db.session.add(new_recipe)
         db.session.commit()
+        enqueue_nutrition(new_recipe)
 
-        ingredients_list = []
-        for ing in ingredients:
-            ingredient = f"{ing["amount"]} {ing["unit"]} {ing["ingredient"]}"
-            ingredients_list.append(ingredient)
+        return redirect(url_for("display_recipe", recipe_title=title))
+    return render_template("recipe-saver.html", form=recipe_url_form, bulk_form=BulkImportForm(),
+                           sites=SITE_EXTRACTORS)
 
-        print(ingredients_list)
-        # ingredients_list = markup_to_list(ingredients)
-        edamam_ingredients = oil_converter(title, ingredients_list)
-        edamam_data = edamam_nutrition_analysis(title, edamam_ingredients)
-        nutrition_to_db(new_recipe, edamam_data["totalNutrients"], edamam_data["totalDaily"])
 
-        return redirect(url_for("display_recipe", recipe_title=title))
-    return render_template("recipe-saver.html", form=recipe_url_form)
+@app.route("/recipe-saver/bulk", methods=["POST"])
+def bulk_recipe_saver():
+    if not current_user.is_authenticated:
+        return redirect(url_for("home"))
+
+    bulk_form = BulkImportForm()
+    if not bulk_form.validate_on_submit():
+        for error in bulk_form.urls_file.errors:
+            flash(error)
+        return redirect(url_for("recipe_saver"))
+
+    # Fetching and parsing up to BULK_IMPORT_MAX_URLS pages takes minutes, so the workers run the import
+    job = enqueue_import(current_user, bulk_form.urls_file.data.read().decode("utf-8", errors="replace"))
+    return redirect(url_for("bulk_import_status", job_id=job.id))
+
+
+@app.route("/recipe-saver/bulk/<int:job_id>")
+def bulk_import_status(job_id):
+    if not current_user.is_authenticated:
+        return redirect(url_for("home"))
+
+    job = db.session.get(ImportJob, job_id)
+    if not job or job.author_id != current_user.id:
+        return "", 404
+    if job.status == "failed":
+        flash(f"The import failed: {job.last_error}")
+    return render_template("recipe-saver.html", form=GetRecipeForm(), bulk_form=BulkImportForm(), import_job=job,
+                           report=ImportReport(**job.report) if job.report else None, sites=SITE_EXTRACTORS)
 
 
 @app.route("/contact", methods=["GET", "POST"])
@@ -630,12 +1202,18 @@ def send_email(name, email, phone, message):
 @app.route("/user/<string:user_name>")
 def display_profile(user_name):
     user = User.query.filter(User.name == user_name).first()
-    user_recipes = Recipe.query.filter(Recipe.author_id == user.id).all()[::-1]
+    own_profile = current_user.is_authenticated and current_user.id == user.id
+
+    def render():
+        user_recipes = Recipe.query.filter(Recipe.author_id == user.id).all()[::-1]
+
+        liked_recipes = []
+        if own_profile:
+            liked_recipes = db.session.query(Recipe).join(Like).filter(Like.user_id == current_user.id).all()[::-1]
+        return render_template("profile.html", user=user, recipes=user_recipes, liked_recipes=liked_recipes)
 
-    liked_recipes = []
-    if user_name == current_user.name:
-        liked_recipes = db.session.query(Recipe).join(Like).filter(Like.user_id == current_user.id).all()[::-1]
-    return render_template("profile.html", user=user, recipes=user_recipes, liked_recipes=liked_recipes)
+    versions, counts = profile_page_versions(user, own_profile)
+    return conditional_page(render, versions, *counts)
 
 
 @app.route("/edit-profile", methods=["GET", "POST"])
@@ -650,15 +1228,14 @@ def edit_profile():
             current_user.password = profile_edit_form.password.data
         if profile_edit_form.description.data != "":
             current_user.description = profile_edit_form.description.data
+        old_filepath = current_user.image_filepath
         if profile_edit_form.image_upload.data:
-            uploaded_file = profile_edit_form.image_upload.data
-            image_uuid = uuid_from_filename(uploaded_file.filename)
-            filepath = "images/profiles/" + image_uuid
-            if current_user.image_filepath:
-                os.remove(f"static/{current_user.image_filepath}")
-            uploaded_file.save(os.path.join(app.config['PROFILE_PHOTO_FOLDER'], image_uuid))
-            current_user.image_filepath = filepath
+            replace_profile_photo(profile_edit_form.image_upload.data)
+        current_user.version = version_bump(User)
         db.session.commit()
+        if current_user.image_filepath != old_filepath:
+            release_image(old_filepath)
+            process_image_later(User, current_user.id, current_user.image_filepath)
         return redirect(url_for("display_profile", user_name=current_user.name))
     return render_template(
         "register.html",
@@ -703,15 +1280,15 @@ def register2():
     form = RegisterCont()
     if form.validate_on_submit():
         current_user.description = form.description.data
+        # Shouldn't have a photo yet for new users but 'edge case' if they're reaccessing this page
+        old_filepath = current_user.image_filepath
         if form.image_upload.data:
-            uploaded_file = form.image_upload.data
-            image_uuid = uuid_from_filename(uploaded_file.filename)
-            filepath = "images/profiles/" + image_uuid
-            if current_user.image_filepath:  # Shouldn't for new users but 'edge case' if they're reaccessing this page
-                os.remove(f"static/{current_user.image_filepath}")
-            uploaded_file.save(os.path.join(app.config['PROFILE_PHOTO_FOLDER'], image_uuid))
-            current_user.image_filepath = filepath
+            replace_profile_photo(form.image_upload.data)
+        current_user.version = version_bump(User)
         db.session.commit()
+        if current_user.image_filepath != old_filepath:
+            release_image(old_filepath)
+            process_image_later(User, current_user.id, current_user.image_filepath)
         return redirect(url_for("home"))
     return render_template("register2.html", form=form, current_user=current_user)
 
@@ -741,27 +1318,1160 @@ def logout():
     return redirect(url_for("home"))
 
 
+@app.route("/recipe-image/<int:recipe_id>/<int:width>.<any(webp, jpg):extension>")
+def recipe_image(recipe_id, width, extension):
+    """Serves a recipe's remote image_url from the local image proxy, resized to one of IMAGE_WIDTHS"""
+
+    image_url = db.session.execute(db.select(Recipe.image_url).where(Recipe.id == recipe_id)).scalar()
+    if not image_url or width not in IMAGE_WIDTHS:
+        return "", 404
+    if not image_proxy.enabled:
+        return redirect(image_url)
+    try:
+        path = image_proxy.variant(image_url, width, extension)
+    except ImageProxyBusy:
+        # Rather than keep the page waiting, let the browser fetch it from the source
+        return redirect(image_url)
+    except ImageProxyError as e:
+        app.logger.info(str(e))
+        return "", 404
+
+    # The link changes along with the image_url, so a current link's content never does
+    current = request.args.get("v") == ImageProxy.version(image_url)
+    response = send_file(path, mimetype=f"image/{'jpeg' if extension == 'jpg' else extension}", conditional=True,
+                         max_age=60 * 60 * 24 * 365 if current else 60)
+    response.cache_control.public = True
+    response.cache_control.immutable = current
+    return response
+
+
+@app.route("/metrics")
+def metrics():
+    # Process-local counters, only served with the METRICS_TOKEN. The client's address can't be trusted for
+    # this, since behind the reverse proxy every request comes from the proxy's
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not METRICS_TOKEN or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        return "", 404
+    return jsonify({
+        "http": http_client.stats(),
+        "edamam_cache": edamam_cache_stats,
+        "page_cache": page_cache.info(),
+        "image_proxy": image_proxy.info(),
+        "ai_cache": {**ai_recipe_cache.stats(), **ai_cache_stats},
+        "ai_scheduler": ai_scheduler.info(),
+        "ai_structured": ai_structured_stats,
+        "fragment_cache": fragment_cache.stats(),
+        "pantry_index": pantry_index.stats(),
+    })
+
+
 # REACT/VITE (?)
 @app.route('/api/data')
 def get_data():
     return jsonify({"message": "Hello from Flask!"})
 
 
+@app.route("/api/feed")
+def api_feed():
+    """Newest recipes first, e.g. only those with both ?ingredient=garlic&ingredient=rice, or filtered and sorted
+    by nutrition like ?max_kcal=500&sort=-protein (see NutritionQuery). Pass the returned next_cursor back as
+    ?cursor= for the next page"""
+
+    ingredients = [canonical_name(name) for name in request.args.getlist("ingredient")]
+    recipes, next_cursor = load_feed_page(request.args.get("cursor", type=int), api_limit(),
+                                          ingredients=[name for name in ingredients if name],
+                                          nutrition=NutritionQuery.from_request())
+    return api_response({"recipes": recipes_json(recipes, api_fields()), "next_cursor": next_cursor})
+
+
+@app.route("/api/search")
+def api_search():
+    query = request.args.get("q", "")
+    page = max(request.args.get("cursor", 1, type=int), 1)
+    recipes, has_next = (full_text_search(query, page, api_limit(), NutritionQuery.from_request()) if query
+                         else ([], False))
+    return api_response({"recipes": recipes_json(recipes, api_fields()), "next_cursor": page + 1 if has_next else None})
+
+
+@app.route("/api/pantry")
+def api_pantry():
+    """Recipes to cook from a pantry, e.g. ?ingredient=rice&ingredient=garlic&max_missing=2, fewest missing
+    ingredients first. Common staples like salt and oil count as on hand unless ?staples=0"""
+
+    pantry = list(dict.fromkeys(filter(None, (canonical_name(name) for name in request.args.getlist("ingredient")))))
+    if len(pantry) > PANTRY_MAX_INGREDIENTS:
+        raise APIError(f"At most {PANTRY_MAX_INGREDIENTS} ingredients per request")
+    page = max(request.args.get("cursor", 1, type=int), 1)
+    limit = api_limit()
+    max_missing = request.args.get("max_missing", type=int)
+    staples = PANTRY_STAPLES if request.args.get("staples", "1") == "1" else frozenset()
+
+    sync_pantry_index()
+    while True:
+        # One extra to know whether there's a next page
+        matches = pantry_index.match(pantry, page * limit + 1, max_missing, staples)[(page - 1) * limit:]
+        recipes = db.session.execute(
+            db.select(Recipe).options(selectinload(Recipe.author))
+            .where(Recipe.id.in_([match.recipe_id for match in matches]))
+        ).scalars().all()
+        recipes_by_id = {recipe.id: recipe for recipe in recipes}
+        # Recipes deleted by another worker are only noticed here
+        deleted = [match.recipe_id for match in matches if match.recipe_id not in recipes_by_id]
+        if not deleted:
+            break
+        for recipe_id in deleted:
+            pantry_index.remove(recipe_id)
+
+    has_next = len(matches) > limit
+    matches = matches[:limit]
+    recipes = recipes_json([recipes_by_id[match.recipe_id] for match in matches], api_fields())
+    for recipe, match in zip(recipes, matches):
+        recipe["pantry"] = {"coverage": match.coverage, "matched": match.matched, "missing": match.missing}
+    return api_response({"pantry": pantry, "recipes": recipes, "next_cursor": page + 1 if has_next else None})
+
+
+@app.route("/api/recipes")
+def api_recipes():
+    """Batch lookup, e.g. ?ids=3,1,2. Recipes come back in the requested order, ids that don't exist under missing"""
+
+    try:
+        recipe_ids = list(dict.fromkeys(int(recipe_id) for recipe_id in request.args.get("ids", "").split(",")
+                                        if recipe_id.strip()))
+    except ValueError:
+        raise APIError("ids must be a comma separated list of recipe ids")
+    if len(recipe_ids) > API_MAX_IDS:
+        raise APIError(f"At most {API_MAX_IDS} ids per request")
+
+    recipes = db.session.execute(
+        db.select(Recipe).options(selectinload(Recipe.author)).where(Recipe.id.in_(recipe_ids))
+    ).scalars().all()
+    recipes_by_id = {recipe.id: recipe for recipe in recipes}
+    return api_response({
+        "recipes": recipes_json([recipes_by_id[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes_by_id],
+                                api_fields()),
+        "missing": [recipe_id for recipe_id in recipe_ids if recipe_id not in recipes_by_id],
+    })
+
+
+@app.route("/api/recipes/<int:recipe_id>")
+def api_recipe(recipe_id):
+    recipe = db.session.get(Recipe, recipe_id)
+    if recipe is None:
+        raise APIError("No such recipe", 404)
+    return api_response({"recipe": recipes_json([recipe], api_fields("full"))[0]})
+
+
+@app.route("/api/recipes/<int:recipe_id>/nutrition")
+def api_recipe_nutrition(recipe_id):
+    recipe = db.session.get(Recipe, recipe_id)
+    if recipe is None:
+        raise APIError("No such recipe", 404)
+    return api_response({
+        "recipe_id": recipe_id,
+        "status": nutrition_job_status(recipe_id),
+        "nutrition": nutrition_json(NutritionFacts.for_recipe(recipe)),
+    })
+
+
+@app.route("/api/users/<string:user_name>")
+def api_user(user_name):
+    """A profile with one page of the user's recipes, newest first"""
+
+    user = db.session.execute(db.select(User).where(User.name == user_name)).scalar()
+    if user is None:
+        raise APIError("No such user", 404)
+    recipes, next_cursor = load_feed_page(request.args.get("cursor", type=int), api_limit(), author_id=user.id)
+    return api_response({
+        "user": {"id": user.id, "name": user.name, "description": user.description, "image": image_json(user)},
+        "recipes": recipes_json(recipes, api_fields()),
+        "next_cursor": next_cursor,
+    })
+
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    if path != "" and os.path.exists(app.static_folder + '/' + path):
+    # The Vite build is served from the site root, which is where its index.html links its assets
+    asset = path and (asset_index.get(path) or asset_index.get(f"react/{path}"))
+    if asset is None and os.path.splitext(path)[1]:
+        # A file that isn't indexed, a missing one 404s rather than getting the app's index.html
         return send_from_directory(app.static_folder, path)
+    asset = asset or asset_index.get("index.html") or asset_index.get("react/index.html")
+    if asset is None:
+        return "", 404
+    return asset_index.respond(asset, request)
+
+
+def static_asset(filename):
+    """Replaces Flask's static view: indexed files are answered from memory, uploaded photos from disk"""
+
+    asset = asset_index.get(filename)
+    if asset is None:
+        return send_from_directory(app.static_folder, filename)
+    # url_for('static') links carry the content hash, so those URLs never change content
+    return asset_index.respond(asset, request, immutable=request.args.get("v") == asset.etag)
+
+
+app.view_functions["static"] = static_asset
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == "static":
+        asset = asset_index.get(values.get("filename", ""))
+        if asset:
+            values.setdefault("v", asset.etag)
+
+
+@dataclass
+class NutritionQuery:
+    """Per-serving nutrition filters and sort for the feed and search, e.g. ?max_kcal=500&min_protein=30 and
+    ?sort=-protein (highest first) or ?sort=kcal, for any NUTRITION_LABEL label. Runs on NutritionSummary's
+    indexes, and only matches recipes whose nutrition has been computed"""
+    minimums: dict[str, float] = field(default_factory=dict)
+    maximums: dict[str, float] = field(default_factory=dict)
+    sort: str | None = None
+    descending: bool = False
+
+    @classmethod
+    def from_request(cls) -> "NutritionQuery":
+        query = cls()
+        for label in NUTRITION_LABEL:
+            if (minimum := request.args.get(f"min_{label}", type=float)) is not None:
+                query.minimums[label] = minimum
+            if (maximum := request.args.get(f"max_{label}", type=float)) is not None:
+                query.maximums[label] = maximum
+        sort = request.args.get("sort", "")
+        if sort.lstrip("-") in NUTRITION_LABEL:
+            query.sort, query.descending = sort.lstrip("-"), sort.startswith("-")
+        return query
+
+    def __bool__(self) -> bool:
+        return bool(self.minimums or self.maximums or self.sort)
+
+    @property
+    def args(self) -> dict:
+        """The query string arguments it came from, for links to other pages"""
+
+        args = {f"min_{label}": value for label, value in self.minimums.items()}
+        args |= {f"max_{label}": value for label, value in self.maximums.items()}
+        if self.sort:
+            args["sort"] = f"{'-' if self.descending else ''}{self.sort}"
+        return args
+
+    def conditions(self) -> list:
+        conditions = [getattr(NutritionSummary, label) >= value for label, value in self.minimums.items()]
+        conditions += [getattr(NutritionSummary, label) <= value for label, value in self.maximums.items()]
+        if self.sort:
+            conditions.append(getattr(NutritionSummary, self.sort).is_not(None))
+        return conditions
+
+    def order_by(self) -> list:
+        if not self.sort:
+            return []
+        sort_column = getattr(NutritionSummary, self.sort)
+        return [sort_column.desc() if self.descending else sort_column.asc()]
+
+
+def load_feed_page(cursor: int | None = None, limit: int = FEED_PAGE_SIZE, author_id: int | None = None,
+                   ingredients: list[str] = (), nutrition: NutritionQuery | None = None) -> tuple[list[Recipe], int | None]:
+    """Loads one page of the newest recipes (ids below the cursor), optionally only one author's, only those
+    using every given canonical ingredient or only those matching a NutritionQuery (in its order, if it sorts),
+    with their authors in a fixed number of queries. Returns the page and the cursor for the next page, or None
+    if this is the last page"""
+
+    query = db.select(Recipe).options(selectinload(Recipe.author)).order_by(Recipe.id.desc()).limit(limit + 1)
+    if nutrition:
+        query = query.join(NutritionSummary, NutritionSummary.recipe_id == Recipe.id).where(*nutrition.conditions())
+    if nutrition and nutrition.sort:
+        # Ties broken by the primary key, which the sort column's index already holds
+        sort_column = getattr(NutritionSummary, nutrition.sort)
+        query = query.order_by(None).order_by(*nutrition.order_by(), NutritionSummary.recipe_id.desc())
+        if cursor:
+            # Keyset pagination: everything after the cursor recipe's position in the sort
+            cursor_value = db.select(sort_column).where(NutritionSummary.recipe_id == cursor).scalar_subquery()
+            query = query.where(or_(
+                sort_column < cursor_value if nutrition.descending else sort_column > cursor_value,
+                and_(sort_column == cursor_value, NutritionSummary.recipe_id < cursor),
+            ))
+    elif cursor:
+        query = query.where(Recipe.id < cursor)
+    if author_id is not None:
+        query = query.where(Recipe.author_id == author_id)
+    for name in ingredients:
+        query = query.where(Recipe.id.in_(db.select(RecipeIngredient.recipe_id).where(RecipeIngredient.name == name)))
+    recipes = db.session.execute(query).scalars().all()
+
+    next_cursor = None
+    if len(recipes) > limit:
+        recipes = recipes[:limit]
+        next_cursor = recipes[-1].id
+    return recipes, next_cursor
+
+
+def count_likes(recipe_ids: list[int]) -> dict[int, int]:
+    """Counts the likes for every given recipe in a single grouped query"""
+
+    if not recipe_ids:
+        return {}
+    result = db.session.execute(
+        db.select(Like.recipe_id, func.count()).where(Like.recipe_id.in_(recipe_ids)).group_by(Like.recipe_id)
+    )
+    like_counts = dict.fromkeys(recipe_ids, 0)
+    like_counts.update({recipe_id: count for recipe_id, count in result})
+    return like_counts
+
+
+def current_user_likes(recipe_ids: list[int]) -> dict[int, bool]:
+    """Looks up which of the given recipes the current user has liked in a single query"""
+
+    if not recipe_ids or not current_user.is_authenticated:
+        return {}
+    liked_ids = set(db.session.execute(
+        db.select(Like.recipe_id).where(Like.user_id == current_user.id, Like.recipe_id.in_(recipe_ids))
+    ).scalars())
+    return {recipe_id: recipe_id in liked_ids for recipe_id in recipe_ids}
+
+
+def version_bump(model: type[Recipe] | type[User]):
+    """Next value of a version column: the current time, or one past the old version if that's later"""
+
+    return func.max(model.version + 1, time.time_ns() // 1_000_000)
+
+
+def bump_versions(model: type[Recipe] | type[User], *ids: int):
+    """Marks rows as changed, which retires their cached fragments in every worker and changes the ETags
+    of the pages showing them. Call before committing"""
+
+    db.session.execute(update(model).where(model.id.in_(ids)).values(version=version_bump(model)))
+
+
+def page_validators(versions: list[int], *etag_parts) -> tuple[str, datetime | None]:
+    """Weak ETag and Last-Modified of a page showing rows with the given versions. The ETag also covers the
+    viewer, whose name, like buttons and edit links are on the page, and the page's CSRF token, which is
+    tied to the session and stops being accepted after WTF_CSRF_TIME_LIMIT"""
+
+    if current_user.is_authenticated:
+        versions = [*versions, current_user.version]
+    # Every page has a CSRF token, make sure the session has its secret before it goes into the ETag
+    generate_csrf()
+    time_limit = app.config["WTF_CSRF_TIME_LIMIT"]
+    csrf_window = int(time.time() // time_limit) if time_limit else 0
+    state = [versions, etag_parts, current_user.get_id(), session.get("csrf_token"), csrf_window]
+    etag = hashlib.sha256(json.dumps(state).encode()).hexdigest()[:16]
+    newest = max(versions)
+    return etag, datetime.fromtimestamp(newest // 1000, timezone.utc) if newest else None
+
+
+def conditional_page(render: Callable[[], str], versions: list[int], *etag_parts) -> Response:
+    """Answers a GET with 304 when the client's copy of the page is current, without calling render().
+    Pages differ per viewer, so they are private and revalidated on every view"""
+
+    # A page with flashed messages shows them once, so it must not be revalidated later
+    if request.method not in ("GET", "HEAD") or session.get("_flashes"):
+        return make_response(render())
+
+    etag, last_modified = page_validators(versions, *etag_parts)
+    if request.if_none_match:
+        current = request.if_none_match.contains_weak(etag)
+    else:
+        current = bool(last_modified and request.if_modified_since and request.if_modified_since >= last_modified)
+    response = Response(status=304) if current else make_response(render())
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add("Cookie")
+    return response
+
+
+def recipe_page_versions(recipe: Recipe) -> list[int]:
+    """Versions of everything on a recipe page: the recipe (with its likes, comments and nutrition),
+    its author and its commenters, who can change their names and photos"""
+
+    commenters = (db.select(func.max(User.version)).join(Comment, Comment.author_id == User.id)
+                  .where(Comment.recipe_id == recipe.id).scalar_subquery())
+    author, newest_commenter = db.session.execute(
+        db.select(User.version, commenters).where(User.id == recipe.author_id)
+    ).one()
+    return [recipe.version, author, newest_commenter or 0]
+
+
+def profile_page_versions(user: User, own_profile: bool) -> tuple[list[int], list[int]]:
+    """Versions of everything on a profile page: the user, their recipes and, on your own profile, the
+    recipes you liked. Also returns the number of recipes in each list, which removals change"""
+
+    lists = [db.select(func.count(), func.max(Recipe.version)).where(Recipe.author_id == user.id)]
+    if own_profile:
+        lists.append(db.select(func.count(), func.max(Recipe.version)).join(Like).where(Like.user_id == user.id))
+    versions, counts = [user.version], []
+    for query in lists:
+        count, newest = db.session.execute(query).one()
+        versions.append(newest or 0)
+        counts.append(count)
+    return versions, counts
+
+
+class APIError(Exception):
+    """Answered as {"error": message} with the given status by api_error()"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+@app.errorhandler(APIError)
+def api_error(e):
+    return jsonify({"error": str(e)}), e.status
+
+
+def api_fields(default: str = "card") -> tuple[str, ...]:
+    """The recipe fields asked for with ?fields=, e.g. ?fields=id,title,kcal or ?fields=card,ingredients"""
+
+    fields = []
+    for name in request.args.get("fields", default).split(","):
+        name = name.strip()
+        if name in API_FIELD_PRESETS:
+            fields += API_FIELD_PRESETS[name]
+        elif name in API_RECIPE_FIELDS:
+            fields.append(name)
+        else:
+            raise APIError(f"Unknown field {name!r}, expected any of {', '.join(API_RECIPE_FIELDS)} "
+                           f"or {', '.join(API_FIELD_PRESETS)}")
+    return tuple(dict.fromkeys(fields))
+
+
+def api_limit() -> int:
+    return min(max(request.args.get("limit", API_PAGE_SIZE, type=int), 1), API_MAX_PAGE_SIZE)
+
+
+def api_response(payload: dict) -> Response:
+    """JSON with a weak ETag of its body, answered with 304 when the client's copy matches"""
+
+    response = jsonify(payload)
+    response.add_etag(weak=True)
+    # Payloads can say whether the viewer liked a recipe, so they must not be shared between users
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add("Cookie")
+    return response.make_conditional(request)
+
+
+def image_json(item: Recipe | User) -> dict | None:
+    """URLs of a recipe or profile photo: the largest JPEG as src, and WebP/JPEG srcsets once derivatives exist"""
+
+    if item.image_filepath:
+        if not item.image_widths:
+            return {"src": url_for("static", filename=item.image_filepath), "srcset": None,
+                    "width": item.image_width, "height": item.image_height}
+        return {
+            "src": url_for("static", filename=derivative_path(item.image_filepath, item.image_widths[-1], "jpg")),
+            "srcset": {extension: srcset_filter(item.image_filepath, item.image_widths, extension)
+                       for extension in DERIVATIVE_FORMATS},
+            "width": item.image_width,
+            "height": item.image_height,
+        }
+    if getattr(item, "image_url", None):
+        return {
+            "src": proxied_image_url(item, 640, "jpg"),
+            "srcset": {extension: proxied_image_srcset(item, extension) for extension in DERIVATIVE_FORMATS},
+            "width": None,
+            "height": None,
+        }
+    return None
+
+
+def nutrition_json(nutrition: "NutritionFacts") -> dict[str, dict | None]:
+    return {label: value._asdict() if (value := getattr(nutrition, label)) else None for label in NUTRITION_LABEL}
+
+
+def recipes_json(recipes: list[Recipe], fields: tuple[str, ...]) -> list[dict]:
+    """Serializes recipes with only the requested fields. Authors must already be loaded (as load_feed_page()
+    and full_text_search() do), likes, nutrition and ingredients are loaded for all recipes in one query each"""
+
+    recipe_ids = [recipe.id for recipe in recipes]
+    like_counts = count_likes(recipe_ids) if "likes" in fields else {}
+    liked = current_user_likes(recipe_ids) if "liked" in fields else {}
+    nutrition = NutritionFacts.for_recipes(recipes) if {"kcal", "nutrition"} & set(fields) else {}
+    ingredients = {}
+    if "ingredients" in fields:
+        for row in db.session.execute(
+            db.select(RecipeIngredient).where(RecipeIngredient.recipe_id.in_(recipe_ids))
+            .order_by(RecipeIngredient.recipe_id, RecipeIngredient.position)
+        ).scalars():
+            ingredients.setdefault(row.recipe_id, []).append(
+                {"amount": row.amount, "description": row.description, "quantity": row.quantity, "unit": row.unit,
+                 "name": row.name}
+            )
+    values = {
+        "id": lambda recipe: recipe.id,
+        "title": lambda recipe: recipe.title,
+        "description": lambda recipe: recipe.description,
+        "url": lambda recipe: url_for("display_recipe", recipe_title=recipe.title),
+        "image": image_json,
+        "author": lambda recipe: {"id": recipe.author.id, "name": recipe.author.name},
+        "likes": lambda recipe: like_counts[recipe.id],
+        "liked": lambda recipe: liked.get(recipe.id, False),
+        "kcal": lambda recipe: int(kcal.amount) if (kcal := nutrition[recipe.id].kcal) else None,
+        "servings": lambda recipe: recipe.default_servings,
+        "time_to_cook": lambda recipe: recipe.time_to_cook,
+        "type_diet": lambda recipe: recipe.type_diet.split(", ") if recipe.type_diet else [],
+        "ingredients": lambda recipe: ingredients.get(recipe.id, []),
+        # HTML, as written in the recipe editor
+        "instructions": lambda recipe: recipe.instructions,
+        "nutrition": lambda recipe: nutrition_json(nutrition[recipe.id]),
+        "version": lambda recipe: recipe.version,
+    }
+    return [{field: values[field](recipe) for field in fields} for recipe in recipes]
+
+
+def full_text_search(search_param: str, page: int = 1, limit: int = SEARCH_PAGE_SIZE,
+                     nutrition: NutritionQuery | None = None) -> tuple[list[Recipe], bool]:
+    """Searches titles, descriptions, ingredients and instructions through the FTS5 index,
+    ranked by BM25 with prefix matching on every word, optionally only matching a NutritionQuery
+    and sorted by it first. Returns one page of results and whether there is another page after it"""
+
+    formatted_param = re.sub(r'[^a-zA-Z0-9\- ]', "", search_param)
+    # Quoted so stray hyphens aren't read as FTS5 operators, * for prefix matching
+    match_query = " OR ".join(f'"{word}"*' for word in formatted_param.split())
+    if not match_query:
+        return [], False
+
+    weights = ", ".join(str(weight) for weight in RECIPE_FTS_WEIGHTS)
+    recipes_fts = table("recipes_fts", column("rowid"))
+    query = (
+        db.select(recipes_fts.c.rowid).where(text("recipes_fts MATCH :query").bindparams(query=match_query))
+        .order_by(text(f"bm25(recipes_fts, {weights})"), recipes_fts.c.rowid.desc())
+        .limit(limit + 1).offset((page - 1) * limit)
+    )
+    if nutrition:
+        query = (query.join(NutritionSummary, NutritionSummary.recipe_id == recipes_fts.c.rowid)
+                 .where(*nutrition.conditions()))
+        if nutrition.sort:
+            query = query.order_by(None).order_by(*nutrition.order_by(), text(f"bm25(recipes_fts, {weights})"),
+                                                  recipes_fts.c.rowid.desc())
+    recipe_ids = db.session.execute(query).scalars().all()
+
+    has_next = len(recipe_ids) > limit
+    recipe_ids = recipe_ids[:limit]
+    recipes = db.session.execute(
+        db.select(Recipe).options(selectinload(Recipe.author)).where(Recipe.id.in_(recipe_ids))
+    ).scalars().all()
+    recipes_by_id = {recipe.id: recipe for recipe in recipes}
+    return [recipes_by_id[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes_by_id], has_next
+
+
+def split_recipe_url(url: str) -> tuple[str, str]:
+    """Splits a recipe's URL into what's saved as Recipe.recipe_url (everything after "www.")
+    and the site it's from, i.e. "allrecipes" """
+
+    url_www_split = url.strip().split("www.")
+    split_url = url_www_split[1] if len(url_www_split) == 2 else url_www_split[0]
+    return split_url, split_url.split(".com")[0]
+
+
+class ImportSourceError(Exception):
+    """Raised when a bulk import's list of URLs or sitemap can't be read"""
+
+
+def read_import_urls(urls_text: str, max_urls: int | None = None) -> list[str]:
+    """Reads recipe URLs from either a sitemap or a plain list, one URL per line. Sitemap indexes are followed
+    SITEMAP_MAX_DEPTH levels deep, and only to the sites in SITE_EXTRACTORS. Raises ImportSourceError if the
+    source can't be read or holds more than max_urls URLs, as soon as it finds out"""
+
+    urls = []
+    collect_import_urls(urls_text, urls, max_urls, depth=0, visited=set())
+    return urls
+
+
+def collect_import_urls(urls_text: str, urls: list[str], max_urls: int | None, depth: int, visited: set[str]):
+    if not urls_text.lstrip().startswith("<"):
+        found = [line.strip() for line in urls_text.splitlines() if line.strip() and not line.startswith("#")]
     else:
-        return send_from_directory(app.static_folder, 'index.html')
+        try:
+            sitemap = ElementTree.fromstring(urls_text.strip())
+        except ElementTree.ParseError as e:
+            raise ImportSourceError(f"Not a valid sitemap ({e})")
+        found = [loc.text.strip() for loc in sitemap.iter("{http://www.sitemaps.org/schemas/sitemap/0.9}loc")
+                 if loc.text and loc.text.strip()]
+
+        if sitemap.tag.endswith("sitemapindex"):
+            if depth >= SITEMAP_MAX_DEPTH:
+                raise ImportSourceError(f"Sitemap indexes are nested more than {SITEMAP_MAX_DEPTH} deep")
+            for url in found:
+                if url in visited:
+                    continue
+                visited.add(url)
+                if not is_supported_site(url):
+                    raise ImportSourceError(f"{url} isn't a sitemap from one of the supported sites")
+                try:
+                    response = http_client.get(url)
+                    response.raise_for_status()
+                except requests.RequestException as e:
+                    raise ImportSourceError(f"Couldn't fetch {url} ({e})")
+                collect_import_urls(response.text, urls, max_urls, depth + 1, visited)
+            return
+
+    for url in found:
+        if max_urls is not None and len(urls) >= max_urls:
+            raise ImportSourceError(f"Please import at most {max_urls} recipes at a time "
+                                    f"(use `flask import-recipes` for more)")
+        urls.append(url)
+
+
+def is_supported_site(url: str) -> bool:
+    """Whether an http(s) URL's host is one of the sites in SITE_EXTRACTORS, e.g. www.simplyrecipes.com"""
+
+    parts = urlsplit(url)
+    host = (parts.hostname or "").removeprefix("www.")
+    return parts.scheme in ("http", "https") and host.endswith(".com") and host.removesuffix(".com") in SITE_EXTRACTORS
+
+
+@dataclass
+class ImportReport:
+    """Outcome of a bulk recipe import"""
+    imported: list[str] = field(default_factory=list)
+    already_saved: list[str] = field(default_factory=list)
+    unsupported: list[str] = field(default_factory=list)
+    errors: dict[str, str] = field(default_factory=dict)
+
+    def summary(self) -> str:
+        return (f"{len(self.imported)} imported, {len(self.already_saved)} already saved, "
+                f"{len(self.unsupported)} from unsupported sites, {len(self.errors)} failed")
+
+
+class DomainThrottle:
+    """Politeness limits for scraping: at most `concurrency` requests in flight to any one domain,
+    started no closer together than `delay` seconds (not spaced at all when it's 0)"""
+
+    def __init__(self, concurrency: int, delay: float):
+        self.concurrency = concurrency
+        self.delay = delay
+        self.domains: dict[str, tuple[Semaphore, RateLimiter | None]] = {}
+        self.lock = Lock()
+
+    def fetch(self, url: str) -> str:
+        """Returns the page from the page cache, only throttling the requests that actually go out"""
+        return page_cache.fetch(url, send=self.get)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        domain = urlsplit(url).netloc
+        with self.lock:
+            if domain not in self.domains:
+                self.domains[domain] = (Semaphore(self.concurrency),
+                                        RateLimiter(1 / self.delay) if self.delay > 0 else None)
+            semaphore, rate_limiter = self.domains[domain]
+        with semaphore:
+            if rate_limiter:
+                rate_limiter.acquire()
+            return http_client.get(url, **kwargs)
+
+
+def import_recipes(urls: list[str], author: User, concurrency: int = 8, per_domain: int = 2,
+                   delay: float = 1.0, batch_size: int = 50) -> ImportReport:
+    """Imports recipes from many URLs at once. Pages are fetched and parsed concurrently under
+    per-domain politeness limits, recipes are committed (and queued for nutrition) in batches"""
+
+    report = ImportReport()
+    saved_urls = set(db.session.execute(db.select(Recipe.recipe_url).where(Recipe.recipe_url.is_not(None))).scalars())
+    saved_titles = set(db.session.execute(db.select(Recipe.title)).scalars())
+
+    to_fetch = {}
+    for url in urls:
+        split_url, recipe_source = split_recipe_url(url)
+        if recipe_source not in SITE_EXTRACTORS or not is_supported_site(url):
+            report.unsupported.append(url)
+        elif split_url in saved_urls:
+            report.already_saved.append(url)
+        else:
+            saved_urls.add(split_url)
+            to_fetch[url] = (split_url, recipe_source)
+
+    throttle = DomainThrottle(per_domain, delay)
+
+    def fetch_and_parse(url):
+        return extract_recipe(to_fetch[url][1], throttle.fetch(url))
+
+    # (url, recipe) pairs
+    batch = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(fetch_and_parse, url): url for url in to_fetch}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                recipe_details = future.result()
+            except Exception as e:
+                report.errors[url] = repr(e)
+                continue
+            if recipe_details["title"] in saved_titles:
+                report.errors[url] = f"A recipe called \"{recipe_details['title']}\" already exists"
+                continue
+            saved_titles.add(recipe_details["title"])
+
+            split_url, recipe_source = to_fetch[url]
+            # By id, since setting author would put the recipe in the session even if its insert fails
+            batch.append((url, Recipe(**recipe_details, author_id=author.id, recipe_url=split_url,
+                                      recipe_source=recipe_source)))
+            if len(batch) >= batch_size:
+                save_imported_recipes(batch, report)
+                batch = []
+    if batch:
+        save_imported_recipes(batch, report)
+    return report
+
+
+def save_imported_recipes(batch: list[tuple[str, Recipe]], report: ImportReport):
+    """Inserts each recipe under its own savepoint, so one that can't be saved fails its own URL, not the batch"""
+
+    saved = []
+    for url, recipe in batch:
+        try:
+            with db.session.begin_nested():
+                db.session.add(recipe)
+        except SQLAlchemyError as e:
+            report.errors[url] = f"Couldn't save the recipe ({getattr(e, 'orig', None) or e})"
+            continue
+        report.imported.append(url)
+        saved.append(recipe)
+    db.session.commit()
+    if saved:
+        enqueue_nutrition(*saved)
+
+
+def enqueue_import(author: User, source: str) -> ImportJob:
+    """Queues a bulk import of a list of URLs or sitemap for the background workers"""
+
+    job = ImportJob(author_id=author.id, source=source, status="pending", attempts=0, created_at=time.time())
+    db.session.add(job)
+    db.session.commit()
+    jobs_ready.set()
+    return job
+
+
+def claim_import_job() -> tuple[int, int] | None:
+    """Atomically marks the oldest pending import as running, like claim_nutrition_job().
+    Returns its id and attempt number, or None when nothing is waiting"""
+
+    now = time.time()
+    claimed = db.session.execute(
+        text("UPDATE import_jobs SET status = 'running', attempts = attempts + 1, locked_at = :now "
+             "WHERE id = (SELECT id FROM import_jobs "
+             "WHERE status = 'pending' OR (status = 'running' AND locked_at < :stale) "
+             "ORDER BY id LIMIT 1) "
+             "RETURNING id, attempts"),
+        {"now": now, "stale": now - IMPORT_JOB_LEASE}
+    ).first()
+    db.session.commit()
+    return tuple(claimed) if claimed else None
+
+
+def run_import_job(job_id: int, attempts: int):
+    """Runs a bulk import and stores its report. An unreadable source fails the job right away, anything else
+    is retried until IMPORT_JOB_MAX_ATTEMPTS (already imported recipes are reported as already saved)"""
+
+    job = db.session.get(ImportJob, job_id)
+    try:
+        urls = read_import_urls(job.source, BULK_IMPORT_MAX_URLS)
+        report = import_recipes(urls, job.author)
+        status, error = "done", None
+    except ImportSourceError as e:
+        report, status, error = None, "failed", str(e)
+    except Exception as e:
+        db.session.rollback()
+        report, error = None, repr(e)
+        status = "failed" if attempts >= IMPORT_JOB_MAX_ATTEMPTS else "pending"
+        app.logger.warning(f"Import job {job_id} failed (attempt {attempts}): {error}")
+
+    job = db.session.get(ImportJob, job_id)
+    job.status = status
+    job.report = asdict(report) if report else None
+    job.last_error = error
+    job.locked_at = None
+    db.session.commit()
+
+
+@app.cli.command("import-recipes")
+@click.argument("source")
+@click.option("--author", required=True, help="Username the recipes are saved under.")
+@click.option("--concurrency", default=8, help="Pages fetched at once.")
+@click.option("--per-domain", default=2, help="Pages fetched at once from any single site.")
+@click.option("--delay", default=1.0, type=click.FloatRange(min=0), help="Minimum seconds between requests to the same site.")
+@click.option("--batch-size", default=50, help="Recipes saved per commit.")
+def import_recipes_command(source, author, concurrency, per_domain, delay, batch_size):
+    """Bulk imports recipes from SOURCE, a file or URL of either a sitemap or a list of recipe URLs."""
+    user = User.query.filter(User.name == author).first()
+    if not user:
+        raise click.BadParameter(f"No user named {author}", param_hint="--author")
+
+    if source.startswith(("http://", "https://")):
+        response = http_client.get(source)
+        response.raise_for_status()
+        urls_text = response.text
+    else:
+        with open(source, encoding="utf-8") as urls_file:
+            urls_text = urls_file.read()
+
+    try:
+        urls = read_import_urls(urls_text)
+    except ImportSourceError as e:
+        raise click.ClickException(str(e))
+    report = import_recipes(urls, user, concurrency, per_domain, delay, batch_size)
+    for url, error in report.errors.items():
+        click.echo(f"FAILED {url}: {error}", err=True)
+    for url in report.unsupported:
+        click.echo(f"UNSUPPORTED {url}", err=True)
+    click.echo(report.summary())
+
+
+@app.cli.command("page-cache")
+@click.option("--clear", is_flag=True, help="Delete every cached page.")
+def page_cache_command(clear):
+    """Prints the size of the scraped page cache, or clears it."""
+    if clear:
+        page_cache.clear()
+    info = page_cache.info()
+    click.echo(f"{info['pages']} cached pages, {info['bytes'] / 1024 / 1024:.1f} MB compressed")
+
+
+@app.cli.command("bench-extractors")
+@click.argument("fixtures_dir", type=click.Path(exists=True, file_okay=False))
+@click.option("--site", default="allrecipes", help="Site whose fallback extractor is benchmarked.")
+@click.option("--rounds", default=20, help="Times each page is parsed.")
+def bench_extractors_command(fixtures_dir, site, rounds):
+    """Times the JSON-LD fast path against the site's selector fallback over saved HTML pages in FIXTURES_DIR."""
+    pages = []
+    for filename in sorted(os.listdir(fixtures_dir)):
+        if filename.endswith((".html", ".htm")):
+            with open(os.path.join(fixtures_dir, filename), encoding="utf-8") as page_file:
+                pages.append(page_file.read())
+    if not pages:
+        raise click.BadParameter("No .html files found", param_hint="FIXTURES_DIR")
+
+    def timed(extractor):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for page in pages:
+                extractor(page)
+        return 1000 * (time.perf_counter() - started) / (rounds * len(pages))
+
+    click.echo(f"{len(pages)} pages x {rounds} rounds, ms per page:")
+    click.echo(f"  {'JSON-LD':<28}{timed(recipe_from_json_ld):8.2f}")
+    fallback = SITE_EXTRACTORS[site]
+    if fallback:
+        click.echo(f"  {f'{site} selectors ({HTML_PARSER})':<28}{timed(fallback):8.2f}")
+
+
+def ai_recipe_messages(query: str, system_prompt: str = AI_RECIPE_SYSTEM_PROMPT) -> list[dict]:
+    return [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        {
+            "role": "user",
+            "content": query,
+        }
+    ]
+
+
+def parse_ai_recipe(recipe_text: str) -> dict:
+    """Splits the AI's markdown response into the fields save_ai_recipe() needs"""
+
+    title = recipe_text.split("**")[1]
+    recipe_split1 = recipe_text.split("**Instructions:**")
+    instructions = recipe_split1[1].strip()
+    recipe_split2 = recipe_split1[0].split("**Ingredients:**")
+    ingredients = recipe_split2[1].strip()
+    recipe_split3 = recipe_split2[0].split("**Number of Servings:**")
+    num_servings = int(re.search(r"\d+", recipe_split3[1]).group())
+    recipe_split4 = recipe_split3[0].split("**Description:**")
+    description = recipe_split4[1].strip()
+
+    return {
+        'title': title,
+        'description': description,
+        'servings': num_servings,
+        'ingredients': ingredients,
+        'instructions': instructions
+    }
+
+
+class AIRecipeInvalid(ValueError):
+    """Raised when a JSON-mode completion doesn't match the recipe schema"""
+
+
+def validate_ai_recipe(recipe_json: str) -> dict:
+    """Checks a JSON-mode completion against the recipe schema and returns the fields save_ai_recipe() needs,
+    with ingredients and instructions as markdown lists"""
+
+    try:
+        data = json.loads(recipe_json)
+    except json.JSONDecodeError as e:
+        raise AIRecipeInvalid(f"the response isn't valid JSON ({e})")
+    if not isinstance(data, dict):
+        raise AIRecipeInvalid("the response must be a single JSON object")
+    for key in ("title", "description"):
+        if not isinstance(data.get(key), str) or not data[key].strip():
+            raise AIRecipeInvalid(f'"{key}" must be a non-empty string')
+    servings = data.get("servings")
+    if isinstance(servings, str) and re.fullmatch(r"\s*\d+\s*", servings):
+        servings = int(servings)
+    if isinstance(servings, bool) or not isinstance(servings, int) or servings < 1:
+        raise AIRecipeInvalid('"servings" must be a positive integer')
+    for key in ("ingredients", "instructions"):
+        items = data.get(key)
+        if not isinstance(items, list) or not items or not all(isinstance(item, str) and item.strip() for item in items):
+            raise AIRecipeInvalid(f'"{key}" must be a non-empty list of strings')
+
+    steps = [re.sub(r"^\s*\d+[.)]\s*", "", step).strip() for step in data["instructions"]]
+    return {
+        'title': data["title"].strip(),
+        'description': data["description"].strip(),
+        'servings': servings,
+        'ingredients': "\n".join(f"* {item.strip().lstrip('*-• ')}" for item in data["ingredients"]),
+        'instructions': "\n".join(f"{number}. {step}" for number, step in enumerate(steps, 1)),
+    }
+
+
+def ai_recipe_markdown(recipe: dict) -> str:
+    """Lays a validated AI recipe out the way the free-text prompt asks for it, for display"""
+
+    return (f"**{recipe['title']}**\n\n**Description:** {recipe['description']}\n\n"
+            f"**Number of Servings:** {recipe['servings']}\n\n**Ingredients:**\n\n{recipe['ingredients']}\n\n"
+            f"**Instructions:**\n\n{recipe['instructions']}")
+
+
+def generate_ai_recipe(query: str, user_key: str, variation: int = 0, variations: int = 1) -> tuple[str, dict]:
+    """Requests a JSON-mode recipe and validates it. A response that fails validation is sent back
+    with the errors for one repair attempt. Returns the raw JSON along with the validated recipe"""
+
+    messages = ai_recipe_messages(query, AI_RECIPE_JSON_PROMPT)
+    if variations > 1:
+        messages[-1]["content"] += (f"\n\n(This is variation {variation + 1} of {variations}, "
+                                    f"make it clearly different from the usual take on the dish.)")
+    # One admission covers the repair attempt too, so a repair is never turned away by the budget its own
+    # first attempt just spent. Both attempts' tokens are charged when the ticket is released
+    with ai_scheduler.acquire(user_key, estimate_ai_tokens(messages)) as ticket:
+        tokens_used = 0
+        for attempt in range(2):
+            chat_completion = client.chat.completions.create(
+                messages=messages,
+                model=AI_RECIPE_MODEL,
+                max_tokens=AI_RECIPE_MAX_TOKENS,
+                response_format={"type": "json_object"},
+            )
+            recipe_json = chat_completion.choices[0].message.content
+            tokens_used += (chat_completion.usage.total_tokens if chat_completion.usage
+                            else estimate_ai_tokens(messages, recipe_json))
+            try:
+                recipe = validate_ai_recipe(recipe_json)
+            except AIRecipeInvalid as e:
+                if attempt:
+                    ticket.release(tokens_used)
+                    ai_structured_stats["failed"] += 1
+                    raise
+                messages += [
+                    {"role": "assistant", "content": recipe_json},
+                    {"role": "user", "content": f"That doesn't match the requested format: {e}. "
+                                                f"Reply with only the corrected JSON object."},
+                ]
+                continue
+            ticket.release(tokens_used)
+            if attempt:
+                ai_structured_stats["repaired"] += 1
+            return recipe_json, recipe
+
+
+def ai_user_key() -> str:
+    """Whose token budget an AI completion is charged to: the user, or their IP address when logged out"""
+
+    if current_user.is_authenticated:
+        return f"user:{current_user.id}"
+    return f"ip:{request.remote_addr}"
+
+
+def estimate_ai_tokens(messages: list[dict], recipe_text: str | None = None) -> int:
+    """Rough token count (~4 characters a token, plus a few per message) of a completion of exactly the messages
+    that are sent, assuming the longest allowed answer until the actual recipe_text is known"""
+
+    prompt_tokens = sum(4 + len(message["content"]) // 4 for message in messages)
+    if recipe_text is None:
+        return prompt_tokens + AI_RECIPE_MAX_TOKENS
+    return prompt_tokens + len(recipe_text) // 4
+
+
+def ai_cache_key(query: str, system_prompt: str = AI_RECIPE_SYSTEM_PROMPT, variation: int = 0) -> str:
+    """Hashes the query's distinct words (lowercased, sorted, stopwords dropped) with the system prompt and model,
+    so rewordings and reorderings of the same request share a cached recipe"""
+
+    words = sorted(set(re.findall(r"[a-z0-9]+", query.lower())) - AI_QUERY_STOPWORDS)
+    key = [AI_RECIPE_MODEL, system_prompt, words] + ([variation] if variation else [])
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+def cached_ai_recipe_text(cache_key: str) -> str | None:
+    """Looks up a previously generated recipe in memory, then in the database if AI_CACHE_PERSIST is on"""
+
+    recipe_text = ai_recipe_cache.get(cache_key)
+    if recipe_text is None and AI_CACHE_PERSIST:
+        entry = db.session.get(AICompletionCache, cache_key)
+        if entry and time.time() - entry.created_at < AI_CACHE_TTL:
+            ai_cache_stats["database_hits"] += 1
+            recipe_text = entry.recipe_text
+            ai_recipe_cache.set(cache_key, recipe_text)
+    return recipe_text
+
+
+def cache_ai_recipe_text(cache_key: str, recipe_text: str):
+    ai_recipe_cache.set(cache_key, recipe_text)
+    if AI_CACHE_PERSIST:
+        now = time.time()
+        AICompletionCache.query.filter(AICompletionCache.created_at < now - AI_CACHE_TTL).delete()
+        db.session.execute(
+            sqlite_insert(AICompletionCache).values(key=cache_key, recipe_text=recipe_text, created_at=now)
+            .on_conflict_do_update(index_elements=[AICompletionCache.key],
+                                   set_={"recipe_text": recipe_text, "created_at": now})
+        )
+        db.session.commit()
+
+
+def server_sent_event(event: str, data: str) -> str:
+    # JSON-encoded so newlines in the data can't break the event framing
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def store_ai_recipe_draft(draft_id: str, recipe: dict):
+    """Saves a streamed AI recipe, or a variation, for save_ai_recipe(), clearing out drafts older than a day"""
+
+    AIRecipeDraft.query.filter(AIRecipeDraft.created_at < time.time() - 60 * 60 * 24).delete()
+    db.session.add(AIRecipeDraft(id=draft_id, recipe=recipe, created_at=time.time()))
+    db.session.commit()
+
+
+def replace_profile_photo(uploaded_file):
+    filepath = "images/profiles/" + store_image(uploaded_file, app.config['PROFILE_PHOTO_FOLDER'])
+    if filepath != current_user.image_filepath:
+        current_user.image_filepath = filepath
+        current_user.image_width = current_user.image_height = current_user.image_widths = None
+
+
+def image_references(filepath: str) -> int:
+    """How many recipes and users use a photo"""
+
+    return sum(db.session.execute(db.select(func.count()).where(model.image_filepath == filepath)).scalar()
+               for model in (Recipe, User))
 
 
-def uuid_from_filename(filename):
-    """Generates a UUID from an image's filename/extension to be saved as"""
+def release_image(filepath: str | None, min_age: float = IMAGE_RELEASE_MIN_AGE) -> bool:
+    """Deletes a photo and its derivatives once the last recipe or user using it is gone. Call after committing.
+    The references are counted under the folder lock store_image() takes, and a photo stored in the last min_age
+    seconds is kept since an identical upload may be about to use it (`flask gc-images` catches it if not).
+    Returns whether it was deleted"""
 
-    split_filename = filename.split(".")
-    file_extension = split_filename[-1]
-    return str(uuid4()) + "." + file_extension
+    if not filepath:
+        return False
+    path = os.path.join(app.static_folder, filepath)
+    with folder_lock(os.path.dirname(path)):
+        if image_references(filepath):
+            return False
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) < min_age:
+            return False
+        remove_image(app.static_folder, filepath)
+        return True
+
+
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-worker")
+
+
+def process_image_later(model: type[Recipe] | type[User], owner_id: int, filepath: str):
+    """Strips an uploaded photo's metadata and generates its responsive derivatives on a background thread,
+    so the upload request doesn't wait on image encoding. Photos that are already processed (identical
+    uploads share a file) just get the existing dimensions"""
+
+    for other in (Recipe, User):
+        processed = db.session.execute(
+            db.select(other.image_width, other.image_height, other.image_widths)
+            .where(other.image_filepath == filepath, other.image_widths.is_not(None)).limit(1)
+        ).first()
+        if processed:
+            db.session.execute(update(model).where(model.id == owner_id)
+                               .values(**processed._asdict(), version=version_bump(model)))
+            db.session.commit()
+            return
+    image_executor.submit(generate_image_derivatives, model, owner_id, filepath)
+
+
+def generate_image_derivatives(model: type[Recipe] | type[User], owner_id: int, filepath: str):
+    with app.app_context():
+        try:
+            dimensions = process_image(app.static_folder, filepath)
+        except (OSError, ValueError) as e:  # Pillow's UnidentifiedImageError is an OSError
+            app.logger.warning(f"Couldn't process image {filepath}: {e!r}")
+            return
+        if dimensions:
+            # Only if the photo wasn't replaced in the meantime
+            db.session.execute(
+                update(model).where(model.id == owner_id, model.image_filepath == filepath)
+                .values(**dimensions, version=version_bump(model))
+            )
+            db.session.commit()
+
+
+@app.cli.command("image-derivatives")
+@click.option("--all", "regenerate_all", is_flag=True, help="Regenerate derivatives that already exist too.")
+def image_derivatives_command(regenerate_all):
+    """Generates responsive derivatives for uploaded recipe and profile photos that don't have them yet."""
+
+    jobs = []
+    for model in (Recipe, User):
+        query = db.select(model.id, model.image_filepath).where(model.image_filepath.is_not(None))
+        if not regenerate_all:
+            query = query.where(model.image_widths.is_(None))
+        jobs += [(model, owner_id, filepath) for owner_id, filepath in db.session.execute(query)]
+    with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as executor:
+        for _ in executor.map(lambda job: generate_image_derivatives(*job), jobs):
+            pass
+    click.echo(f"Processed {len(jobs)} photos")
+
+
+@app.cli.command("gc-images")
+@click.option("--dry-run", is_flag=True, help="Only report what would be deleted.")
+@click.option("--min-age", default=3600, show_default=True,
+              help="Seconds a file must be untouched before it's collected, sparing uploads still being saved.")
+def gc_images_command(dry_run, min_age):
+    """Deletes uploaded photos, with their derivatives, that no recipe or user references any more."""
+
+    total_files = total_bytes = 0
+    for folder in (app.config['RECIPE_PHOTO_FOLDER'], app.config['PROFILE_PHOTO_FOLDER']):
+        files = reclaimable = 0
+        # Under the lock store_image() takes, so an upload can't reuse a photo between the check and the delete
+        with folder_lock(folder):
+            referenced = set()
+            for model in (Recipe, User):
+                filepaths = db.session.execute(db.select(model.image_filepath).where(model.image_filepath.is_not(None)))
+                referenced.update(os.path.normpath(os.path.splitext(os.path.join(app.static_folder, filepath))[0])
+                                  for filepath in filepaths.scalars())
+            now = time.time()
+            # A derivative is only as old as its original, which store_image() touches when it's uploaded again
+            mtimes = {entry.path: entry.stat().st_mtime for entry in os.scandir(folder)
+                      if entry.is_file() and not entry.name.startswith(".")}
+            touched = {}
+            for path, mtime in mtimes.items():
+                owner = os.path.normpath(image_owner(path))
+                touched[owner] = max(touched.get(owner, 0), mtime)
+            for path in mtimes:
+                owner = os.path.normpath(image_owner(path))
+                if owner in referenced or now - touched[owner] < min_age:
+                    continue
+                files += 1
+                reclaimable += os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+        click.echo(f"{os.path.relpath(folder, app.static_folder)}: {files} files, {reclaimable:,} bytes")
+        total_files += files
+        total_bytes += reclaimable
+    click.echo(f"{'Would reclaim' if dry_run else 'Reclaimed'} {total_bytes:,} bytes from {total_files} unreferenced files")
 
 
 def markup_to_list(markup_ingredients: str) -> list[str]:
@@ -774,6 +2484,21 @@ def markup_to_list(markup_ingredients: str) -> list[str]:
     return ingredients_list
 
 
+def strip_markup(markup: str) -> str:
+    """Removes HTML tags and entities from rich-text fields, leaving plain text"""
+
+    return html.unescape(re.sub(r"<[^>]+>", " ", markup or "")).strip()
+
+
+def ingredient_lines(ingredients: str | list[dict]) -> list[str]:
+    """Returns a recipe's ingredients as plain-text lines, whether they were saved as markup
+    (add_recipe/save_ai_recipe) or as a List of amount/unit/ingredient dicts (recipe_saver)"""
+
+    if isinstance(ingredients, str):
+        return [strip_markup(ing) for ing in markup_to_list(ingredients) if strip_markup(ing)]
+    return [f"{ing["amount"]} {ing["unit"]} {ing["ingredient"]}" for ing in ingredients]
+
+
 def oil_converter(title: str, ingredients: list[str]) -> list[str]:
     """Takes a recipe's title and a List of its ingredients as inputs to determine whether
     the amount of oil used needs to be altered to get a more accurate nutritional value calculation
@@ -836,7 +2561,7 @@ def edamam_nutrition_analysis(title: str, ingredients: list[str]) -> dict:
         "title": title,
         "ingr": ingredients
     }
-    response = requests.post(
+    response = http_client.post(
         url=EDAMAM_ENDPOINT,
         params=edamam_params,
         headers={"Content-Type": "application/json"},
@@ -848,99 +2573,473 @@ def edamam_nutrition_analysis(title: str, ingredients: list[str]) -> dict:
     return data
 
 
+edamam_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def edamam_cache_key(ingredients: list[str]) -> str:
+    """Hashes a canonical form of the ingredient lines (lowercased, whitespace collapsed, blanks dropped, sorted)
+    so identical or reordered ingredient lists share one cache entry"""
+
+    lines = sorted(" ".join(ing.lower().split()) for ing in ingredients if ing.strip() not in ("", "&nbsp;"))
+    return hashlib.sha256(json.dumps(lines).encode()).hexdigest()
+
+
+def cached_nutrition_analysis(title: str, ingredients: list[str], rate_limiter: "RateLimiter" = None) -> dict:
+    """Returns the Edamam analysis of the (already oil_converter'd) ingredients from the on-disk cache,
+    only sending a request to Edamam on a miss or once the cached entry is older than EDAMAM_CACHE_MAX_AGE.
+    Requests that do go out to Edamam wait on the rate limiter, if one is given"""
+
+    key = edamam_cache_key(ingredients)
+    now = time.time()
+    entry = db.session.get(EdamamCache, key)
+    if entry and now - entry.created_at < EDAMAM_CACHE_MAX_AGE:
+        edamam_cache_stats["hits"] += 1
+        entry.hits += 1
+        entry.last_used_at = now
+        db.session.commit()
+        return {"totalNutrients": entry.total_nutrients, "totalDaily": entry.total_daily}
+
+    edamam_cache_stats["misses"] += 1
+    if rate_limiter:
+        rate_limiter.acquire()
+    data = edamam_nutrition_analysis(title, ingredients)
+    # Upsert, another thread may have cached the same ingredients while this one was waiting on Edamam
+    entry_values = {
+        "total_nutrients": data["totalNutrients"],
+        "total_daily": data["totalDaily"],
+        "created_at": now,
+        "last_used_at": now,
+        "hits": 0
+    }
+    db.session.execute(
+        sqlite_insert(EdamamCache).values(key=key, **entry_values)
+        .on_conflict_do_update(index_elements=[EdamamCache.key], set_=entry_values)
+    )
+    db.session.commit()
+    evict_edamam_cache(now)
+    return data
+
+
+def evict_edamam_cache(now: float):
+    """Removes cache entries past EDAMAM_CACHE_MAX_AGE, then the least recently used ones over EDAMAM_CACHE_MAX_ENTRIES"""
+
+    evicted = EdamamCache.query.filter(EdamamCache.created_at < now - EDAMAM_CACHE_MAX_AGE).delete()
+    overflow = EdamamCache.query.count() - EDAMAM_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        lru_keys = db.select(EdamamCache.key).order_by(EdamamCache.last_used_at).limit(overflow)
+        evicted += EdamamCache.query.filter(EdamamCache.key.in_(lru_keys)).delete()
+    db.session.commit()
+    edamam_cache_stats["evictions"] += evicted
+
+
+@app.cli.command("edamam-cache")
+def edamam_cache_command():
+    """Prints the size and hit counts of the Edamam nutrition cache."""
+    entries = EdamamCache.query.count()
+    hits = db.session.execute(db.select(func.coalesce(func.sum(EdamamCache.hits), 0))).scalar()
+    click.echo(f"{entries} cached analyses, {hits} hits served from cache")
+
+
 def nutrition_to_db(recipe: Recipe, nutrition_dict: dict, daily_value_dict: dict):
     """Takes a recipe and its Edamam API generated dictionaries as inputs and
-    stores all Nutrition Facts related nutrients to the Nutrition table within the SQLite database.
-    Follows FDA rounding guidelines for each nutrient group."""
-
-    non_label = ["CHOCDF.net", "WATER", "MG", "ZN", "P", "VITA_RAE", "VITC", "THIA", "RIBF",
-                 "NIA", "VITB6A", "FOLDFE", "FOLFD", "FOLAC", "VITB12", "TOCPHA", "VITK1"]
-
-    for nutrient, data in nutrition_dict.items():
-        if nutrient not in non_label:
-
-            amount = data["quantity"]/int(recipe.default_servings)
-
-            if nutrient in ["ENERC_KCAL"]:
-                if amount < 5:
-                    amount = 0
-                elif 5 <= amount <= 50:
-                    amount = 5 * round(amount / 5)
-                else:
-                    amount = 10 * round(amount / 10)
-            elif nutrient in ["FAT", "FASAT", "FATRN", "FAMS", "FAPU"]:
-                if amount < 0.5:
-                    amount = 0
-                elif 0.5 <= amount < 5:
-                    amount = round(amount * 2) / 2
-                else:
-                    amount = round(amount)
-            elif nutrient in ["CHOLE"]:
-                if amount < 2:
-                    amount = 0
-                elif 2 <= amount <= 5:
-                    amount = round(amount)
-                else:
-                    amount = 5 * round(amount / 5)
-            elif nutrient in ["NA", "K"]:
-                if amount < 5:
-                    amount = 0
-                elif 5 <= amount <= 140:
-                    amount = 5 * round(amount / 5)
-                else:
-                    amount = 10 * round(amount / 10)
-            elif nutrient in ["CHOCDF", "FIBTG", "SUGAR"]:
-                if amount < 0.5:
-                    amount = 0
-                elif 0.5 <= amount < 1:
-                    amount = round(amount, 1)
-                else:
-                    amount = round(amount)
-            elif nutrient in ["PROCNT"]:
-                if amount < 0.5:
-                    amount = 0
-                else:
-                    amount = round(amount)
-            elif nutrient in ["FE", "VITD"]:
-                amount = round(amount, 1)
-            elif nutrient in ["CA"]:
-                amount = 10 * round(amount / 10)
+    stores all Nutrition Facts related nutrients to the Nutrition table within the SQLite database,
+    replacing any the recipe already had."""
+
+    write_nutrition(nutrition_rows({recipe.id: (recipe.default_servings, nutrition_dict, daily_value_dict)}))
+
+
+def write_nutrition(rows_by_recipe: dict[int, list[dict]]):
+    """Replaces the Nutrition rows and NutritionSummary of every given recipe using one bulk delete, one bulk
+    insert, one bulk upsert and a single commit, and marks them as computed with the current NUTRITION_RULES_VERSION"""
+
+    recipe_ids = list(rows_by_recipe)
+    rows = [row for recipe_rows in rows_by_recipe.values() for row in recipe_rows]
+    db.session.execute(delete(Nutrition).where(Nutrition.recipe_id.in_(recipe_ids)))
+    if rows:
+        db.session.execute(insert(Nutrition), rows)
+    summaries = {recipe_id: dict.fromkeys(NUTRITION_LABEL) | {"recipe_id": recipe_id} for recipe_id in recipe_ids}
+    for row in rows:
+        if row["nutrient"] in NUTRITION_LABEL_BY_NUTRIENT:
+            summaries[row["recipe_id"]][NUTRITION_LABEL_BY_NUTRIENT[row["nutrient"]]] = row["amount"]
+    summary_insert = sqlite_insert(NutritionSummary)
+    db.session.execute(
+        summary_insert.on_conflict_do_update(
+            index_elements=[NutritionSummary.recipe_id],
+            set_={label: summary_insert.excluded[label] for label in NUTRITION_LABEL},
+        ),
+        list(summaries.values()),
+    )
+    db.session.execute(
+        update(Recipe).where(Recipe.id.in_(recipe_ids))
+        .values(nutrition_version=NUTRITION_RULES_VERSION, version=version_bump(Recipe))
+    )
+    db.session.commit()
 
-            try:
-                dvp = int(daily_value_dict[nutrient].get("quantity", None))
-            except KeyError:
-                dvp = None
-
-            new_nutrition = Nutrition(
-                recipe=recipe,
-                nutrient=nutrient,
-                amount=amount,
-                unit=data["unit"],
-                daily_value_percent=dvp
-            )
-            db.session.add(new_nutrition)
 
+def rebuild_nutrition_summaries():
+    """(Re)pivots every recipe's Nutrition rows into NutritionSummary with one INSERT ... SELECT"""
+
+    db.session.execute(delete(NutritionSummary))
+    db.session.execute(insert(NutritionSummary).from_select(
+        ["recipe_id", *NUTRITION_LABEL],
+        db.select(Nutrition.recipe_id, *(func.max(case((Nutrition.nutrient == nutrient, Nutrition.amount)))
+                                         for nutrient in NUTRITION_LABEL.values()))
+        .group_by(Nutrition.recipe_id)
+    ))
+    db.session.commit()
+
+
+@app.cli.command("rebuild-nutrition-summaries")
+def rebuild_nutrition_summaries_command():
+    """Pivots every recipe's Nutrition rows into the nutrition_summaries table again."""
+    rebuild_nutrition_summaries()
+    click.echo(f"Summarized {db.session.execute(db.select(func.count()).select_from(NutritionSummary)).scalar()} "
+               f"recipes")
+
+
+class RateLimiter:
+    """Spaces out acquire() calls across threads so they happen at most `rate` times per second"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_slot = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def analyze_recipe_nutrition(title: str, ingredients: str | list[dict], rate_limiter: RateLimiter = None) -> dict:
+    """Runs a recipe's stored ingredients through oil_converter and the cached Edamam analysis.
+    Safe to call from worker threads"""
+
+    with app.app_context():
+        edamam_ingredients = oil_converter(title, ingredient_lines(ingredients))
+        return cached_nutrition_analysis(title, edamam_ingredients, rate_limiter)
+
+
+@app.cli.command("backfill-nutrition")
+@click.option("--all", "recompute_all", is_flag=True, help="Recompute every recipe, not only missing/stale ones.")
+@click.option("--concurrency", default=4, help="Edamam analyses to run at once.")
+@click.option("--rps", default=5.0, help="Maximum Edamam requests per second.")
+@click.option("--batch-size", default=100, help="Recipes written per commit.")
+@click.option("--start-after", default=0, help="Resume after this recipe id.")
+def backfill_nutrition_command(recompute_all, concurrency, rps, batch_size, start_after):
+    """Recomputes Nutrition rows for recipes that are missing them or were computed with older rules.
+
+    Progress is committed batch by batch and finished recipes are no longer stale,
+    so an interrupted run picks up where it left off when run again."""
+    query = db.select(Recipe.id, Recipe.title, Recipe.ingredients, Recipe.default_servings).order_by(Recipe.id)
+    if not recompute_all:
+        query = query.where(
+            Recipe.nutrition_version.is_(None) | (Recipe.nutrition_version < NUTRITION_RULES_VERSION)
+        )
+
+    rate_limiter = RateLimiter(rps)
+    done = failed = 0
+    started = time.monotonic()
+    last_id = start_after
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            batch = db.session.execute(query.where(Recipe.id > last_id).limit(batch_size)).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            futures = [
+                (recipe, executor.submit(analyze_recipe_nutrition, recipe.title, recipe.ingredients, rate_limiter))
+                for recipe in batch
+            ]
+            analyses = {}
+            for recipe, future in futures:
+                try:
+                    edamam_data = future.result()
+                except Exception as e:
+                    failed += 1
+                    click.echo(f"Recipe {recipe.id} ({recipe.title}) failed: {e!r}", err=True)
+                    continue
+                analyses[recipe.id] = (recipe.default_servings, edamam_data["totalNutrients"],
+                                       edamam_data["totalDaily"])
+            # The whole batch is rounded in one pass and written with one bulk insert
+            if analyses:
+                write_nutrition(nutrition_rows(analyses))
+            done += len(analyses)
+
+            rate = done / (time.monotonic() - started)
+            click.echo(f"{done} recomputed, {failed} failed ({rate:.1f} recipes/s), last recipe id {last_id}")
+
+
+@app.cli.command("bench-nutrition")
+@click.option("--recipes", default=1000, help="Synthetic Edamam analyses per round.")
+@click.option("--rounds", default=5, help="Times the analyses are converted.")
+@click.option("--seed", default=0, help="Random seed for the nutrient amounts.")
+def bench_nutrition_command(recipes, rounds, seed):
+    """Times nutrition_rows() over synthetic analyses and checks the vectorized rounding against round_amount()."""
+    rng = random.Random(seed)
+    nutrients = [*ROUNDING_RULES, "CHOCDF.net", "VITC", "ZN"]
+    analyses = {}
+    for recipe_id in range(recipes):
+        servings = rng.randint(1, 12)
+        # Small amounts and exact halves, around the bounds where the rounding steps change
+        totals = {nutrient: {"quantity": servings * rng.choice([rng.uniform(0, 10), rng.uniform(0, 500),
+                                                                 rng.choice([0.05, 0.15, 0.25, 0.45, 2.5, 50])]),
+                             "unit": "g"}
+                  for nutrient in nutrients}
+        analyses[recipe_id] = (servings, totals, {nutrient: {"quantity": rng.uniform(0, 100)} for nutrient in totals})
+
+    def timed(convert):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            result = convert()
+        return result, 1000 * (time.perf_counter() - started) / rounds
+
+    rows_by_recipe, rows_ms = timed(lambda: nutrition_rows(analyses))
+    rows = [row for recipe_rows in rows_by_recipe.values() for row in recipe_rows]
+    names = [row["nutrient"] for row in rows]
+    amounts = [analyses[row["recipe_id"]][1][row["nutrient"]]["quantity"] / analyses[row["recipe_id"]][0]
+               for row in rows]
+    expected, scalar_ms = timed(lambda: [round_amount(name, amount) for name, amount in zip(names, amounts)])
+    vectorized, vectorized_ms = timed(lambda: round_amounts(names, amounts))
+
+    click.echo(f"{recipes} recipes x {rounds} rounds ({len(rows)} rows), ms per round:")
+    click.echo(f"  {'nutrition_rows()':<28}{rows_ms:8.2f}")
+    click.echo(f"  {'round_amount() per row':<28}{scalar_ms:8.2f}")
+    click.echo(f"  {'round_amounts()':<28}{vectorized_ms:8.2f}")
+    mismatches = sum(actual != wanted for actual, wanted in zip(vectorized, expected))
+    if mismatches:
+        raise click.ClickException(f"{mismatches} amounts rounded differently than round_amount()")
+
+
+jobs_ready = Event()
+
+
+def enqueue_nutrition(*recipes: Recipe):
+    """Queues recipes for nutrition analysis by the nutrition workers, so saves don't wait on Edamam.
+    A recipe that is already waiting in the queue is rescheduled instead of queued twice"""
+
+    now = time.time()
+    pending = NutritionJob.query.filter(
+        NutritionJob.recipe_id.in_([recipe.id for recipe in recipes]), NutritionJob.status == "pending"
+    ).all()
+    for job in pending:
+        job.attempts = 0
+        job.run_after = now
+    pending_ids = {job.recipe_id for job in pending}
+    db.session.add_all(
+        NutritionJob(recipe_id=recipe.id, status="pending", attempts=0, run_after=now)
+        for recipe in recipes if recipe.id not in pending_ids
+    )
     db.session.commit()
+    jobs_ready.set()
+
+
+def nutrition_job_status(recipe_id: int) -> str | None:
+    """Returns "pending" while a recipe's nutrition is queued or being analyzed,
+    "failed" if its latest analysis gave up, otherwise None"""
+
+    status = db.session.execute(
+        db.select(NutritionJob.status).where(NutritionJob.recipe_id == recipe_id).order_by(NutritionJob.id.desc())
+    ).scalar()
+    if status in ("pending", "running"):
+        return "pending"
+    if status == "failed":
+        return "failed"
+    return None
+
+
+def claim_nutrition_job() -> tuple[int, int, int] | None:
+    """Atomically marks the next due job as running so no other worker can take it.
+    Returns its id, recipe id and attempt number, or None when nothing is due"""
+
+    now = time.time()
+    claimed = db.session.execute(
+        text("UPDATE nutrition_jobs SET status = 'running', attempts = attempts + 1, locked_at = :now "
+             "WHERE id = (SELECT id FROM nutrition_jobs "
+             "WHERE (status = 'pending' AND run_after <= :now) OR (status = 'running' AND locked_at < :stale) "
+             "ORDER BY run_after LIMIT 1) "
+             "RETURNING id, recipe_id, attempts"),
+        {"now": now, "stale": now - NUTRITION_JOB_LEASE}
+    ).first()
+    db.session.commit()
+    return tuple(claimed) if claimed else None
+
+
+def run_nutrition_job(job_id: int, recipe_id: int, attempts: int):
+    """Analyzes a recipe's nutrition and replaces its Nutrition rows. Failures are retried with
+    exponential backoff plus jitter until NUTRITION_JOB_MAX_ATTEMPTS, then the job is marked failed"""
+
+    try:
+        recipe = db.session.get(Recipe, recipe_id)
+        # The recipe may have been deleted while its job was waiting
+        if recipe:
+            edamam_ingredients = oil_converter(recipe.title, ingredient_lines(recipe.ingredients))
+            edamam_data = cached_nutrition_analysis(recipe.title, edamam_ingredients)
+            nutrition_to_db(recipe, edamam_data["totalNutrients"], edamam_data["totalDaily"])
+        status, run_after, error = "done", None, None
+    except Exception as e:
+        db.session.rollback()
+        error = repr(e)
+        if attempts >= NUTRITION_JOB_MAX_ATTEMPTS:
+            status, run_after = "failed", None
+            # The recipe page now says the nutrition couldn't be calculated
+            bump_versions(Recipe, recipe_id)
+        else:
+            delay = NUTRITION_JOB_BACKOFF * 2 ** (attempts - 1)
+            status, run_after = "pending", time.time() + delay + random.uniform(0, delay / 2)
+        app.logger.warning(f"Nutrition job {job_id} for recipe {recipe_id} failed (attempt {attempts}): {error}")
+
+    job = db.session.get(NutritionJob, job_id)
+    job.status = status
+    job.last_error = error
+    job.locked_at = None
+    if run_after:
+        job.run_after = run_after
+    db.session.commit()
+
+
+def nutrition_worker(stop: Event):
+    """Runs queued nutrition jobs, then bulk imports, until stopped.
+    Sleeps until woken by enqueue_nutrition() or enqueue_import() when both queues are empty"""
+
+    while not stop.is_set():
+        with app.app_context():
+            job = claim_nutrition_job()
+            if job:
+                run_nutrition_job(*job)
+                continue
+            job = claim_import_job()
+            if job:
+                run_import_job(*job)
+                continue
+        jobs_ready.wait(timeout=1)
+        jobs_ready.clear()
+
+
+def start_nutrition_workers(count: int = NUTRITION_WORKERS) -> Event:
+    """Starts a pool of nutrition worker threads, returns the Event that stops them"""
+
+    stop = Event()
+    for i in range(count):
+        Thread(target=nutrition_worker, args=(stop,), name=f"nutrition-worker-{i}", daemon=True).start()
+    return stop
+
+
+@app.cli.command("nutrition-worker")
+@click.option("--workers", default=NUTRITION_WORKERS, help="Number of worker threads.")
+def nutrition_worker_command(workers):
+    """Runs the nutrition analysis and bulk import workers in the foreground."""
+    stop = start_nutrition_workers(workers)
+    try:
+        while not stop.wait(timeout=60):
+            pass
+    except KeyboardInterrupt:
+        stop.set()
+
+
+# Nutrition Facts label line -> Edamam nutrient code
+NUTRITION_LABEL = {
+    "kcal": "ENERC_KCAL",
+    "totalfat": "FAT",
+    "satfat": "FASAT",
+    "transfat": "FATRN",
+    "cholesterol": "CHOLE",
+    "sodium": "NA",
+    "totalcarbs": "CHOCDF",
+    "fiber": "FIBTG",
+    "sugar": "SUGAR",
+    "protein": "PROCNT",
+    "vitd": "VITD",
+    "calcium": "CA",
+    "iron": "FE",
+    "potassium": "K",
+}
+
+NUTRITION_LABEL_BY_NUTRIENT = {nutrient: label for label, nutrient in NUTRITION_LABEL.items()}
+
+NutrientValue = namedtuple("NutrientValue", ["amount", "unit", "daily_value_percent"])
 
 
 class NutritionFacts:
-    """Saves each of the recipe's important nutrients as an object to be able to access amount, unit, and DVP"""
-    def __init__(self, recipe_id):
-        self.kcal = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="ENERC_KCAL").first()
-        self.totalfat = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="FAT").first()
-        self.satfat = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="FASAT").first()
-        self.transfat = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="FATRN").first()
-        self.cholesterol = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="CHOLE").first()
-        self.sodium = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="NA").first()
-        self.totalcarbs = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="CHOCDF").first()
-        self.fiber = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="FIBTG").first()
-        self.sugar = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="SUGAR").first()
-        self.protein = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="PROCNT").first()
-        self.vitd = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="VITD").first()
-        self.calcium = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="CA").first()
-        self.iron = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="FE").first()
-        self.potassium = Nutrition.query.filter_by(recipe_id=recipe_id, nutrient="K").first()
+    """Saves each of the recipe's important nutrients as an object to be able to access amount, unit, and DVP.
+    Use for_recipe()/for_recipes() to go through the per-recipe cache instead of querying directly. The cache is
+    keyed by Recipe.version, which write_nutrition() bumps, so a write from any process (the nutrition workers,
+    backfill-nutrition) is seen by every worker without invalidating anything"""
+
+    _cache: OrderedDict[tuple[int, int], "NutritionFacts"] = OrderedDict()
+    _cache_lock = Lock()
+
+    def __init__(self, recipe_id, nutrients: dict[str, NutrientValue] | None = None):
+        self.recipe_id = recipe_id
+        if nutrients is None:
+            nutrients = self._load([recipe_id]).get(recipe_id, {})
+        for label, nutrient in NUTRITION_LABEL.items():
+            setattr(self, label, nutrients.get(nutrient))
+
+    @staticmethod
+    def _load(recipe_ids: list[int]) -> dict[int, dict[str, NutrientValue]]:
+        """Loads the label nutrients of every given recipe in one query and pivots them per recipe"""
+
+        rows = db.session.execute(
+            db.select(Nutrition.recipe_id, Nutrition.nutrient, Nutrition.amount,
+                      Nutrition.unit, Nutrition.daily_value_percent)
+            .where(Nutrition.recipe_id.in_(recipe_ids), Nutrition.nutrient.in_(NUTRITION_LABEL.values()))
+        )
+        nutrients_by_recipe = {}
+        for recipe_id, nutrient, amount, unit, dvp in rows:
+            nutrients_by_recipe.setdefault(recipe_id, {})[nutrient] = NutrientValue(amount, unit, dvp)
+        return nutrients_by_recipe
+
+    @classmethod
+    def for_recipe(cls, recipe: "Recipe") -> "NutritionFacts":
+        return cls.for_recipes([recipe])[recipe.id]
+
+    @classmethod
+    def for_recipes(cls, recipes: list["Recipe"]) -> dict[int, "NutritionFacts"]:
+        """Returns the Nutrition Facts of many recipes at once by recipe id, querying only for the ones not
+        cached at their current version yet. Entries for older versions age out of the LRU"""
+
+        keys = {recipe.id: (recipe.id, recipe.version) for recipe in recipes}
+        facts = {}
+        with cls._cache_lock:
+            for recipe_id, key in keys.items():
+                if key in cls._cache:
+                    cls._cache.move_to_end(key)
+                    facts[recipe_id] = cls._cache[key]
+
+        missing = [recipe_id for recipe_id in keys if recipe_id not in facts]
+        if missing:
+            loaded = cls._load(missing)
+            with cls._cache_lock:
+                for recipe_id in missing:
+                    facts[recipe_id] = cls._cache[keys[recipe_id]] = cls(recipe_id, loaded.get(recipe_id, {}))
+                while len(cls._cache) > NUTRITION_CACHE_SIZE:
+                    cls._cache.popitem(last=False)
+        return facts
+
+
+with app.app_context():
+    # Backfill the search index the first time the app runs against an existing database
+    if not db.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'recipes_fts'")).first():
+        rebuild_search_index()
+    # Same for the parsed ingredients
+    if (not db.session.execute(db.select(RecipeIngredient.id).limit(1)).first()
+            and db.session.execute(db.select(Recipe.id).limit(1)).first()):
+        rebuild_recipe_ingredients()
+    # And the nutrition summaries
+    if (not db.session.execute(db.select(NutritionSummary.recipe_id).limit(1)).first()
+            and db.session.execute(db.select(Nutrition.id).limit(1)).first()):
+        rebuild_nutrition_summaries()
 
 
 if __name__ == "__main__":
+    # Only the reloader's child process serves requests, so only start the workers there
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_nutrition_workers()
+    # Pick up edits to static files without restarting
+    asset_index.watch = True
     app.run(debug=True)
@@ -0,0 +1,99 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Edamam nutrients that aren't on the Nutrition Facts label, so they're never stored
+NON_LABEL_NUTRIENTS = frozenset({"CHOCDF.net", "WATER", "MG", "ZN", "P", "VITA_RAE", "VITC", "THIA", "RIBF", "NIA",
+                                 "VITB6A", "FOLDFE", "FOLFD", "FOLAC", "VITB12", "TOCPHA", "VITK1"})
+# FDA label rounding per serving: (below, step) pairs checked in order, the first whose bound the amount is
+# below applies. step 0 declares the amount as 0, 0.1 rounds to one decimal place and any other step to its
+# nearest multiple. Amounts at a bound round the same under both neighbouring steps (50 kcal is 50 either way),
+# so every bound can be exclusive. Nutrients without a rule are stored as computed
+ROUNDING_RULES = {
+    "ENERC_KCAL": ((5, 0), (50, 5), (float("inf"), 10)),
+    **dict.fromkeys(("FAT", "FASAT", "FATRN", "FAMS", "FAPU"), ((0.5, 0), (5, 0.5), (float("inf"), 1))),
+    "CHOLE": ((2, 0), (5, 1), (float("inf"), 5)),
+    **dict.fromkeys(("NA", "K"), ((5, 0), (140, 5), (float("inf"), 10))),
+    **dict.fromkeys(("CHOCDF", "FIBTG", "SUGAR"), ((0.5, 0), (1, 0.1), (float("inf"), 1))),
+    "PROCNT": ((0.5, 0), (float("inf"), 1)),
+    **dict.fromkeys(("FE", "VITD"), ((float("inf"), 0.1),)),
+    "CA": ((float("inf"), 10),),
+}
+# The rules as arrays for round_amounts(), padded to the longest rule. Row 0 is for nutrients without a rule
+RULE_ROWS = {nutrient: row for row, nutrient in enumerate(ROUNDING_RULES, start=1)}
+if np is not None:
+    _RULE_WIDTH = max(len(rule) for rule in ROUNDING_RULES.values())
+    RULE_BOUNDS = np.array([[np.inf] * _RULE_WIDTH] + [
+        [below for below, _ in rule] + [np.inf] * (_RULE_WIDTH - len(rule)) for rule in ROUNDING_RULES.values()
+    ])
+    RULE_STEPS = np.array([[np.nan] * _RULE_WIDTH] + [
+        [step for _, step in rule] + [np.nan] * (_RULE_WIDTH - len(rule)) for rule in ROUNDING_RULES.values()
+    ])
+
+
+def round_amount(nutrient: str, amount: float) -> float:
+    """Rounds one per-serving amount as it's declared on the label"""
+
+    for below, step in ROUNDING_RULES.get(nutrient, ()):
+        if amount < below:
+            if step == 0:
+                return 0
+            if step == 0.1:
+                return round(amount, 1)
+            return step * round(amount / step)
+    return amount
+
+
+def round_amounts(nutrients: list[str], amounts: list[float]) -> list[float]:
+    """round_amount() over many amounts at once, in one vectorized pass when NumPy is installed"""
+
+    if np is None or not amounts:
+        return [round_amount(nutrient, amount) for nutrient, amount in zip(nutrients, amounts)]
+
+    values = np.asarray(amounts, dtype=float)
+    rows = np.array([RULE_ROWS.get(nutrient, 0) for nutrient in nutrients])
+    # Index of the first bound each amount is below
+    segments = (values[:, None] >= RULE_BOUNDS[rows]).sum(axis=1)
+    steps = RULE_STEPS[rows, np.minimum(segments, RULE_BOUNDS.shape[1] - 1)]
+    with np.errstate(all="ignore"):
+        multiples = steps * np.rint(values / steps)
+    tenths = np.round(values, 1)
+    rounded = np.where(np.isnan(steps), values, np.where(steps == 0.1, tenths, np.where(steps == 0, 0, multiples)))
+    # round() never gives -0.0
+    rounded += 0.0
+
+    result = rounded.tolist()
+    # np.round() scales by 10 first, which can land exactly on a half that round() (working on the exact decimal
+    # value) doesn't see, so those few amounts are rounded again the same way round_amount() does
+    scaled = values * 10
+    for index in np.flatnonzero((steps == 0.1) & (scaled - np.floor(scaled) == 0.5)).tolist():
+        result[index] = round(amounts[index], 1)
+    return result
+
+
+def nutrition_rows(analyses: dict[int, tuple[int, dict, dict]]) -> dict[int, list[dict]]:
+    """Converts Edamam totalNutrients and totalDaily dictionaries, given as {recipe id: (servings,
+    totalNutrients, totalDaily)}, to per-serving Nutrition rows by recipe, rounding every amount in one pass"""
+
+    rows_by_recipe = {recipe_id: [] for recipe_id in analyses}
+    rows, nutrients, amounts = [], [], []
+    for recipe_id, (servings, nutrition_dict, daily_value_dict) in analyses.items():
+        servings = int(servings)
+        for nutrient, data in nutrition_dict.items():
+            if nutrient in NON_LABEL_NUTRIENTS:
+                continue
+            try:
+                dvp = int(daily_value_dict[nutrient].get("quantity", None))
+            except KeyError:
+                dvp = None
+            row = {"recipe_id": recipe_id, "nutrient": nutrient, "amount": None, "unit": data["unit"],
+                   "daily_value_percent": dvp}
+            rows_by_recipe[recipe_id].append(row)
+            rows.append(row)
+            nutrients.append(nutrient)
+            amounts.append(data["quantity"] / servings)
+
+    for row, amount in zip(rows, round_amounts(nutrients, amounts)):
+        row["amount"] = amount
+    return rows_by_recipe
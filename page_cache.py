@@ -0,0 +1,117 @@
+import sqlite3
+import time
+import zlib
+from contextlib import closing
+from threading import Lock
+from typing import Callable
+
+import requests
+
+from http_client import HttpClient
+
+
+class PageCache:
+    """On-disk cache of scraped pages, keyed by URL. Bodies are stored zlib-compressed with their
+    ETag/Last-Modified so stale pages are revalidated with a conditional GET instead of downloaded again.
+    Least recently used pages are evicted once the compressed bodies exceed max_bytes"""
+
+    def __init__(self, http_client: HttpClient, path: str, ttl: float, max_bytes: int):
+        self.http_client = http_client
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0, "evictions": 0}
+        self._stats_lock = Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "url TEXT PRIMARY KEY, body BLOB NOT NULL, size INTEGER NOT NULL, encoding TEXT, "
+                "etag TEXT, last_modified TEXT, fetched_at REAL NOT NULL, last_used_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS pages_last_used_at ON pages (last_used_at)")
+
+    def fetch(self, url: str, send: Callable[..., requests.Response] | None = None) -> str:
+        """Returns the page's HTML. Fresh cached pages never touch the network, stale ones are revalidated.
+        `send(url, headers=...)` makes the actual request, the shared HTTP client by default"""
+
+        send = send or self.http_client.get
+        now = time.time()
+        with closing(self._connect()) as conn:
+            entry = conn.execute(
+                "SELECT body, encoding, etag, last_modified, fetched_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if entry and now - entry[4] < self.ttl:
+            self._count("hits")
+            self._touch(url, now)
+            return self._decode(entry[0], entry[1])
+
+        headers = {}
+        if entry and entry[2]:
+            headers["If-None-Match"] = entry[2]
+        if entry and entry[3]:
+            headers["If-Modified-Since"] = entry[3]
+        response = send(url, headers=headers)
+        if entry and response.status_code == 304:
+            self._count("revalidated")
+            self._touch(url, now, refetched=True)
+            return self._decode(entry[0], entry[1])
+
+        response.raise_for_status()
+        self._count("misses")
+        self.store(url, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return response.text
+
+    def store(self, url: str, page_html: str, etag: str | None = None, last_modified: str | None = None):
+        body = zlib.compress(page_html.encode("utf-8"), 6)
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pages (url, body, size, encoding, etag, last_modified, fetched_at, last_used_at) "
+                "VALUES (?, ?, ?, 'utf-8', ?, ?, ?, ?)",
+                (url, body, len(body), etag, last_modified, now, now)
+            )
+        self.evict()
+
+    def evict(self):
+        """Drops least recently used pages until the cache is back under max_bytes"""
+
+        with closing(self._connect()) as conn, conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evicted = 0
+            for url, size in conn.execute("SELECT url, size FROM pages ORDER BY last_used_at").fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+                total -= size
+                evicted += 1
+        self._count("evictions", evicted)
+
+    def clear(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM pages")
+
+    def info(self) -> dict:
+        with closing(self._connect()) as conn:
+            pages, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+        with self._stats_lock:
+            return {"pages": pages, "bytes": size, **self.stats}
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _touch(self, url: str, now: float, refetched: bool = False):
+        with closing(self._connect()) as conn, conn:
+            if refetched:
+                conn.execute("UPDATE pages SET last_used_at = ?, fetched_at = ? WHERE url = ?", (now, now, url))
+            else:
+                conn.execute("UPDATE pages SET last_used_at = ? WHERE url = ?", (now, url))
+
+    def _count(self, stat: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[stat] += amount
+
+    @staticmethod
+    def _decode(body: bytes, encoding: str) -> str:
+        return zlib.decompress(body).decode(encoding)
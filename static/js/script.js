@@ -1,30 +1,69 @@
-document.querySelectorAll(".like-button").forEach((likeButton) => {
-  likeButton.addEventListener("click", function () {
-    const recipeId = this.getAttribute("data-recipe-id");
-
-    fetch(`/like/${recipeId}`, {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-        "X-CSRFToken": document
-          .querySelector('meta[name="csrf-token"]')
-          .getAttribute("content"),
-      },
-    })
-      .then((response) => response.json())
-      .then((data) => {
-        if (data.status === "liked") {
-          this.textContent = "🧡";
-        } else if (data.status === "unliked") {
-          this.textContent = "💛";
-        }
-        document.getElementById(`likes-count-${recipeId}`).textContent =
-          data.likes_count;
+function bindLikeButtons(root) {
+  root.querySelectorAll(".like-button").forEach((likeButton) => {
+    likeButton.addEventListener("click", function () {
+      const recipeId = this.getAttribute("data-recipe-id");
+
+      fetch(`/like/${recipeId}`, {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+          "X-CSRFToken": document
+            .querySelector('meta[name="csrf-token"]')
+            .getAttribute("content"),
+        },
       })
-      .catch((error) => console.error("Error:", error));
+        .then((response) => response.json())
+        .then((data) => {
+          if (data.status === "liked") {
+            this.textContent = "🧡";
+          } else if (data.status === "unliked") {
+            this.textContent = "💛";
+          }
+          document.getElementById(`likes-count-${recipeId}`).textContent =
+            data.likes_count;
+        })
+        .catch((error) => console.error("Error:", error));
+    });
+  });
+}
+
+bindLikeButtons(document);
+
+
+// Home feed infinite scroll: swap the pager for the next page of cards when it scrolls into view
+const feed = document.getElementById("feed");
+
+function loadMoreRecipes(pager) {
+  const loadMore = pager.querySelector("#load-more");
+  fetch(loadMore.getAttribute("data-next-url"))
+    .then((response) => response.text())
+    .then((html) => {
+      const page = document.createElement("div");
+      page.innerHTML = html;
+      bindLikeButtons(page);
+      pager.replaceWith(...page.childNodes);
+      observeFeedPager();
+    })
+    .catch((error) => console.error("Error:", error));
+}
+
+function observeFeedPager() {
+  const pager = feed.querySelector(".feed-pager");
+  if (!pager) {
+    return;
+  }
+  const observer = new IntersectionObserver((entries) => {
+    if (entries[0].isIntersecting) {
+      observer.disconnect();
+      loadMoreRecipes(pager);
+    }
   });
-});
+  observer.observe(pager);
+}
 
+if (feed && "IntersectionObserver" in window) {
+  observeFeedPager();
+}
 
 
 // Get slider and output elements
@@ -46,7 +85,11 @@ slider.oninput = function() {
   // Loop through each ingredient in the list
   ingredientsList.querySelectorAll("li").forEach((ingredientElement) => {
     const baseAmount = parseFloat(ingredientElement.getAttribute("data-amount"));
-    
+    // Ingredients without a quantity, like "salt to taste", stay as written
+    if (Number.isNaN(baseAmount)) {
+      return;
+    }
+
     // Recalculate the new amount based on the ratio of new servings to base servings
     const newAmount = (baseAmount / baseServings) * newServings;
 
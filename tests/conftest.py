@@ -0,0 +1,59 @@
+import os
+import tempfile
+from uuid import uuid4
+
+import pytest
+
+# main reads these at import time, so set them before any test imports it. The instance folder holds the
+# database and every on-disk cache, so the tests never touch instance/recipes.db
+os.environ["INSTANCE_PATH"] = tempfile.mkdtemp(prefix="recipes-test-")
+for name in ("GROQ_API_KEY", "SMTP_USERNAME", "SMTP_PASSWORD", "EDAMAM_API_KEY", "EDAMAM_APP_ID", "APP_SECRET_KEY"):
+    os.environ.setdefault(name, "test")
+
+
+@pytest.fixture(scope="session")
+def main():
+    import main
+    main.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return main
+
+
+@pytest.fixture
+def app_context(main):
+    with main.app.app_context():
+        yield
+        main.db.session.remove()
+
+
+@pytest.fixture
+def user(main, app_context):
+    user = main.User(email=f"{uuid4().hex}@example.com", password="x", name=uuid4().hex[:20])
+    main.db.session.add(user)
+    main.db.session.commit()
+    return user
+
+
+@pytest.fixture
+def make_recipe(main, user):
+    def make_recipe(**columns):
+        recipe = main.Recipe(**{
+            "title": f"Recipe {uuid4().hex[:12]}",
+            "ingredients": "<ul><li>1 cup rice</li><li>2 cloves garlic</li></ul>",
+            "instructions": "<ol><li>Cook the rice</li></ol>",
+            "default_servings": 2,
+            "author": user,
+            **columns,
+        })
+        main.db.session.add(recipe)
+        main.db.session.commit()
+        return recipe
+    return make_recipe
+
+
+@pytest.fixture
+def client(main, user):
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user.id)
+        session["_fresh"] = True
+    return client
@@ -0,0 +1,80 @@
+import json
+from threading import Barrier, Lock
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+
+RECIPE_JSON = json.dumps({"title": "Garlic Rice", "description": "Fluffy garlic rice.", "servings": 2,
+                          "ingredients": ["1 cup rice", "2 cloves garlic"], "instructions": ["Cook the rice."]})
+
+
+@pytest.fixture
+def groq(main, monkeypatch):
+    """Replaces the Groq client's JSON-mode completions: answers with .replies in order, then RECIPE_JSON.
+    Set .barrier to hold the completions until that many are in flight at once"""
+
+    class FakeCompletions:
+        replies = []
+        calls = []
+        lock = Lock()
+        barrier = None
+
+        def create(self, messages, **kwargs):
+            if self.barrier:
+                self.barrier.wait()
+            with self.lock:
+                self.calls.append(list(messages))
+                content = self.replies.pop(0) if self.replies else RECIPE_JSON
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                                   usage=SimpleNamespace(total_tokens=700))
+
+    completions = FakeCompletions()
+    monkeypatch.setattr(main.client, "chat", SimpleNamespace(completions=completions))
+    return completions
+
+
+def scheduler(main, monkeypatch, tmp_path, user_token_budget):
+    scheduler = main.CompletionScheduler(str(tmp_path / "llm_scheduler.db"), main.AI_MAX_IN_FLIGHT, main.AI_MAX_QUEUE,
+                                         main.AI_MAX_WAIT, main.AI_GLOBAL_TOKENS_PER_MINUTE, user_token_budget)
+    monkeypatch.setattr(main, "ai_scheduler", scheduler)
+    return scheduler
+
+
+def test_most_variations_of_the_longest_query_fit_the_user_budget(main, client, groq, monkeypatch, tmp_path):
+    scheduler(main, monkeypatch, tmp_path, main.AI_USER_TOKENS_PER_MINUTE)
+    query = f"garlic rice {uuid4().hex} ".ljust(500, "x")
+    # All of them reserved at once, as they are when Groq is slower than the scheduler
+    groq.barrier = Barrier(main.AI_MAX_VARIATIONS, timeout=5)
+
+    response = client.post("/ai-recipe", data={"query": query, "variations": main.AI_MAX_VARIATIONS,
+                                               "regenerate": "y"})
+
+    assert response.status_code == 200
+    assert len(groq.calls) == main.AI_MAX_VARIATIONS
+    assert "could be written" not in response.get_data(as_text=True)
+
+
+def test_estimate_counts_the_messages_actually_sent(main):
+    short = main.estimate_ai_tokens(main.ai_recipe_messages("rice"))
+    json_prompt = main.estimate_ai_tokens(main.ai_recipe_messages("rice", main.AI_RECIPE_JSON_PROMPT))
+
+    assert json_prompt - short == (len(main.AI_RECIPE_JSON_PROMPT) // 4 - len(main.AI_RECIPE_SYSTEM_PROMPT) // 4)
+    assert main.estimate_ai_tokens(main.ai_recipe_messages("rice"), "x" * 400) == short - main.AI_RECIPE_MAX_TOKENS + 100
+
+
+def test_repair_is_not_turned_away_by_its_own_first_attempt(main, app_context, groq, monkeypatch, tmp_path):
+    query = f"garlic rice {uuid4().hex}"
+    budget = main.estimate_ai_tokens(main.ai_recipe_messages(query, main.AI_RECIPE_JSON_PROMPT))
+    ai_scheduler = scheduler(main, monkeypatch, tmp_path, budget)
+    groq.replies = ['{"title": "Garlic Rice"}']
+    repaired = main.ai_structured_stats["repaired"]
+
+    recipe_json, recipe = main.generate_ai_recipe(query, "user:repair")
+
+    assert recipe["title"] == "Garlic Rice" and recipe_json == RECIPE_JSON
+    assert len(groq.calls) == 2 and "doesn't match" in groq.calls[1][-1]["content"]
+    assert main.ai_structured_stats["repaired"] == repaired + 1
+    info = ai_scheduler.info()
+    # Both attempts are charged, once
+    assert info["admitted"] == 1 and info["tokens_used"] == 1400 and info["in_flight"] == 0
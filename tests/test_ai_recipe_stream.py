@@ -0,0 +1,130 @@
+import json
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import func
+
+RECIPE_TOKENS = ["**Garlic ", "Rice**\n", "**Description:** Fluffy garlic rice.\n", "**Number of Servings:** 2\n",
+                 "**Ingredients:**\n- 1 cup rice\n- 2 cloves garlic\n", "**Instructions:**\n1. Cook the rice."]
+
+
+class FakeStream:
+    """Stands in for a streamed Groq completion: yields the tokens, then a usage chunk, optionally failing
+    after fail_after tokens"""
+
+    def __init__(self, tokens, fail_after=None, total_tokens=321):
+        self.tokens = tokens
+        self.fail_after = fail_after
+        self.total_tokens = total_tokens
+        self.sent = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.closed = True
+
+    def __iter__(self):
+        for token in self.tokens:
+            if self.sent == self.fail_after:
+                raise ConnectionError("Groq went away")
+            self.sent += 1
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))], x_groq=None)
+        yield SimpleNamespace(choices=[], x_groq=SimpleNamespace(usage=SimpleNamespace(total_tokens=self.total_tokens)))
+
+
+@pytest.fixture
+def groq(main, monkeypatch):
+    """Replaces the Groq client's completions with a FakeStream, set .stream to change it"""
+
+    class FakeCompletions:
+        stream = FakeStream(RECIPE_TOKENS)
+
+        def create(self, stream=False, **kwargs):
+            assert stream
+            return self.stream
+
+    completions = FakeCompletions()
+    monkeypatch.setattr(main.client, "chat", SimpleNamespace(completions=completions))
+    return completions
+
+
+@pytest.fixture
+def scheduler(main, monkeypatch, tmp_path):
+    scheduler = main.CompletionScheduler(str(tmp_path / "llm_scheduler.db"), 2, 0, 0, 100_000, 100_000)
+    monkeypatch.setattr(main, "ai_scheduler", scheduler)
+    return scheduler
+
+
+def parse_events(body):
+    events = []
+    for message in body.split("\n\n"):
+        if message:
+            event, data = message.split("\n")
+            events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def stream_recipe(main, **kwargs):
+    return main.app.test_client().post("/ai-recipe/stream", data={"query": f"garlic rice {uuid4().hex}",
+                                                                  "variations": 1, "regenerate": "y"}, **kwargs)
+
+
+def draft_count(main):
+    return main.db.session.execute(main.db.select(func.count()).select_from(main.AIRecipeDraft)).scalar()
+
+
+def test_tokens_are_framed_as_events_then_done(main, app_context, groq, scheduler):
+    drafts = draft_count(main)
+    response = stream_recipe(main)
+
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache"
+    events = parse_events(response.get_data(as_text=True))
+    # Newlines in the tokens stay inside their JSON-encoded data lines
+    assert events[:-1] == [("token", token) for token in RECIPE_TOKENS]
+    assert events[-1][0] == "done" and "<strong>Garlic Rice</strong>" in events[-1][1]
+    assert groq.stream.closed
+    assert draft_count(main) == drafts + 1
+    info = scheduler.info()
+    assert info["in_flight"] == 0 and info["tokens_used"] == 321
+
+
+def test_client_disconnect_closes_the_completion_and_frees_the_slot(main, app_context, groq, scheduler):
+    drafts = draft_count(main)
+    response = stream_recipe(main, buffered=False)
+    events = iter(response.response)
+    assert parse_events(next(events).decode()) == [("token", RECIPE_TOKENS[0])]
+
+    response.close()
+
+    assert groq.stream.closed and groq.stream.sent == 1
+    assert draft_count(main) == drafts
+    assert scheduler.info()["in_flight"] == 0
+
+
+def test_error_mid_stream_ends_with_an_error_event(main, app_context, groq, scheduler):
+    groq.stream = FakeStream(RECIPE_TOKENS, fail_after=2)
+    drafts = draft_count(main)
+
+    events = parse_events(stream_recipe(main).get_data(as_text=True))
+
+    assert [event for event, _ in events] == ["token", "token", "error"]
+    assert "something went wrong" in events[-1][1]
+    assert groq.stream.closed
+    assert draft_count(main) == drafts
+    info = scheduler.info()
+    # Charged an estimate for the partial recipe, since Groq never reported the usage
+    assert info["in_flight"] == 0 and 0 < info["tokens_used"] < main.estimate_ai_tokens(main.ai_recipe_messages("garlic rice"))
+
+
+def test_busy_scheduler_answers_before_the_stream_starts(main, app_context, groq, scheduler):
+    scheduler.user_token_budget = 1
+
+    response = stream_recipe(main)
+
+    assert response.status_code == 429 and response.mimetype == "application/json"
+    assert int(response.headers["Retry-After"]) >= 1
+    assert groq.stream.sent == 0
@@ -0,0 +1,172 @@
+from io import BytesIO
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import delete
+
+SITEMAP = '<?xml version="1.0"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{}</urlset>'
+SITEMAP_INDEX = '<?xml version="1.0"?><sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{}</sitemapindex>'
+
+
+def locs(*urls):
+    return "".join(f"<url><loc>{url}</loc></url>" for url in urls)
+
+
+@pytest.fixture
+def sitemaps(main, monkeypatch):
+    """Serves sitemaps from a dict instead of the network, remembering which URLs were fetched"""
+
+    class FakeResponse:
+        def __init__(self, text):
+            self.text = text
+
+        def raise_for_status(self):
+            pass
+
+    pages = {}
+    fetched = []
+
+    def get(url, **kwargs):
+        fetched.append(url)
+        return FakeResponse(pages[url])
+
+    monkeypatch.setattr(main.http_client, "get", get)
+    return pages, fetched
+
+
+@pytest.fixture
+def scraped(main, monkeypatch):
+    """Stands in for fetching and extracting recipe pages: maps URL to the extracted columns, or an exception"""
+
+    recipes = {}
+    monkeypatch.setattr(main.DomainThrottle, "fetch", lambda self, url: url)
+
+    def extract_recipe(site, url):
+        if isinstance(recipes[url], Exception):
+            raise recipes[url]
+        return recipes[url]
+
+    monkeypatch.setattr(main, "extract_recipe", extract_recipe)
+    return recipes
+
+
+def recipe_url():
+    return f"https://www.simplyrecipes.com/recipes/{uuid4().hex}/"
+
+
+def recipe_columns(**columns):
+    return {"title": f"Imported {uuid4().hex[:12]}", "ingredients": "<ul><li>1 cup oats</li></ul>",
+            "instructions": "<ol><li>Soak the oats</li></ol>", "default_servings": 2, **columns}
+
+
+def test_malformed_sitemap(main):
+    with pytest.raises(main.ImportSourceError, match="Not a valid sitemap"):
+        main.read_import_urls("<urlset><url>")
+
+
+def test_sitemap_index_is_only_followed_to_supported_sites(main, sitemaps):
+    pages, fetched = sitemaps
+    index = SITEMAP_INDEX.format(locs("http://169.254.169.254/latest/meta-data/",
+                                      "https://evil.com/?www.simplyrecipes.com"))
+
+    with pytest.raises(main.ImportSourceError, match="supported sites"):
+        main.read_import_urls(index)
+    assert fetched == []
+
+
+def test_sitemap_index_depth_is_limited(main, sitemaps):
+    pages, fetched = sitemaps
+    for depth in range(main.SITEMAP_MAX_DEPTH + 1):
+        pages[f"https://www.simplyrecipes.com/sitemap-{depth}.xml"] = SITEMAP_INDEX.format(
+            locs(f"https://www.simplyrecipes.com/sitemap-{depth + 1}.xml"))
+
+    with pytest.raises(main.ImportSourceError, match="nested"):
+        main.read_import_urls(pages["https://www.simplyrecipes.com/sitemap-0.xml"])
+    assert len(fetched) == main.SITEMAP_MAX_DEPTH
+
+
+def test_sitemap_index_loop_is_fetched_once(main, sitemaps):
+    pages, fetched = sitemaps
+    url = "https://www.simplyrecipes.com/sitemap.xml"
+    pages[url] = SITEMAP_INDEX.format(locs(url, "https://www.simplyrecipes.com/recipes.xml"))
+    pages["https://www.simplyrecipes.com/recipes.xml"] = SITEMAP.format(locs("https://www.simplyrecipes.com/a/"))
+
+    assert main.read_import_urls(SITEMAP_INDEX.format(locs(url))) == ["https://www.simplyrecipes.com/a/"]
+    assert fetched == [url, "https://www.simplyrecipes.com/recipes.xml"]
+
+
+def test_url_cap_stops_fetching(main, sitemaps):
+    pages, fetched = sitemaps
+    for part in range(3):
+        pages[f"https://www.simplyrecipes.com/sitemap-{part}.xml"] = SITEMAP.format(
+            locs(*(f"https://www.simplyrecipes.com/{part}/{i}/" for i in range(3))))
+    index = SITEMAP_INDEX.format(locs(*pages))
+
+    with pytest.raises(main.ImportSourceError, match="at most 4"):
+        main.read_import_urls(index, max_urls=4)
+    assert len(fetched) == 2
+    with pytest.raises(main.ImportSourceError, match="at most 2"):
+        main.read_import_urls("\n".join(["https://www.simplyrecipes.com/a/"] * 3), max_urls=2)
+
+
+def test_recipe_that_cant_be_saved_only_fails_its_own_url(main, user, scraped):
+    good, bad, broken = recipe_url(), recipe_url(), recipe_url()
+    scraped[good] = recipe_columns()
+    scraped[bad] = recipe_columns(default_servings=None)
+    scraped[broken] = main.ExtractionError("Couldn't find a recipe")
+
+    report = main.import_recipes([good, bad, broken, "https://example.com/recipe"], user, concurrency=1)
+
+    assert report.imported == [good]
+    assert set(report.errors) == {bad, broken} and "NOT NULL" in report.errors[bad]
+    assert report.unsupported == ["https://example.com/recipe"]
+    assert main.db.session.execute(
+        main.db.select(main.Recipe.title).where(main.Recipe.title == scraped[good]["title"])
+    ).scalar() is not None
+    assert main.db.session.execute(
+        main.db.select(main.Recipe.id).where(main.Recipe.title == scraped[bad]["title"])
+    ).scalar() is None
+
+
+def test_bulk_import_runs_on_the_job_queue(main, client, user, scraped):
+    main.db.session.execute(delete(main.ImportJob))
+    main.db.session.commit()
+    url = recipe_url()
+    scraped[url] = recipe_columns()
+
+    response = client.post("/recipe-saver/bulk", data={"urls_file": (BytesIO(url.encode()), "urls.txt")})
+    assert response.status_code == 302
+    status_url = response.headers["Location"]
+    assert "being imported" in client.get(status_url).get_data(as_text=True)
+
+    main.run_import_job(*main.claim_import_job())
+    assert main.claim_import_job() is None
+    page = client.get(status_url).get_data(as_text=True)
+    assert f"Imported {url}" in page and "1 imported" in page
+
+
+def test_unreadable_import_source_fails_the_job(main, user, app_context):
+    main.db.session.execute(delete(main.ImportJob))
+    main.db.session.commit()
+    job = main.enqueue_import(user, "<urlset><url>")
+
+    main.run_import_job(*main.claim_import_job())
+
+    main.db.session.refresh(job)
+    assert job.status == "failed" and "Not a valid sitemap" in job.last_error and job.report is None
+
+
+@pytest.mark.parametrize("delay", [0, 0.5])
+def test_throttle_only_spaces_requests_with_a_delay(main, sitemaps, delay):
+    pages, fetched = sitemaps
+    pages["https://example.com/a"] = "a"
+    throttle = main.DomainThrottle(concurrency=1, delay=delay)
+
+    assert throttle.get("https://example.com/a").text == "a"
+    assert (throttle.domains["example.com"][1] is None) == (delay == 0)
+
+
+def test_negative_import_delay_is_refused(main):
+    result = main.app.test_cli_runner().invoke(args=["import-recipes", "urls.txt", "--author", "x", "--delay", "-1"])
+
+    assert result.exit_code == 2 and "--delay" in result.output
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import pytest
+
+from extractors import ExtractionError, extract_recipe, recipe_from_json_ld
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def fixture(name):
+    return (FIXTURES / name).read_text(encoding="utf-8")
+
+
+def test_json_ld_recipe_in_a_graph():
+    recipe = extract_recipe("simplyrecipes", fixture("json_ld_graph.html"))
+
+    assert recipe["title"] == "Buttermilk Pancakes"
+    assert recipe["description"] == "Fluffy buttermilk pancakes & syrup."
+    assert recipe["ingredients"] == [
+        {"amount": "2", "unit": "cups", "ingredient": "all-purpose flour"},
+        {"amount": "1 1/2", "unit": "cups", "ingredient": "buttermilk"},
+        {"amount": "2", "unit": "large", "ingredient": "eggs"},
+        {"amount": "", "unit": "", "ingredient": "salt"},
+    ]
+    assert recipe["instructions"] == ("<ol> <li>Whisk the flour and salt.</li> <li>Stir in the buttermilk and eggs."
+                                      "</li> <li>Cook on a hot griddle.</li> </ol>")
+    assert recipe["default_servings"] == 4
+    assert recipe["time_to_cook"] == "1 hr 15 mins"
+    assert recipe["image_url"] == "https://www.simplyrecipes.com/pancakes.jpg"
+
+
+def test_json_ld_values_of_the_wrong_type_count_as_missing():
+    recipe = recipe_from_json_ld(fixture("json_ld_wrong_types.html"))
+
+    assert recipe["title"] == "" and recipe["description"] == "" and recipe["ingredients"] == []
+    assert recipe["time_to_cook"] is None and recipe["image_url"] is None
+    assert recipe["instructions"] == "<ol> <li>Simmer the tomatoes.</li> </ol>"
+
+
+def test_json_ld_with_the_wrong_types_is_an_extraction_error():
+    with pytest.raises(ExtractionError):
+        extract_recipe("seriouseats", fixture("json_ld_wrong_types.html"))
+
+
+def test_page_without_a_recipe_is_an_extraction_error():
+    assert recipe_from_json_ld(fixture("no_recipe.html")) is None
+    with pytest.raises(ExtractionError):
+        extract_recipe("foodnetwork", fixture("no_recipe.html"))
+
+
+def test_unsupported_site_is_an_extraction_error():
+    with pytest.raises(ExtractionError, match="not been integrated"):
+        extract_recipe("example", fixture("json_ld_graph.html"))
+
+
+def test_allrecipes_fallback():
+    recipe = extract_recipe("allrecipes", fixture("allrecipes.html"))
+
+    assert recipe["title"] == "Classic Meatloaf"
+    assert recipe["ingredients"][0] == {"amount": "1 1/2", "unit": "pounds", "ingredient": "ground beef"}
+    assert recipe["instructions"] == "<ol> <li>Mix everything together.</li> <li>Bake for an hour.</li> </ol>"
+    assert recipe["default_servings"] == 8
+    assert recipe["time_to_cook"] == "1 hr 20 mins"
+
+
+def test_allrecipes_fallback_without_servings_is_an_extraction_error():
+    with pytest.raises(ExtractionError, match="default_servings"):
+        extract_recipe("allrecipes", fixture("allrecipes_no_servings.html"))
+
+
+def test_allrecipes_page_of_another_layout_is_an_extraction_error():
+    with pytest.raises(ExtractionError):
+        extract_recipe("allrecipes", fixture("no_recipe.html"))
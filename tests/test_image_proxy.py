@@ -0,0 +1,119 @@
+import io
+import socket
+
+import pytest
+import requests
+
+from http_client import HostHeaderAdapter
+from image_proxy import ImageProxy, ImageProxyError
+from images import Image
+
+PUBLIC = "http://93.184.216.34"
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 20), "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FakeHttpClient:
+    """Answers from a dict of URL -> (status, headers, body), recording every request"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        self.requests.append((url, kwargs))
+        status, headers, body = self.pages[url]
+        response = requests.Response()
+        response.status_code, response.url = status, url
+        response.headers.update(headers)
+        response.raw = io.BytesIO(body)
+        return response
+
+
+def redirect(location):
+    return 302, {"Location": location}, b""
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    def proxy(pages, **options):
+        return ImageProxy(FakeHttpClient(pages), str(tmp_path), max_bytes=10 * 1024 * 1024, **options)
+    return proxy
+
+
+@pytest.mark.skipif(Image is None, reason="Pillow isn't installed")
+def test_redirects_to_public_hosts_are_followed(proxy):
+    image_proxy = proxy({
+        f"{PUBLIC}/a.png": redirect("/b.png"),
+        f"{PUBLIC}/b.png": (200, {"Content-Type": "image/png"}, png_bytes()),
+    })
+
+    image_proxy.variant(f"{PUBLIC}/a.png", 320, "jpg")
+
+    assert [url for url, _ in image_proxy.http_client.requests] == [f"{PUBLIC}/a.png", f"{PUBLIC}/b.png"]
+    assert all(kwargs["allow_redirects"] is False for _, kwargs in image_proxy.http_client.requests)
+    # Nothing left behind once the download is done
+    assert image_proxy._url_locks == {}
+
+
+@pytest.mark.parametrize("location", ["http://127.0.0.1/admin", "http://169.254.169.254/latest/meta-data/",
+                                      "file:///etc/passwd"])
+def test_redirect_to_a_private_host_is_refused(proxy, location):
+    image_proxy = proxy({f"{PUBLIC}/a.png": redirect(location)})
+
+    with pytest.raises(ImageProxyError):
+        image_proxy.variant(f"{PUBLIC}/a.png", 320, "jpg")
+    assert [url for url, _ in image_proxy.http_client.requests] == [f"{PUBLIC}/a.png"]
+    assert image_proxy._url_locks == {}
+
+
+def test_redirects_are_limited(proxy):
+    image_proxy = proxy({f"{PUBLIC}/{hop}.png": redirect(f"/{hop + 1}.png") for hop in range(10)}, max_redirects=3)
+
+    with pytest.raises(ImageProxyError, match="redirects"):
+        image_proxy.variant(f"{PUBLIC}/0.png", 320, "jpg")
+    assert len(image_proxy.http_client.requests) == 4
+
+
+@pytest.fixture
+def dns(monkeypatch):
+    """Resolves hostnames from a dict of hostname -> list of answers, each lookup taking the next answer"""
+
+    answers = {}
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (answers[host].pop(0), port))]
+
+    monkeypatch.setattr("image_proxy.socket.getaddrinfo", getaddrinfo)
+    return answers
+
+
+def test_download_connects_to_the_address_that_was_checked(proxy, dns):
+    # Rebinding: the second lookup, the one the connection would make, points at the server itself
+    dns["images.example"] = ["93.184.216.34", "127.0.0.1"]
+    dns["cdn.example"] = ["93.184.216.35", "127.0.0.1"]
+    image_proxy = proxy({
+        "http://93.184.216.34/a.png": redirect("https://cdn.example:8443/b.png"),
+        "https://93.184.216.35:8443/b.png": (200, {"Content-Type": "text/html"}, b""),
+    })
+
+    with pytest.raises(ImageProxyError, match="isn't an image"):
+        image_proxy.variant("http://images.example/a.png", 320, "jpg")
+
+    assert [(url, kwargs["headers"]) for url, kwargs in image_proxy.http_client.requests] == [
+        ("http://93.184.216.34/a.png", {"Host": "images.example"}),
+        ("https://93.184.216.35:8443/b.png", {"Host": "cdn.example:8443"}),
+    ]
+
+
+def test_tls_is_checked_against_the_host_header():
+    request = requests.Request("GET", "https://93.184.216.35:8443/b.png", headers={"Host": "cdn.example:8443"})
+
+    host_params, pool_kwargs = HostHeaderAdapter().build_connection_pool_key_attributes(request.prepare(), True)
+
+    assert host_params["host"] == "93.184.216.35"
+    assert pool_kwargs["server_hostname"] == pool_kwargs["assert_hostname"] == "cdn.example"
@@ -0,0 +1,58 @@
+import io
+import os
+import time
+from uuid import uuid4
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from images import derivative_path, store_image
+
+
+@pytest.fixture
+def photos(main, app_context, monkeypatch, tmp_path):
+    """Stores uploads under a throwaway static folder, returning their paths relative to it"""
+
+    monkeypatch.setattr(main.app, "static_folder", str(tmp_path))
+    folder = tmp_path / "images" / "recipes"
+    folder.mkdir(parents=True)
+
+    def store(data):
+        return "images/recipes/" + store_image(FileStorage(io.BytesIO(data), "photo.jpg"), str(folder))
+    return store
+
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_unused_photo_is_deleted_with_its_derivatives(main, tmp_path, photos):
+    filepath = photos(uuid4().bytes)
+    derivative = tmp_path / derivative_path(filepath, 320, "webp")
+    derivative.write_bytes(b"webp")
+    age(tmp_path / filepath, main.IMAGE_RELEASE_MIN_AGE + 1)
+
+    assert main.release_image(filepath)
+    assert not (tmp_path / filepath).exists() and not derivative.exists()
+
+
+def test_photo_stored_again_is_kept_for_the_upload_using_it(main, tmp_path, photos):
+    data = uuid4().bytes
+    filepath = photos(data)
+    (tmp_path / filepath).write_bytes(b"processed")
+    age(tmp_path / filepath, main.IMAGE_RELEASE_MIN_AGE + 1)
+
+    # An identical upload lands while the last row using the photo is being deleted
+    assert photos(data) == filepath
+    assert not main.release_image(filepath)
+    # Touched, not overwritten with the unprocessed upload
+    assert (tmp_path / filepath).read_bytes() == b"processed"
+
+
+def test_referenced_photo_is_kept(main, tmp_path, photos, make_recipe):
+    filepath = photos(uuid4().bytes)
+    make_recipe(image_filepath=filepath)
+
+    assert not main.release_image(filepath, min_age=0)
+    assert (tmp_path / filepath).exists()
@@ -0,0 +1,79 @@
+import time
+from threading import Timer
+
+import pytest
+
+from llm_scheduler import CompletionScheduler, SchedulerBusy
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two schedulers on the same file, as two gunicorn workers would have"""
+
+    def scheduler(**options):
+        return CompletionScheduler(str(tmp_path / "llm_scheduler.db"), **{
+            "max_in_flight": 2, "max_queue": 0, "max_wait": 0,
+            "global_token_budget": 1000, "user_token_budget": 600, **options,
+        })
+    return scheduler(), scheduler()
+
+
+def test_concurrency_limit_is_shared(workers):
+    first, second = workers
+    tickets = [first.acquire("a", 10), second.acquire("b", 10)]
+
+    with pytest.raises(SchedulerBusy):
+        first.acquire("c", 10)
+    assert first.info()["in_flight"] == second.info()["in_flight"] == 2
+
+    tickets[1].release()
+    second.acquire("c", 10).release()
+    assert first.info()["rejected_queue_full"] == 1
+
+
+def test_token_budgets_are_shared(workers):
+    first, second = workers
+    first.acquire("a", 500).release(400)
+
+    # 400 + 300 is over the user budget of 600, whichever worker asks
+    with pytest.raises(SchedulerBusy) as busy:
+        second.acquire("a", 300)
+    assert 1 <= busy.value.retry_after <= 60
+    second.acquire("b", 500).release()
+    # 400 + 500 + 200 is over the global budget of 1000
+    with pytest.raises(SchedulerBusy):
+        first.acquire("c", 200)
+    assert first.info()["tokens_in_window"] == second.info()["tokens_in_window"] == 900
+
+
+def test_rejected_requests_give_back_their_reservation(workers):
+    first, second = workers
+    held = [first.acquire("a", 100), first.acquire("a", 100)]
+
+    with pytest.raises(SchedulerBusy):
+        second.acquire("a", 100)
+    assert second.info()["tokens_in_window"] == 200
+
+    for ticket in held:
+        ticket.release()
+
+
+def test_waiter_gets_a_slot_freed_by_another_worker(tmp_path):
+    path = str(tmp_path / "llm_scheduler.db")
+    first = CompletionScheduler(path, 1, 1, 5, 1000, 1000)
+    second = CompletionScheduler(path, 1, 1, 5, 1000, 1000)
+    ticket = first.acquire("a", 10)
+
+    Timer(0.2, ticket.release).start()
+    started = time.monotonic()
+    second.acquire("b", 10).release()
+
+    assert 0.1 < time.monotonic() - started < 2
+
+
+def test_slot_of_a_dead_worker_is_given_back(tmp_path):
+    path = str(tmp_path / "llm_scheduler.db")
+    CompletionScheduler(path, 1, 0, 0, 1000, 1000, slot_lease=0.1).acquire("a", 10)
+
+    time.sleep(0.2)
+    CompletionScheduler(path, 1, 0, 0, 1000, 1000, slot_lease=0.1).acquire("b", 10)
@@ -0,0 +1,21 @@
+import pytest
+
+
+@pytest.fixture
+def metrics_token(main, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", "s3cret")
+    return "s3cret"
+
+
+def test_metrics_need_the_token_even_from_localhost(client, metrics_token):
+    assert client.get("/metrics").status_code == 404
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 404
+
+    response = client.get("/metrics", headers={"Authorization": f"Bearer {metrics_token}"})
+    assert response.status_code == 200
+    assert "http" in response.get_json()
+
+
+def test_metrics_are_disabled_without_a_token(main, client, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", "")
+    assert client.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 404
@@ -0,0 +1,132 @@
+import math
+import random
+
+import pytest
+
+import nutrition
+from nutrition import ROUNDING_RULES, nutrition_rows, round_amount, round_amounts
+
+
+def legacy_nutrition_rows(recipe_id: int, servings: int, nutrition_dict: dict, daily_value_dict: dict) -> list[dict]:
+    """The if/elif rounding nutrition_rows() replaced, kept verbatim as the reference it has to agree with"""
+
+    non_label = ["CHOCDF.net", "WATER", "MG", "ZN", "P", "VITA_RAE", "VITC", "THIA", "RIBF",
+                 "NIA", "VITB6A", "FOLDFE", "FOLFD", "FOLAC", "VITB12", "TOCPHA", "VITK1"]
+
+    rows = []
+    for nutrient, data in nutrition_dict.items():
+        if nutrient not in non_label:
+
+            amount = data["quantity"]/int(servings)
+
+            if nutrient in ["ENERC_KCAL"]:
+                if amount < 5:
+                    amount = 0
+                elif 5 <= amount <= 50:
+                    amount = 5 * round(amount / 5)
+                else:
+                    amount = 10 * round(amount / 10)
+            elif nutrient in ["FAT", "FASAT", "FATRN", "FAMS", "FAPU"]:
+                if amount < 0.5:
+                    amount = 0
+                elif 0.5 <= amount < 5:
+                    amount = round(amount * 2) / 2
+                else:
+                    amount = round(amount)
+            elif nutrient in ["CHOLE"]:
+                if amount < 2:
+                    amount = 0
+                elif 2 <= amount <= 5:
+                    amount = round(amount)
+                else:
+                    amount = 5 * round(amount / 5)
+            elif nutrient in ["NA", "K"]:
+                if amount < 5:
+                    amount = 0
+                elif 5 <= amount <= 140:
+                    amount = 5 * round(amount / 5)
+                else:
+                    amount = 10 * round(amount / 10)
+            elif nutrient in ["CHOCDF", "FIBTG", "SUGAR"]:
+                if amount < 0.5:
+                    amount = 0
+                elif 0.5 <= amount < 1:
+                    amount = round(amount, 1)
+                else:
+                    amount = round(amount)
+            elif nutrient in ["PROCNT"]:
+                if amount < 0.5:
+                    amount = 0
+                else:
+                    amount = round(amount)
+            elif nutrient in ["FE", "VITD"]:
+                amount = round(amount, 1)
+            elif nutrient in ["CA"]:
+                amount = 10 * round(amount / 10)
+
+            try:
+                dvp = int(daily_value_dict[nutrient].get("quantity", None))
+            except KeyError:
+                dvp = None
+
+            rows.append({
+                "recipe_id": recipe_id,
+                "nutrient": nutrient,
+                "amount": amount,
+                "unit": data["unit"],
+                "daily_value_percent": dvp
+            })
+
+    return rows
+
+
+# Every ruled nutrient, one stored as computed and one that's never stored
+NUTRIENTS = [*ROUNDING_RULES, "SUGAR.added", "WATER"]
+SERVINGS = (1, 3, 4, 7)
+
+
+def per_serving_amounts() -> list[float]:
+    """Amounts on a fine grid (which lands exactly on every bound and on the halves between steps), just either
+    side of every bound, on the tenths' halves where binary floats round either way, and random ones"""
+
+    amounts = [i / 40 for i in range(8000)] + [i / 1000 for i in range(2000)]
+    for rule in ROUNDING_RULES.values():
+        for below, _ in rule[:-1]:
+            amounts += [below, math.nextafter(below, 0), math.nextafter(below, math.inf)]
+    amounts += [tenth / 100 + offset for tenth in range(5, 2000, 10) for offset in (-1e-12, 0, 1e-12)]
+    rng = random.Random(24)
+    amounts += [rng.uniform(0, 2000) for _ in range(2000)] + [rng.uniform(0, 10) for _ in range(2000)]
+    return amounts
+
+
+@pytest.fixture(params=["numpy", "python"])
+def rounding_path(request, monkeypatch):
+    if request.param == "numpy" and nutrition.np is None:
+        pytest.skip("NumPy isn't installed")
+    if request.param == "python":
+        monkeypatch.setattr(nutrition, "np", None)
+    return request.param
+
+
+def test_nutrition_rows_agree_with_the_legacy_rounding(rounding_path):
+    analyses = {}
+    for recipe_id, amount in enumerate(per_serving_amounts()):
+        servings = SERVINGS[recipe_id % len(SERVINGS)]
+        analyses[recipe_id] = (
+            servings,
+            {nutrient: {"quantity": amount * servings, "unit": "g"} for nutrient in NUTRIENTS},
+            {nutrient: {"quantity": amount * 3.7} for nutrient in NUTRIENTS[::2]},
+        )
+
+    rows = nutrition_rows(analyses)
+
+    for recipe_id, (servings, nutrition_dict, daily_value_dict) in analyses.items():
+        assert rows[recipe_id] == legacy_nutrition_rows(recipe_id, servings, nutrition_dict, daily_value_dict)
+
+
+def test_round_amounts_agrees_with_round_amount(rounding_path):
+    amounts = per_serving_amounts()
+    nutrients = [NUTRIENTS[index % len(NUTRIENTS)] for index in range(len(amounts))]
+
+    assert round_amounts(nutrients, amounts) == [round_amount(nutrient, amount)
+                                                 for nutrient, amount in zip(nutrients, amounts)]
@@ -0,0 +1,123 @@
+import time
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import delete
+
+EDAMAM_RESPONSE = {
+    "totalNutrients": {"ENERC_KCAL": {"quantity": 1234.0, "unit": "kcal"}, "PROCNT": {"quantity": 41.0, "unit": "g"}},
+    "totalDaily": {"PROCNT": {"quantity": 82.0}},
+}
+
+
+@pytest.fixture
+def empty_queue(main, app_context):
+    main.db.session.execute(delete(main.NutritionJob))
+    main.db.session.commit()
+
+
+@pytest.fixture
+def edamam(main, monkeypatch):
+    """Stands in for the Edamam API: set .failures to fail that many calls first"""
+
+    class FakeEdamam:
+        calls = 0
+        failures = 0
+
+        def __call__(self, title, ingredients):
+            self.calls += 1
+            if self.calls <= self.failures:
+                raise RuntimeError("Edamam is down")
+            return EDAMAM_RESPONSE
+
+    fake = FakeEdamam()
+    monkeypatch.setattr(main, "edamam_nutrition_analysis", fake)
+    return fake
+
+
+@pytest.fixture
+def queued_recipe(main, make_recipe, empty_queue):
+    # Unique ingredients, so the analysis isn't served from an earlier test's Edamam cache entry
+    recipe = make_recipe(ingredients=f"<ul><li>1 cup rice {uuid4().hex}</li></ul>")
+    main.enqueue_nutrition(recipe)
+    return recipe
+
+
+def job_for(main, recipe):
+    return main.db.session.execute(
+        main.db.select(main.NutritionJob).where(main.NutritionJob.recipe_id == recipe.id)
+    ).scalar_one()
+
+
+def test_claimed_job_is_not_claimed_twice(main, queued_recipe):
+    job_id, recipe_id, attempts = main.claim_nutrition_job()
+
+    assert (recipe_id, attempts) == (queued_recipe.id, 1)
+    assert main.claim_nutrition_job() is None
+    assert main.nutrition_job_status(queued_recipe.id) == "pending"
+
+
+def test_completed_job_writes_nutrition(main, queued_recipe, edamam):
+    version = queued_recipe.version
+    main.run_nutrition_job(*main.claim_nutrition_job())
+
+    job = job_for(main, queued_recipe)
+    main.db.session.refresh(queued_recipe)
+    assert job.status == "done" and job.last_error is None and job.locked_at is None
+    assert main.nutrition_job_status(queued_recipe.id) is None
+    # Per serving (2) and rounded to the label rules
+    assert main.NutritionFacts.for_recipe(queued_recipe).kcal.amount == 620
+    assert main.NutritionFacts.for_recipe(queued_recipe).protein.daily_value_percent == 82
+    assert queued_recipe.nutrition_version == main.NUTRITION_RULES_VERSION
+    assert queued_recipe.version > version
+
+
+def test_failed_job_is_retried_with_backoff(main, queued_recipe, edamam):
+    edamam.failures = 1
+    main.run_nutrition_job(*main.claim_nutrition_job())
+
+    job = job_for(main, queued_recipe)
+    assert job.status == "pending" and job.attempts == 1 and "Edamam is down" in job.last_error
+    assert job.run_after >= time.time() + main.NUTRITION_JOB_BACKOFF * 0.9
+    # Not due yet
+    assert main.claim_nutrition_job() is None
+
+    job.run_after = time.time()
+    main.db.session.commit()
+    main.run_nutrition_job(*main.claim_nutrition_job())
+    main.db.session.refresh(job)
+    assert (job.status, job.attempts, job.last_error) == ("done", 2, None)
+
+
+def test_job_fails_after_max_attempts(main, queued_recipe, edamam):
+    edamam.failures = main.NUTRITION_JOB_MAX_ATTEMPTS
+    for _ in range(main.NUTRITION_JOB_MAX_ATTEMPTS):
+        main.run_nutrition_job(*main.claim_nutrition_job())
+        job = job_for(main, queued_recipe)
+        job.run_after = time.time()
+        main.db.session.commit()
+
+    assert job.status == "failed" and job.attempts == main.NUTRITION_JOB_MAX_ATTEMPTS
+    assert main.claim_nutrition_job() is None
+    assert main.nutrition_job_status(queued_recipe.id) == "failed"
+
+
+def test_job_left_running_by_dead_worker_is_reclaimed(main, queued_recipe):
+    job_id, _, _ = main.claim_nutrition_job()
+    job = job_for(main, queued_recipe)
+    job.locked_at = time.time() - main.NUTRITION_JOB_LEASE - 1
+    main.db.session.commit()
+
+    assert main.claim_nutrition_job() == (job_id, queued_recipe.id, 2)
+
+
+def test_enqueue_reschedules_a_pending_job(main, queued_recipe):
+    job = job_for(main, queued_recipe)
+    job.run_after = time.time() + 3600
+    job.attempts = 3
+    main.db.session.commit()
+
+    main.enqueue_nutrition(queued_recipe)
+
+    main.db.session.refresh(job)
+    assert job.attempts == 0 and job.run_after <= time.time()
@@ -0,0 +1,53 @@
+from uuid import uuid4
+
+import pytest
+
+
+@pytest.fixture
+def synced(main, app_context, monkeypatch):
+    """Syncs the pantry index, recording the ids of the recipes it re-read"""
+
+    main.sync_pantry_index()
+    updated = []
+    update = main.pantry_index.update
+
+    def record(recipe_id, names):
+        updated.append(recipe_id)
+        update(recipe_id, names)
+
+    monkeypatch.setattr(main.pantry_index, "update", record)
+    return updated
+
+
+def test_new_and_edited_recipes_are_synced(main, make_recipe, synced):
+    # Letters only, canonical names drop digits
+    ingredient = "quince" + uuid4().hex[:8].translate(str.maketrans("0123456789", "ghijklmnop"))
+    recipe = make_recipe(ingredients=f"<ul><li>1 cup rice</li><li>2 {ingredient}</li></ul>")
+
+    main.sync_pantry_index()
+    assert recipe.id in synced
+    assert [match.recipe_id for match in main.pantry_index.match([ingredient])] == [recipe.id]
+
+    synced.clear()
+    recipe.ingredients = "<ul><li>1 cup rice</li></ul>"
+    main.db.session.commit()
+    main.sync_pantry_index()
+    assert synced == [recipe.id]
+    assert main.pantry_index.match([ingredient]) == []
+
+
+def test_likes_comments_and_nutrition_dont_resync_a_recipe(main, make_recipe, synced):
+    recipe = make_recipe()
+    main.sync_pantry_index()
+    ingredients_version = recipe.ingredients_version
+
+    synced.clear()
+    main.bump_versions(main.Recipe, recipe.id)
+    main.db.session.commit()
+    recipe.title = f"Renamed {uuid4().hex[:12]}"
+    main.db.session.commit()
+    main.sync_pantry_index()
+
+    main.db.session.refresh(recipe)
+    assert recipe.ingredients_version == ingredients_version
+    assert recipe.id not in synced
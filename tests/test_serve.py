@@ -0,0 +1,12 @@
+def test_app_routes_fall_back_to_the_index(main):
+    response = main.app.test_client().get("/planner/week")
+
+    assert response.status_code == 200 and response.mimetype == "text/html"
+
+
+def test_missing_files_are_not_found(main):
+    client = main.app.test_client()
+
+    assert client.get("/vite.svg").status_code == 200
+    assert client.get("/missing.js").status_code == 404
+    assert client.get("/assets/favicon.png").status_code == 404